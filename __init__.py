@@ -1,3 +1,3 @@
-import fyyur_01.config
-from fyyur_01.app import app, db
-import fyyur_01.routes
\ No newline at end of file
+# The flask command and WSGI servers build the app with create_app(); the
+# views and commands are only imported then
+from fyyur_01.app import db, create_app
@@ -0,0 +1,207 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, show_listing
+from fyyur_01.discovery import ShowFacetCount
+from fyyur_01.deletion import Deletion
+from fyyur_01.payloads import (
+  timeline_args, show_listing_args, discovery_args, venues_data, venue_data, artists_data, artist_data, search_data,
+  shows_data, discover_data, free_slots_args, free_slots_data, matching_args, matches_data
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from flask import request
+from datetime import datetime
+from functools import wraps
+import hashlib
+import json
+import time
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+#----------------------------------------------------------------------------#
+# JSON API.
+#----------------------------------------------------------------------------#
+
+API_PREFIX = '/api/v1'
+
+
+def dumps(payload):
+  if orjson is not None:
+    return orjson.dumps(payload)
+  return json.dumps(payload, default=lambda value: value.isoformat(), separators=(',', ':')).encode()
+
+
+def _stamp(model, *criteria, join=None):
+  # (row count, latest updated_at) of the rows a payload is built from
+  query = db.session.query(db.func.count(model.id), db.func.max(model.updated_at))
+  if join is not None:
+    query = query.join(*join)
+  return query.filter(*criteria).subquery()
+
+
+def _started(*criteria):
+  # When the latest of these shows started: shows move from upcoming to
+  # past then, without any row changing
+  return db.session.query(db.func.max(Show.start_time).label('started')).\
+    filter(Show.start_time <= datetime.utcnow(), *criteria).subquery()
+
+
+def _deleted():
+  # Deleting or restoring a venue or artist hides or shows it, and its
+  # shows, without updating them: the deletion is updated instead
+  return db.session.query(db.func.max(Deletion.updated_at).label('deleted')).subquery()
+
+
+def _shows_refreshed():
+  # Stamping every show would cost more than most payloads: the facets
+  # table is rebuilt whenever shows change, so its refresh time stands in
+  # for them. Without the table, they are stamped.
+  if not app.config['SHOW_FACETS_TABLE']:
+    return _stamp(Show), _started()
+  return db.session.query(db.func.max(ShowFacetCount.refreshed_at).label('refreshed')).subquery(), _started()
+
+
+def not_modified(etag, last_modified):
+  """Whether the request's If-None-Match, or without one its
+  If-Modified-Since, says the client has this version."""
+  if request.if_none_match:
+    return request.if_none_match.contains(etag)
+  return bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since.replace(tzinfo=None))
+
+
+def api_route(rule, stamps, last_modified=True):
+  """Register a GET JSON endpoint answering conditional requests.
+
+  `stamps(**view_args)` returns subqueries describing the rows behind the
+  payload; they are read in one query and hashed, with the URL, into a
+  strong ETag. When If-None-Match or If-Modified-Since match, the view is
+  not called and 304 is returned.
+
+  Last-Modified is the latest time among the stamps and the latest
+  deletion, so it moves when rows leave the payload too. Payloads that
+  also change with the clock (a period in their stamps) pass
+  `last_modified=False` and only get an ETag.
+  """
+  def decorator(view):
+    @wraps(view)
+    def wrapper(**kwargs):
+      row = db.session.query(*stamps(**kwargs), _deleted()).one()
+      etag = hashlib.sha1(repr((request.full_path, tuple(row))).encode()).hexdigest()
+      updated = [value for value in row if isinstance(value, datetime)]
+      modified = max(updated).replace(microsecond=0) if updated and last_modified else None
+
+      response = app.response_class(mimetype='application/json')
+      response.set_etag(etag)
+      response.last_modified = modified
+      if not_modified(etag, modified):
+        response.status_code = 304
+        return response
+
+      response.set_data(dumps(view(**kwargs)))
+      return response
+    return app.route(API_PREFIX + rule, endpoint='api_' + view.__name__)(wrapper)
+  return decorator
+
+
+#  Venues
+#  ----------------------------------------------------------------
+@api_route('/venues', lambda: (_stamp(Venue), *_shows_refreshed()))
+def venues():
+  return venues_data(request.args.get('page', type=int))
+
+
+@api_route('/venues/search', lambda: (_stamp(Venue), *_shows_refreshed()))
+def search_venues():
+  return search_data(Venue, request.args.get('q', ''), request.args.get('page', 1, type=int))
+
+
+@api_route('/venues/<int:venue_id>', lambda venue_id: (
+  _stamp(Venue, Venue.id == venue_id),
+  _stamp(Show, Show.venue_id == venue_id),
+  _stamp(Artist, Show.venue_id == venue_id, join=(Show, Show.artist_id == Artist.id)),
+  _started(Show.venue_id == venue_id)
+))
+def venue(venue_id):
+  return venue_data(venue_id, **timeline_args(request.args))
+
+
+@api_route('/venues/<int:venue_id>/free-slots', lambda venue_id: (
+  _stamp(Venue, Venue.id == venue_id),
+  _stamp(Show, Show.venue_id == venue_id),
+  # Without ?start, the slots start at the current minute
+  db.session.query(db.literal(int(time.time() // 60)).label('minute')).subquery()
+), last_modified=False)
+def venue_free_slots(venue_id):
+  return free_slots_data(venue_id, **free_slots_args(request.args))
+
+
+#  Artists
+#  ----------------------------------------------------------------
+@api_route('/artists', lambda: (_stamp(Artist),))
+def artists():
+  return artists_data()
+
+
+@api_route('/artists/search', lambda: (_stamp(Artist), *_shows_refreshed()))
+def search_artists():
+  return search_data(Artist, request.args.get('q', ''), request.args.get('page', 1, type=int))
+
+
+@api_route('/artists/<int:artist_id>', lambda artist_id: (
+  _stamp(Artist, Artist.id == artist_id),
+  _stamp(Show, Show.artist_id == artist_id),
+  _stamp(Venue, Show.artist_id == artist_id, join=(Show, Show.venue_id == Venue.id)),
+  _started(Show.artist_id == artist_id)
+))
+def artist(artist_id):
+  return artist_data(artist_id, **timeline_args(request.args))
+
+
+#  Shows
+#  ----------------------------------------------------------------
+def _listing_stamps():
+  # The requested page's own rows, read with its filters and limit: their
+  # ids, and when they, their venues and their artists last changed
+  page = show_listing(limit=app.config['SHOWS_PER_PAGE'], with_updated_at=True, **show_listing_args(request.args)).subquery()
+  rows = db.session.query(
+    db.func.array_agg(aggregate_order_by(page.c.id, page.c.id)),
+    db.func.max(page.c.updated_at), db.func.max(page.c.venue_updated_at), db.func.max(page.c.artist_updated_at)
+  ).subquery()
+  return (rows,)
+
+
+@api_route('/shows', _listing_stamps)
+def shows():
+  return list(shows_data(**show_listing_args(request.args)))
+
+
+#  Discovery
+#  ----------------------------------------------------------------
+def _discovery_stamps(kind):
+  return (_stamp(Venue), _stamp(Artist), *_shows_refreshed())
+
+
+@api_route('/discover/<any(venues, artists, shows):kind>', _discovery_stamps)
+def discover(kind):
+  return discover_data(kind, **discovery_args(request.args))
+
+
+#  Matchmaking
+#  ----------------------------------------------------------------
+def _matching_stamps(**kwargs):
+  # Shows are only added to the index, so the latest show id stands in for
+  # them; other changes reach every process's index within the period
+  period = int(time.time() // app.config['MATCHING_INDEX_TTL'])
+  shows = db.session.query(db.func.max(Show.id), db.literal(period).label('period')).subquery()
+  return _stamp(Venue), _stamp(Artist), shows
+
+
+@api_route('/artists/<int:artist_id>/matches', _matching_stamps, last_modified=False)
+def artist_matches(artist_id):
+  return matches_data(Artist, artist_id, **matching_args(request.args))
+
+
+@api_route('/venues/<int:venue_id>/matches', _matching_stamps, last_modified=False)
+def venue_matches(venue_id):
+  return matches_data(Venue, venue_id, **matching_args(request.args))
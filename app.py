@@ -2,34 +2,114 @@
 # Imports
 #----------------------------------------------------------------------------#
 from flask import Flask
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from jinja2 import FileSystemBytecodeCache
+from fyyur_01.pooling import FyyurSQLAlchemy, reset_pools
+from fyyur_01 import instrumentation
 import logging
 from logging import Formatter, FileHandler
+import os
 import sys
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
+# The app and db are module globals, which the views, models and commands
+# register on as they are imported; create_app() configures the app first
+# and then imports them.
 app = Flask(__name__)
-moment = Moment(app)
 app.config.from_object('fyyur_01.config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+db = FyyurSQLAlchemy(app, query_class=instrumentation.TimedQuery)
 
 
-if not app.debug:
+@db.event.listens_for(db.session, 'after_begin')
+def set_statement_timeout(session, transaction, connection):
+  # Behind PgBouncer (transaction pooling) session settings would leak to
+  # other clients, so the timeout is set per transaction instead
+  if app.config['DB_PGBOUNCER'] and app.config['DB_STATEMENT_TIMEOUT'] and connection.dialect.name == 'postgresql':
+    connection.execute(f"SET LOCAL statement_timeout = {int(app.config['DB_STATEMENT_TIMEOUT'])}")
+
+
+#----------------------------------------------------------------------------#
+# App factory.
+#----------------------------------------------------------------------------#
+
+def create_app(profile=None):
+  """Configure the app and load its views and commands; returns the app.
+
+  `profile` names a class of fyyur_01.config (default: the FYYUR_CONFIG
+  environment variable, else 'production'), applied over the defaults;
+  a file named by FYYUR_SETTINGS overrides both. Only the first call
+  configures the app. Debug mode and the development secret key are only
+  had by asking for 'development'.
+
+  Flask-Migrate (which imports alembic) is only set up once imported, as
+  the flask command does to offer `flask db`; servers never load it.
+
+  With gunicorn, `gunicorn --preload 'fyyur_01:create_app()'` builds the
+  app once and forks workers from it.
+  """
+  if 'fyyur' not in app.extensions:
+    _configure(profile or os.environ.get('FYYUR_CONFIG', 'production'))
+  if 'flask_migrate' in sys.modules and 'migrate' not in app.extensions:
+    sys.modules['flask_migrate'].Migrate(app, db)
+  return app
+
+
+def _configure(profile):
+  from fyyur_01 import config
+  profile_class = getattr(config, profile.capitalize(), None)
+  if not isinstance(profile_class, type):
+    raise RuntimeError(f'unknown config profile {profile!r}')
+  app.config.from_object(profile_class)
+  app.config.from_envvar('FYYUR_SETTINGS', silent=True)
+  if not app.config['SECRET_KEY']:
+    # A key per process would break sessions and flashes across workers
+    raise RuntimeError('set FYYUR_SECRET_KEY (or SECRET_KEY in FYYUR_SETTINGS)')
+  app.extensions['fyyur'] = profile
+
+  instrumentation.init_app(app)
+  if not app.debug and not app.testing:
     file_handler = FileHandler('error.log')
     file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+      Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
     )
     app.logger.setLevel(logging.INFO)
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+  # Read app.config as they are imported
+  import fyyur_01.assets
+  import fyyur_01.images
+  import fyyur_01.routes
+  import fyyur_01.api
+  import fyyur_01.feeds
+  import fyyur_01.commands
+
+  if app.config['TEMPLATE_CACHE_DIR']:
+    os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+  if app.config['TEMPLATE_PRELOAD']:
+    preload_templates()
+
+  # Forked workers (gunicorn --preload, multiprocessing) must not share the
+  # parent's database connections
+  os.register_at_fork(after_in_child=lambda: reset_pools(app))
+
+
+def preload_templates():
+  """Compile every template into the Jinja environment's cache; returns
+  their number. Before a fork, workers share the compiled templates."""
+  env = app.jinja_env
+  names = env.list_templates(extensions=['html'])
+  # The cache would otherwise evict templates compiled here
+  if getattr(env.cache, 'capacity', len(names)) < len(names):
+    env.cache.capacity = len(names)
+  for name in names:
+    env.get_template(name)
+  return len(names)
+
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -37,4 +117,6 @@ if not app.debug:
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    # Run as a script, this module isn't the fyyur_01.app the views use
+    from fyyur_01 import create_app
+    create_app().run()
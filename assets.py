@@ -0,0 +1,163 @@
+from fyyur_01.app import app
+from flask import request, url_for, send_from_directory, safe_join
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+try:
+  import rcssmin
+except ImportError:
+  rcssmin = None
+
+try:
+  import rjsmin
+except ImportError:
+  rjsmin = None
+
+#----------------------------------------------------------------------------#
+# Static assets.
+#----------------------------------------------------------------------------#
+
+# Bundles in the order the layout loads them, with sources relative to the
+# static folder. The bundles are written next to static/css, so relative
+# url()s in the stylesheets resolve to the same files.
+BUNDLES = {
+  'main.css': [
+    'css/bootstrap.min.css',
+    'css/layout.main.css',
+    'css/main.css',
+    'css/main.responsive.css',
+    'css/main.quickfix.css'
+  ],
+  'head.js': [
+    'js/libs/modernizr-2.8.2.min.js',
+    'js/libs/moment.min.js'
+  ],
+  'main.js': [
+    'js/libs/jquery-1.11.1.min.js',
+    'js/script.js',
+    'js/libs/bootstrap-3.1.1.min.js',
+    'js/plugins.js'
+  ]
+}
+
+MANIFEST = 'manifest.json'
+
+# Precompressed variants, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def assets_dir():
+  return os.path.join(app.static_folder, app.config['ASSETS_DIR'])
+
+
+def minify_css(text):
+  if rcssmin is not None:
+    return rcssmin.cssmin(text)
+  text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+  text = re.sub(r'\s+', ' ', text)
+  return re.sub(r'\s*([{};,])\s*', r'\1', text).strip()
+
+
+def minify_js(text):
+  # Without rjsmin, scripts are only concatenated; most are minified already
+  return rjsmin.jsmin(text) if rjsmin is not None else text
+
+
+def bundle(name):
+  """Concatenated, minified contents of bundle `name`."""
+  minify = minify_css if name.endswith('.css') else minify_js
+  parts = []
+  for source in BUNDLES[name]:
+    with open(os.path.join(app.static_folder, source), encoding='utf-8') as f:
+      text = f.read()
+    parts.append(text if '.min.' in source else minify(text))
+  # A script missing its final semicolon must not run into the next one
+  return ('\n' if name.endswith('.css') else ';\n').join(parts).encode()
+
+
+def _write(path, data):
+  with open(path + '.tmp', 'wb') as f:
+    f.write(data)
+  os.replace(path + '.tmp', path)
+
+
+def build_assets(clean=False):
+  """Write fingerprinted, precompressed bundles and their manifest.
+
+  Files of earlier builds are kept, so pages rendered before the build
+  still load, unless `clean` is set. Returns the new manifest.
+  """
+  directory = assets_dir()
+  os.makedirs(directory, exist_ok=True)
+  manifest = {}
+  for name in BUNDLES:
+    data = bundle(name)
+    stem, ext = os.path.splitext(name)
+    filename = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+    path = os.path.join(directory, filename)
+    _write(path, data)
+    _write(path + '.gz', gzip.compress(data, 9, mtime=0))
+    if brotli is not None:
+      _write(path + '.br', brotli.compress(data))
+    manifest[name] = filename
+  _write(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2).encode())
+
+  if clean:
+    keep = {MANIFEST} | {filename + suffix for filename in manifest.values() for suffix in ('', '.gz', '.br')}
+    for filename in os.listdir(directory):
+      if filename not in keep:
+        os.remove(os.path.join(directory, filename))
+  return manifest
+
+
+_manifest = {'mtime': None, 'files': {}}
+
+
+def manifest():
+  """The build manifest, reread when `flask build-assets` replaces it."""
+  try:
+    mtime = os.stat(os.path.join(assets_dir(), MANIFEST)).st_mtime
+  except FileNotFoundError:
+    return {}
+  if mtime != _manifest['mtime']:
+    with open(os.path.join(assets_dir(), MANIFEST)) as f:
+      _manifest['files'] = json.load(f)
+    _manifest['mtime'] = mtime
+  return _manifest['files']
+
+
+@app.template_global()
+def asset_urls(name):
+  """URLs to include for bundle `name`: the built bundle, or its sources."""
+  filename = manifest().get(name)
+  if filename is not None:
+    return [url_for('asset', filename=filename)]
+  return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+
+@app.route('/static/' + app.config['ASSETS_DIR'] + '/<path:filename>')
+def asset(filename):
+  # Fingerprinted names never change content, so they are cached for good
+  directory = assets_dir()
+  mimetype = mimetypes.guess_type(filename)[0]
+  for encoding, suffix in ENCODINGS:
+    if request.accept_encodings[encoding] and os.path.isfile(safe_join(directory, filename + suffix)):
+      response = send_from_directory(directory, filename + suffix, mimetype=mimetype, conditional=True)
+      response.content_encoding = encoding
+      break
+  else:
+    response = send_from_directory(directory, filename, mimetype=mimetype, conditional=True)
+  response.vary.add('Accept-Encoding')
+  response.cache_control.public = True
+  response.cache_control.max_age = app.config['ASSETS_MAX_AGE']
+  response.cache_control.immutable = True
+  return response
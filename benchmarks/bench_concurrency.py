@@ -0,0 +1,91 @@
+from fyyur_01.app import app, db
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+import itertools
+import time
+import pytest
+
+#----------------------------------------------------------------------------#
+# Concurrency benchmarks.
+#----------------------------------------------------------------------------#
+
+# Pages whose independent queries run concurrently (parallel.gather), with
+# every statement delayed by DB_LATENCY seconds as on a distant or busy
+# database, with the queries run in turn (PAGE_QUERY_THREADS = 0) and
+# concurrently. The load benchmarks send LOAD_REQUESTS requests from
+# LOAD_CLIENTS threads and report p50/p99 latency and throughput in the
+# benchmark's extra_info. Every request has its own query string, so the
+# page cache always misses.
+
+DB_LATENCY = 0.01
+LOAD_CLIENTS = 8
+LOAD_REQUESTS = 80
+
+# Across benchmarks, so none is served a page another one cached
+_numbers = itertools.count()
+
+
+@pytest.fixture
+def db_latency(dataset):
+  def delay(*args):
+    time.sleep(DB_LATENCY)
+  with app.app_context():
+    engine = db.engine
+  db.event.listen(engine, 'before_cursor_execute', delay)
+  yield DB_LATENCY
+  db.event.remove(engine, 'before_cursor_execute', delay)
+
+
+@pytest.fixture(params=[0, 4], ids=['in_turn', 'concurrent'])
+def page_query_threads(request):
+  threads = app.config['PAGE_QUERY_THREADS']
+  app.config['PAGE_QUERY_THREADS'] = request.param
+  yield request.param
+  app.config['PAGE_QUERY_THREADS'] = threads
+
+
+def _pages(dataset):
+  return {
+    'venue': f"/venues/{dataset['venue_id']}",
+    'artist': f"/artists/{dataset['artist_id']}",
+    'discover_shows': '/discover/shows?genre=Jazz'
+  }
+
+
+@pytest.mark.benchmark(group='concurrency')
+@pytest.mark.parametrize('page', ['venue', 'artist', 'discover_shows'])
+def bench_page_latency(benchmark, client, dataset, db_latency, page_query_threads, page):
+  path = _pages(dataset)[page]
+  separator = '&' if '?' in path else '?'
+
+  def fetch():
+    response = client.get(f'{path}{separator}n={next(_numbers)}')
+    assert response.status_code == 200, response.status
+
+  benchmark.pedantic(fetch, rounds=20, warmup_rounds=1)
+
+
+@pytest.mark.benchmark(group='concurrency-load')
+@pytest.mark.parametrize('page', ['venue', 'artist'])
+def bench_page_load(benchmark, dataset, db_latency, page_query_threads, page):
+  path = _pages(dataset)[page]
+
+  def request(_):
+    start = time.perf_counter()
+    response = app.test_client().get(f'{path}?n={next(_numbers)}')
+    assert response.status_code == 200, response.status
+    return time.perf_counter() - start
+
+  def load():
+    start = time.perf_counter()
+    with ThreadPoolExecutor(LOAD_CLIENTS) as clients:
+      latencies = list(clients.map(request, range(LOAD_REQUESTS)))
+    elapsed = time.perf_counter() - start
+    percentiles = quantiles(latencies, n=100)
+    benchmark.extra_info.update(
+      p50_ms=round(percentiles[49] * 1000, 2),
+      p99_ms=round(percentiles[98] * 1000, 2),
+      requests_per_second=round(LOAD_REQUESTS / elapsed, 1)
+    )
+
+  benchmark.pedantic(load, rounds=3)
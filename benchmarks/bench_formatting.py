@@ -0,0 +1,46 @@
+from fyyur_01.formatting import PATTERNS, format_datetimes, _format
+from datetime import datetime, timedelta
+import babel.dates
+import pytest
+
+#----------------------------------------------------------------------------#
+# Formatting benchmarks.
+#----------------------------------------------------------------------------#
+
+# A timeline's worth of show times formatted by the `datetime` filter, and
+# by the filter it replaced, which called babel.dates.format_datetime for
+# every value. They need no database.
+
+LOCALE = 'en_US'
+TIMEZONE = 'America/New_York'
+# A busy page: 120 shows, a few of them at the same time
+START = datetime(2030, 1, 1, 20)
+TIMES = [START + timedelta(days=i // 3) for i in range(120)]
+
+
+def _babel_format(dt, format='medium'):
+  return babel.dates.format_datetime(dt, PATTERNS.get(format, format), tzinfo=TIMEZONE, locale=LOCALE)
+
+
+def test_format_matches_babel():
+  for format in PATTERNS:
+    assert format_datetimes(TIMES, format, LOCALE, TIMEZONE) == [_babel_format(dt, format) for dt in TIMES]
+
+
+@pytest.mark.benchmark(group='formatting')
+def bench_format_babel(benchmark):
+  benchmark(lambda: [_babel_format(dt) for dt in TIMES])
+
+
+@pytest.mark.benchmark(group='formatting')
+def bench_format_compiled(benchmark):
+  # Without the memoized strings: the parsed pattern, locale and timezone alone
+  def format():
+    _format.cache_clear()
+    return format_datetimes(TIMES, 'medium', LOCALE, TIMEZONE)
+  benchmark(format)
+
+
+@pytest.mark.benchmark(group='formatting')
+def bench_format_memoized(benchmark):
+  benchmark(format_datetimes, TIMES, 'medium', LOCALE, TIMEZONE)
@@ -0,0 +1,355 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist
+from fyyur_01.forms import VenueForm, ArtistForm
+from fyyur_01.jobs import Job, DONE
+from fyyur_01 import images
+from conftest import BENCHMARK_NAME
+from datetime import datetime, timedelta
+import io
+import itertools
+import os
+import pytest
+
+#----------------------------------------------------------------------------#
+# Route benchmarks.
+#----------------------------------------------------------------------------#
+
+# One benchmark per view in routes.py, and for the matchmaking API, through
+# the test client. Page views run with the page cache emptied before every
+# request, except where noted.
+
+VENUE_FORM = {
+  'name': BENCHMARK_NAME + ' Venue',
+  'city': 'San Francisco',
+  'state': 'CA',
+  'address': '1 Benchmark Street',
+  'phone': '415-000-0000',
+  'genres': ['Jazz', 'Blues'],
+  'facebook_link': 'https://www.facebook.com/benchmark',
+  'website': 'https://benchmark.example.com'
+}
+ARTIST_FORM = {key: value for key, value in VENUE_FORM.items() if key != 'address'}
+ARTIST_FORM['name'] = BENCHMARK_NAME + ' Artist'
+
+
+def _form(form_class, row):
+  # Resubmits a row as it is, so edit benchmarks don't change the dataset
+  with app.test_request_context():
+    data = form_class(obj=row, meta={'csrf': False}).data
+  return {key: 'y' if value is True else value for key, value in data.items() if value not in (None, False, '')}
+
+
+def _create(model, form):
+  with app.app_context():
+    row = model(**form)
+    db.session.add(row)
+    db.session.commit()
+    return row.id
+
+
+#  Venues
+#  ----------------------------------------------------------------
+@pytest.mark.benchmark(group='venues')
+def bench_home(benchmark, fetch):
+  benchmark(fetch, '/')
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_venues(benchmark, fetch):
+  benchmark(fetch, '/venues')
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_venues_cached(benchmark, fetch):
+  fetch('/venues')
+  benchmark(fetch, '/venues', cached=True)
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_search_venues(benchmark, fetch):
+  benchmark(fetch, '/venues/search', 'POST', data={'search_term': 'blue'})
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_show_venue(benchmark, fetch, dataset):
+  benchmark(fetch, f"/venues/{dataset['venue_id']}")
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_create_venue_form(benchmark, fetch):
+  benchmark(fetch, '/venues/create')
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_create_venue_submission(benchmark, fetch):
+  benchmark.pedantic(fetch, ('/venues/create', 'POST'), {'data': VENUE_FORM}, rounds=50)
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_edit_venue(benchmark, fetch, dataset):
+  benchmark(fetch, f"/venues/{dataset['venue_id']}/edit")
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_edit_venue_submission(benchmark, fetch, dataset):
+  with app.app_context():
+    data = _form(VenueForm, Venue.query.get(dataset['venue_id']))
+  benchmark.pedantic(fetch, (f"/venues/{dataset['venue_id']}/edit", 'POST', 302), {'data': data}, rounds=50)
+
+
+@pytest.mark.benchmark(group='venues')
+def bench_delete_venue(benchmark, client):
+  benchmark.pedantic(lambda id: client.delete(f'/venues/{id}'), setup=lambda: ((_create(Venue, VENUE_FORM),), {}), rounds=50)
+
+
+#  Artists
+#  ----------------------------------------------------------------
+@pytest.mark.benchmark(group='artists')
+def bench_artists(benchmark, fetch):
+  benchmark(fetch, '/artists')
+
+
+@pytest.mark.benchmark(group='artists')
+def bench_search_artists(benchmark, fetch):
+  benchmark(fetch, '/artists/search', 'POST', data={'search_term': 'blue'})
+
+
+@pytest.mark.benchmark(group='artists')
+def bench_show_artist(benchmark, fetch, dataset):
+  benchmark(fetch, f"/artists/{dataset['artist_id']}")
+
+
+@pytest.mark.benchmark(group='artists')
+def bench_create_artist_form(benchmark, fetch):
+  benchmark(fetch, '/artists/create')
+
+
+@pytest.mark.benchmark(group='artists')
+def bench_create_artist_submission(benchmark, fetch):
+  benchmark.pedantic(fetch, ('/artists/create', 'POST'), {'data': ARTIST_FORM}, rounds=50)
+
+
+@pytest.mark.benchmark(group='artists')
+def bench_edit_artist(benchmark, fetch, dataset):
+  benchmark(fetch, f"/artists/{dataset['artist_id']}/edit")
+
+
+@pytest.mark.benchmark(group='artists')
+def bench_edit_artist_submission(benchmark, fetch, dataset):
+  with app.app_context():
+    data = _form(ArtistForm, Artist.query.get(dataset['artist_id']))
+  benchmark.pedantic(fetch, (f"/artists/{dataset['artist_id']}/edit", 'POST', 302), {'data': data}, rounds=50)
+
+
+@pytest.mark.benchmark(group='artists')
+def bench_delete_artist(benchmark, client):
+  benchmark.pedantic(lambda id: client.delete(f'/artists/{id}'), setup=lambda: ((_create(Artist, ARTIST_FORM),), {}), rounds=50)
+
+
+#  Shows
+#  ----------------------------------------------------------------
+@pytest.mark.benchmark(group='shows')
+def bench_shows(benchmark, fetch):
+  benchmark(fetch, '/shows')
+
+
+@pytest.mark.benchmark(group='shows')
+def bench_shows_streamed(benchmark, fetch):
+  benchmark(fetch, '/shows?stream=1')
+
+
+@pytest.mark.benchmark(group='shows')
+def bench_create_shows(benchmark, fetch):
+  benchmark(fetch, '/shows/create')
+
+
+@pytest.mark.benchmark(group='shows')
+def bench_create_show_submission(benchmark, fetch, dataset):
+  # Listed at a benchmark venue, so the shows are deleted with it, a day
+  # apart so none of them overlap
+  venue_id = _create(Venue, VENUE_FORM)
+  days = itertools.count()
+  data = lambda: (('/shows/create', 'POST'), {'data': {
+    'artist_id': dataset['artist_id'],
+    'venue_id': venue_id,
+    'start_time': (datetime(2030, 1, 1, 20) + timedelta(days=next(days))).strftime('%Y-%m-%d %H:%M')
+  }})
+  benchmark.pedantic(fetch, setup=data, rounds=50)
+
+
+#  Discovery
+#  ----------------------------------------------------------------
+@pytest.mark.benchmark(group='discovery')
+def bench_discover_venues(benchmark, fetch):
+  benchmark(fetch, '/discover/venues?genre=Jazz&genre=Blues&state=NY')
+
+
+@pytest.mark.benchmark(group='discovery')
+def bench_discover_artists(benchmark, fetch):
+  benchmark(fetch, '/discover/artists?genre=Rock n Roll&seeking=1')
+
+
+@pytest.mark.benchmark(group='discovery')
+def bench_discover_shows(benchmark, fetch):
+  benchmark(fetch, '/discover/shows?genre=Jazz&genre=Soul&match=all&state=CA')
+
+
+#  Feeds
+#  ----------------------------------------------------------------
+@pytest.mark.benchmark(group='feeds')
+def bench_venue_calendar(benchmark, fetch, dataset):
+  benchmark(fetch, f"/venues/{dataset['venue_id']}/calendar.ics")
+
+
+@pytest.mark.benchmark(group='feeds')
+def bench_venue_calendar_cached(benchmark, fetch, dataset):
+  fetch(f"/venues/{dataset['venue_id']}/calendar.ics")
+  benchmark(fetch, f"/venues/{dataset['venue_id']}/calendar.ics", cached=True)
+
+
+@pytest.mark.benchmark(group='feeds')
+def bench_venue_calendar_not_modified(benchmark, fetch, dataset):
+  # A calendar client polling an unchanged feed, cached or not
+  etag = fetch(f"/venues/{dataset['venue_id']}/calendar.ics").headers['ETag']
+  benchmark(fetch, f"/venues/{dataset['venue_id']}/calendar.ics", status=304, headers={'If-None-Match': etag})
+
+
+@pytest.mark.benchmark(group='feeds')
+def bench_artist_calendar(benchmark, fetch, dataset):
+  benchmark(fetch, f"/artists/{dataset['artist_id']}/calendar.ics")
+
+
+@pytest.mark.benchmark(group='feeds')
+def bench_genre_rss(benchmark, fetch):
+  benchmark(fetch, '/genres/Jazz/shows.rss')
+
+
+@pytest.mark.benchmark(group='feeds')
+def bench_city_rss(benchmark, fetch, dataset):
+  with app.app_context():
+    venue = Venue.query.get(dataset['venue_id'])
+    path = f'/cities/{venue.state}/{venue.city}/shows.rss'
+  benchmark(fetch, path)
+
+
+#  Matchmaking
+#  ----------------------------------------------------------------
+@pytest.mark.benchmark(group='matching')
+def bench_artist_matches(benchmark, fetch, dataset):
+  benchmark(fetch, f"/api/v1/artists/{dataset['artist_id']}/matches")
+
+
+@pytest.mark.benchmark(group='matching')
+def bench_venue_matches(benchmark, fetch, dataset):
+  benchmark(fetch, f"/api/v1/venues/{dataset['venue_id']}/matches?seeking=1")
+
+
+#  Jobs and deletions
+#  ----------------------------------------------------------------
+@pytest.fixture
+def finished_job(dataset):
+  with app.app_context():
+    job = Job(name='benchmark', args='{}', key=BENCHMARK_NAME, status=DONE, attempts=1, max_attempts=1, run_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    id = job.id
+  yield id
+  with app.app_context():
+    Job.query.filter(Job.id == id).delete()
+    db.session.commit()
+
+
+def _deleted_venue(fetch):
+  # A deletion of a benchmark venue, still pending
+  id = _create(Venue, VENUE_FORM)
+  return fetch(f'/venues/{id}', 'DELETE', status=202).get_json()['id']
+
+
+@pytest.mark.benchmark(group='jobs')
+def bench_job_stats(benchmark, fetch):
+  benchmark(fetch, '/jobs')
+
+
+@pytest.mark.benchmark(group='jobs')
+def bench_job_status(benchmark, fetch, finished_job):
+  benchmark(fetch, f'/jobs/{finished_job}')
+
+
+@pytest.mark.benchmark(group='jobs')
+def bench_deletion_status(benchmark, fetch):
+  benchmark(fetch, f'/deletions/{_deleted_venue(fetch)}')
+
+
+@pytest.mark.benchmark(group='jobs')
+def bench_undo_deletion(benchmark, fetch):
+  setup = lambda: ((f'/deletions/{_deleted_venue(fetch)}/undo', 'POST'), {})
+  benchmark.pedantic(fetch, setup=setup, rounds=50)
+
+
+#  Images
+#  ----------------------------------------------------------------
+IMAGE_LINK = 'https://images.example.com/benchmark.jpg'
+
+
+@pytest.fixture
+def image_path(dataset, tmp_path, monkeypatch):
+  """Path of a benchmark venue's thumbnail, with images read from a local
+  directory and cached in another."""
+  Image = pytest.importorskip('PIL.Image')
+  originals = tmp_path / 'originals'
+  originals.mkdir()
+  Image.new('RGB', (1600, 1200), (200, 80, 40)).save(originals / os.path.basename(IMAGE_LINK), 'JPEG')
+  store = images.ImageStore(str(tmp_path / 'cache'), images.FileFetcher(str(originals)), 64 * 1024 * 1024)
+  monkeypatch.setitem(images._store, 'store', store)
+  id = _create(Venue, dict(VENUE_FORM, image_link=IMAGE_LINK))
+  return f'/images/venue/{id}/thumb.{images.link_digest(IMAGE_LINK)}.jpeg'
+
+
+def _empty_image_cache(path):
+  for entry in images.image_store()._files():
+    os.remove(entry.path)
+  return (path,), {}
+
+
+@pytest.mark.benchmark(group='images')
+def bench_image_first_view(benchmark, fetch, image_path):
+  # Fetched, resized and written to the cache
+  benchmark.pedantic(fetch, setup=lambda: _empty_image_cache(image_path), rounds=20)
+
+
+@pytest.mark.benchmark(group='images')
+def bench_image(benchmark, fetch, image_path):
+  fetch(image_path)
+  benchmark(fetch, image_path)
+
+
+#  Bulk import/export and monitoring
+#  ----------------------------------------------------------------
+@pytest.mark.benchmark(group='bulk')
+def bench_import_upload(benchmark, fetch):
+  lines = '\n'.join(
+    f'{{"name": "{BENCHMARK_NAME} Venue {i}", "city": "Austin", "state": "TX", "address": "{i} Main St", "genres": ["Jazz"]}}'
+    for i in range(100)
+  ).encode()
+  upload = lambda: {'file': (io.BytesIO(lines), 'venues.ndjson')}
+  benchmark.pedantic(lambda: fetch('/import/venues', 'POST', data=upload()), rounds=20)
+
+
+@pytest.mark.benchmark(group='bulk')
+def bench_export_download(benchmark, fetch):
+  benchmark(fetch, '/export/venues.csv')
+
+
+@pytest.mark.benchmark(group='monitoring')
+def bench_cache_stats(benchmark, fetch):
+  benchmark(fetch, '/cache/stats')
+
+
+@pytest.mark.benchmark(group='monitoring')
+def bench_db_pool_stats(benchmark, fetch):
+  benchmark(fetch, '/db/pool')
+
+
+@pytest.mark.benchmark(group='monitoring')
+def bench_metrics(benchmark, fetch):
+  benchmark(fetch, '/metrics')
@@ -0,0 +1,32 @@
+from fyyur_01.app import app
+from fyyur_01.cache import page_cache
+from fyyur_01.seed import SCALES
+import pytest
+
+#----------------------------------------------------------------------------#
+# Scaling benchmarks.
+#----------------------------------------------------------------------------#
+
+# Pages timed at every scale of seed.SCALES, to see how they grow with the
+# number of venues, artists and shows. The database is reseeded at each
+# scale, and left at the largest: run them on their own, e.g.
+# python -m pytest bench_scaling.py --scaling -k "small or medium"
+
+pytestmark = pytest.mark.scaling
+
+
+@pytest.mark.benchmark(group='scaling-venues')
+@pytest.mark.parametrize('seeded', list(SCALES), indirect=True)
+@pytest.mark.parametrize('path', ['/venues', '/venues?page=1'], ids=['all', 'page'])
+def bench_venues_by_scale(benchmark, seeded, path):
+  client = app.test_client()
+  benchmark.extra_info['rows'] = seeded
+
+  def fetch():
+    if page_cache is not None:
+      page_cache.clear()
+    response = client.get(path)
+    response.get_data()
+    assert response.status_code == 200
+
+  benchmark(fetch)
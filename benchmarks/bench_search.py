@@ -0,0 +1,31 @@
+from fyyur_01.app import app
+import pytest
+
+#----------------------------------------------------------------------------#
+# Search benchmarks.
+#----------------------------------------------------------------------------#
+
+# Venue search latency with 10k, 100k and 1M venues, for a substring, a
+# prefix, a misspelling and a term matching nothing. Like the scaling
+# benchmarks, they reseed the database at each size and only run with
+# --scaling.
+
+pytestmark = pytest.mark.scaling
+
+ROWS = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+TERMS = {'substring': 'velvet', 'prefix': 'midn', 'misspelled': 'lantren', 'no_match': 'xylophone'}
+
+
+@pytest.mark.benchmark(group='search')
+@pytest.mark.parametrize('seeded', [(rows, 0, 0) for rows in ROWS.values()], ids=list(ROWS), indirect=True)
+@pytest.mark.parametrize('term', list(TERMS.values()), ids=list(TERMS))
+def bench_search_venues(benchmark, seeded, term):
+  client = app.test_client()
+  benchmark.extra_info['rows'] = seeded
+
+  def search():
+    response = client.post('/venues/search', data={'search_term': term})
+    response.get_data()
+    assert response.status_code == 200
+
+  benchmark(search)
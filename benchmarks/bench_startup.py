@@ -0,0 +1,46 @@
+from fyyur_01.app import app, db, preload_templates
+import os
+import subprocess
+import sys
+import pytest
+
+#----------------------------------------------------------------------------#
+# Startup benchmarks.
+#----------------------------------------------------------------------------#
+
+# A cold start imports the package and creates the app in a new
+# interpreter, as a server or autoscaled instance boots. A preloaded
+# worker is forked from the benchmark process (whose app is created, with
+# pooled connections) and serves one page before exiting, as a gunicorn
+# --preload worker does.
+
+CREATE_APP = "from fyyur_01 import create_app; create_app('testing')"
+
+
+@pytest.mark.benchmark(group='startup')
+def bench_cold_start(benchmark):
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+  benchmark.pedantic(subprocess.run, ([sys.executable, '-c', CREATE_APP],), {'env': env, 'check': True}, rounds=5)
+
+
+@pytest.mark.benchmark(group='startup')
+def bench_preloaded_worker(benchmark, client):
+  client.get('/')
+
+  def fork():
+    pid = os.fork()
+    if pid == 0:
+      with app.app_context():
+        status = app.test_client().get('/').status_code
+        db.session.remove()
+        # The child's own connections; the parent's were left out of its pool
+        db.engine.dispose()
+      os._exit(0 if status == 200 else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+
+  benchmark.pedantic(fork, rounds=20)
+
+
+@pytest.mark.benchmark(group='startup')
+def bench_preload_templates(benchmark):
+  benchmark.pedantic(preload_templates, setup=app.jinja_env.cache.clear, rounds=20)
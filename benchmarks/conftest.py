@@ -0,0 +1,94 @@
+from fyyur_01 import create_app, db
+# Before the imports below, which read the config
+app = create_app('testing')
+from fyyur_01.models import Venue, Artist, Show
+from fyyur_01.cache import page_cache
+from fyyur_01.seed import SCALES, seed
+import os
+import pytest
+
+#----------------------------------------------------------------------------#
+# Benchmark setup.
+#----------------------------------------------------------------------------#
+
+# Rows created by the write benchmarks carry this name and are deleted after
+# the run, so the dataset stays the same between runs
+BENCHMARK_NAME = 'Benchmark'
+
+
+def pytest_addoption(parser):
+  group = parser.getgroup('fyyur')
+  group.addoption('--database-url', default=os.environ.get('FYYUR_BENCH_DATABASE_URL'),
+                  help='Database to benchmark against (default: SQLALCHEMY_DATABASE_URI).')
+  group.addoption('--scale', choices=list(SCALES), help='Reseed the database at this scale first.')
+  group.addoption('--seed', type=int, default=0, help='Random seed for --scale.')
+  group.addoption('--scaling', action='store_true',
+                  help='Run the scaling benchmarks, which reseed the database at every size (slow: run them on their own).')
+
+
+def pytest_configure(config):
+  if config.getoption('database_url'):
+    app.config['SQLALCHEMY_DATABASE_URI'] = config.getoption('database_url')
+
+
+def pytest_collection_modifyitems(config, items):
+  if config.getoption('scaling'):
+    return
+  skip = pytest.mark.skip(reason='reseeds the database: run with --scaling')
+  for item in items:
+    if 'scaling' in item.keywords:
+      item.add_marker(skip)
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+  # Reports are only comparable between runs over the same data
+  with app.app_context():
+    output_json['dataset'] = {
+      'dialect': db.engine.dialect.name,
+      'scale': config.getoption('scale'),
+      'seed': config.getoption('seed'),
+      'rows': {model.__tablename__: db.session.query(model).count() for model in (Venue, Artist, Show)}
+    }
+
+
+@pytest.fixture(scope='session')
+def dataset(request):
+  """Ids the benchmarks request: the venue and artist with the most shows."""
+  with app.app_context():
+    if request.config.getoption('scale'):
+      seed(request.config.getoption('scale'), request.config.getoption('seed'), reset=True)
+    busiest = lambda column: db.session.query(column).group_by(column).order_by(db.func.count().desc(), column).limit(1).scalar()
+    ids = {'venue_id': busiest(Show.venue_id), 'artist_id': busiest(Show.artist_id)}
+    if None in ids.values():
+      pytest.exit('no shows to benchmark: seed the database first (--scale small)')
+  yield ids
+  with app.app_context():
+    for model in (Venue, Artist):
+      db.session.query(model).filter(model.name.like(BENCHMARK_NAME + '%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@pytest.fixture(scope='module')
+def seeded(request):
+  """Reseed the database at the scale the benchmark is parametrized with
+  (indirectly), once per scale and module; returns the rows inserted."""
+  with app.app_context():
+    return seed(request.param, request.config.getoption('seed'), reset=True)
+
+
+@pytest.fixture
+def client(dataset):
+  return app.test_client()
+
+
+@pytest.fixture
+def fetch(client):
+  """Request a page with the page cache emptied first, expecting `status`."""
+  def fetch(path, method='GET', status=200, cached=False, **kwargs):
+    if page_cache is not None and not cached:
+      page_cache.clear()
+    response = client.open(path, method=method, **kwargs)
+    response.get_data()
+    assert response.status_code == status, response.status
+    return response
+  return fetch
@@ -0,0 +1,85 @@
+from locust import HttpUser, task, between
+import random
+
+#----------------------------------------------------------------------------#
+# Load scenario.
+#----------------------------------------------------------------------------#
+
+# Mostly browsing, some searching and a few new listings, against a running
+# server. Reseed (`flask seed --reset`) before each run so runs compare:
+#   locust -f locustfile.py --host http://localhost:5000 --headless -u 50 -r 10 -t 2m --json > load.json
+
+SEARCH_TERMS = ['blue', 'the', 'jazz', 'velvet owl', 'hall', 'moon', 'rusty', 'x']
+GENRES = ['Jazz', 'Blues', 'Rock n Roll', 'Folk', 'Pop']
+
+# Listings created under load carry this name, as in the benchmarks
+LOAD_TEST_NAME = 'Benchmark Load'
+
+
+class FyyurUser(HttpUser):
+  wait_time = between(0.5, 2)
+
+  def on_start(self):
+    areas = self.client.get('/api/v1/venues', name='/api/v1/venues').json()
+    self.venue_ids = [venue['id'] for area in areas for venue in area['venues']]
+    self.artist_ids = [artist['id'] for artist in self.client.get('/api/v1/artists', name='/api/v1/artists').json()]
+
+  #  Browse
+  #  ----------------------------------------------------------------
+  @task(6)
+  def venues(self):
+    self.client.get('/venues')
+
+  @task(4)
+  def artists(self):
+    self.client.get('/artists')
+
+  @task(6)
+  def shows(self):
+    self.client.get('/shows')
+
+  @task(10)
+  def show_venue(self):
+    if self.venue_ids:
+      self.client.get(f'/venues/{random.choice(self.venue_ids)}', name='/venues/[id]')
+
+  @task(10)
+  def show_artist(self):
+    if self.artist_ids:
+      self.client.get(f'/artists/{random.choice(self.artist_ids)}', name='/artists/[id]')
+
+  @task(4)
+  def discover(self):
+    kind = random.choice(['venues', 'artists', 'shows'])
+    self.client.get(f'/discover/{kind}', params={'genre': random.sample(GENRES, random.randint(1, 2))}, name=f'/discover/{kind}')
+
+  #  Search
+  #  ----------------------------------------------------------------
+  @task(4)
+  def search_venues(self):
+    self.client.post('/venues/search', data={'search_term': random.choice(SEARCH_TERMS)})
+
+  @task(4)
+  def search_artists(self):
+    self.client.post('/artists/search', data={'search_term': random.choice(SEARCH_TERMS)})
+
+  #  Create
+  #  ----------------------------------------------------------------
+  @task(1)
+  def create_venue(self):
+    self.client.post('/venues/create', data={
+      'name': f'{LOAD_TEST_NAME} Venue {random.randrange(10 ** 6)}',
+      'city': 'Austin',
+      'state': 'TX',
+      'address': '1 Load Street',
+      'genres': random.sample(GENRES, 2)
+    })
+
+  @task(1)
+  def create_show(self):
+    if self.venue_ids and self.artist_ids:
+      self.client.post('/shows/create', data={
+        'artist_id': random.choice(self.artist_ids),
+        'venue_id': random.choice(self.venue_ids),
+        'start_time': f'2030-{random.randint(1, 12):02}-{random.randint(1, 28):02} 20:00'
+      })
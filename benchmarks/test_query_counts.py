@@ -0,0 +1,77 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show
+from fyyur_01.cache import page_cache
+from conftest import BENCHMARK_NAME
+from datetime import datetime, timedelta
+import pytest
+
+#----------------------------------------------------------------------------#
+# Query counts.
+#----------------------------------------------------------------------------#
+
+# Pages listing shows must run the same number of queries however many
+# shows, and counterparts, they list: a page is rendered as a venue and an
+# artist gain shows, each with another venue or artist, and the
+# X-Query-Count header (see instrumentation.py) must not change.
+
+PAGES = ['/venues', '/venues/{venue_id}', '/artists/{artist_id}']
+# Shows of the venue and of the artist after each step
+SIZES = [1, 10, 120]
+
+
+@pytest.fixture
+def owners():
+  with app.app_context():
+    venue = Venue(name=BENCHMARK_NAME + ' Venue', city='Austin', state='TX', genres=['Jazz'])
+    artist = Artist(name=BENCHMARK_NAME + ' Artist', city='Austin', state='TX', genres=['Jazz'])
+    db.session.add_all([venue, artist])
+    db.session.commit()
+    ids = {'venue_id': venue.id, 'artist_id': artist.id}
+  yield ids
+  with app.app_context():
+    # Their shows are deleted with them
+    for model in (Venue, Artist):
+      db.session.query(model).filter(model.name.like(BENCHMARK_NAME + '%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _add_shows(owners, first, last):
+  # Shows `first` to `last` of the venue and of the artist, half of them
+  # past, each with a counterpart of its own
+  now = datetime.utcnow().replace(microsecond=0)
+  rows = []
+  for i in range(first, last):
+    venue = Venue(name=f'{BENCHMARK_NAME} Venue {i}', city='Austin', state='TX', genres=['Jazz'])
+    artist = Artist(name=f'{BENCHMARK_NAME} Artist {i}', city='Austin', state='TX', genres=['Jazz'])
+    db.session.add_all([venue, artist])
+    db.session.flush()
+    start_time = now + timedelta(days=i // 2 + 1) * (1 if i % 2 else -1)
+    rows.append({'venue_id': owners['venue_id'], 'artist_id': artist.id, 'start_time': start_time})
+    rows.append({'venue_id': venue.id, 'artist_id': owners['artist_id'], 'start_time': start_time})
+  db.session.execute(Show.__table__.insert(), rows)
+  db.session.commit()
+
+
+def _query_count(client, path):
+  if page_cache is not None:
+    page_cache.clear()
+  response = client.get(path)
+  response.get_data()
+  assert response.status_code == 200, response.status
+  return int(response.headers['X-Query-Count'])
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_query_count_is_fixed(owners, monkeypatch, page):
+  # Queries run on other threads aren't counted
+  monkeypatch.setitem(app.config, 'PAGE_QUERY_THREADS', 0)
+  client = app.test_client()
+  path = page.format(**owners)
+  counts = []
+  shows = 0
+  for size in SIZES:
+    with app.app_context():
+      _add_shows(owners, shows, size)
+    shows = size
+    counts.append(_query_count(client, path))
+  assert counts == [counts[0]] * len(SIZES), f'{path}: {counts} queries with {SIZES} shows'
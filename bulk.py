@@ -0,0 +1,226 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, all_shows, deleted_ids
+from fyyur_01.forms import VenueForm, ArtistForm, ShowForm
+from fyyur_01.cache import mark_changed
+from fyyur_01.jobs import enqueue
+from fyyur_01.discovery import queue_facets_refresh
+from fyyur_01.scheduling import check_schedule, show_end
+from datetime import timedelta
+from itertools import islice
+from werkzeug.datastructures import MultiDict
+from wtforms import BooleanField
+import csv
+import io
+import json
+
+#----------------------------------------------------------------------------#
+# Bulk import/export.
+#----------------------------------------------------------------------------#
+
+# Records are streamed in and out one chunk at a time, so memory use does
+# not depend on file size. Import rows are validated with the same forms
+# as the create routes and inserted with one executemany per chunk.
+
+KINDS = {
+  'venues': (Venue, VenueForm),
+  'artists': (Artist, ArtistForm),
+  'shows': (Show, ShowForm)
+}
+FORMATS = ('csv', 'ndjson')
+
+# Multi-valued fields are joined with this in CSV files
+LIST_SEPARATOR = ';'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+class RecordError(Exception):
+  pass
+
+
+def read_records(lines, fmt):
+  """Yield (record number, record dict or None, error or None) from a text stream."""
+  if fmt == 'csv':
+    for number, record in enumerate(csv.DictReader(lines), 1):
+      yield number, record, None
+    return
+  number = 0
+  for line in lines:
+    if not line.strip():
+      continue
+    number += 1
+    try:
+      record = json.loads(line)
+    except ValueError as e:
+      yield number, None, f'invalid JSON: {e}'
+      continue
+    if not isinstance(record, dict):
+      yield number, None, 'expected a JSON object'
+      continue
+    yield number, record, None
+
+
+def _formdata(form_class, record):
+  formdata = MultiDict()
+  for name, value in record.items():
+    field = getattr(form_class, name, None)
+    if field is not None and field.field_class is BooleanField:
+      if str(value).strip().lower() in ('1', 'true', 't', 'y', 'yes', 'on'):
+        formdata.add(name, 'y')
+    elif isinstance(value, list):
+      for item in value:
+        formdata.add(name, str(item))
+    elif name == 'genres' and isinstance(value, str):
+      for item in filter(None, (genre.strip() for genre in value.split(LIST_SEPARATOR))):
+        formdata.add(name, item)
+    elif value is not None:
+      formdata.add(name, str(value))
+  return formdata
+
+
+def _validate(model, form_class, record, keep_ids):
+  form = form_class(formdata=_formdata(form_class, record), meta={'csrf': False})
+  if not form.validate():
+    raise RecordError('; '.join(f"{field} {'|'.join(errors)}" for field, errors in form.errors.items()))
+  row = {name: value for name, value in form.data.items() if name in model.__table__.c}
+  try:
+    if model is Show:
+      row['artist_id'], row['venue_id'] = int(row['artist_id']), int(row['venue_id'])
+      row['end_time'] = show_end(row['start_time'], form.duration.data)
+    if keep_ids:
+      row['id'] = int(record['id'])
+  except (KeyError, TypeError, ValueError):
+    raise RecordError('ids must be integers')
+  return row
+
+
+def _missing_references(rows):
+  # One IN query per referenced table for the whole chunk
+  missing = set()
+  for model, key in ((Artist, 'artist_id'), (Venue, 'venue_id')):
+    ids = {row[key] for _, row in rows}
+    found = {id for id, in db.session.query(model.id).filter(model.id.in_(ids))}
+    missing.update((key, id) for id in ids - found)
+  return missing
+
+
+def _insert(model, rows, on_error):
+  try:
+    db.session.execute(model.__table__.insert(), [row for _, row in rows])
+    mark_changed('all')
+    db.session.commit()
+    return len(rows)
+  except Exception:
+    db.session.rollback()
+  # Isolate the failing rows, keeping the rest of the chunk
+  imported = 0
+  for number, row in rows:
+    try:
+      db.session.execute(model.__table__.insert(), row)
+      mark_changed('all')
+      db.session.commit()
+      imported += 1
+    except Exception as e:
+      db.session.rollback()
+      on_error(number, str(getattr(e, 'orig', e)).strip())
+  return imported
+
+
+def import_records(kind, records, chunk_size=None, keep_ids=False, on_error=None):
+  """Validate and insert `records` from read_records() in chunks.
+
+  Invalid rows, shows referencing unknown artists/venues or overlapping
+  other shows (see scheduling.check_schedule()) and rows the database
+  rejects are passed to `on_error(record number, message)` and skipped. Returns counts of records read, imported and failed.
+  """
+  model, form_class = KINDS[kind]
+  chunk_size = chunk_size or app.config['BULK_CHUNK_SIZE']
+  stats = {'read': 0, 'imported': 0, 'failed': 0}
+
+  def fail(number, message):
+    stats['failed'] += 1
+    if on_error is not None:
+      on_error(number, message)
+
+  records = iter(records)
+  while True:
+    chunk = list(islice(records, chunk_size))
+    if not chunk:
+      break
+    stats['read'] += len(chunk)
+    rows = []
+    for number, record, error in chunk:
+      try:
+        if error is not None:
+          raise RecordError(error)
+        rows.append((number, _validate(model, form_class, record, keep_ids)))
+      except RecordError as e:
+        fail(number, str(e))
+    if model is Show and rows:
+      missing = _missing_references(rows)
+      for number, row in rows:
+        for key in ('artist_id', 'venue_id'):
+          if (key, row[key]) in missing:
+            fail(number, f'{key} {row[key]} does not exist')
+      rows = [(number, row) for number, row in rows if not {('artist_id', row['artist_id']), ('venue_id', row['venue_id'])} & missing]
+      conflicts = check_schedule(rows)
+      for number, message in conflicts.items():
+        fail(number, message)
+      rows = [(number, row) for number, row in rows if number not in conflicts]
+    if rows:
+      stats['imported'] += _insert(model, rows, fail)
+
+  if stats['imported']:
+    if keep_ids and db.engine.dialect.name == 'postgresql':
+      table = model.__tablename__
+      db.session.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+      db.session.commit()
+    if model is Show and app.config['UPCOMING_COUNTS_TABLE']:
+      enqueue('refresh_upcoming_counts', {'full': True}, key='upcoming:full')
+      db.session.commit()
+    if model is Show and app.config['SHOW_FACETS_TABLE']:
+      queue_facets_refresh()
+      db.session.commit()
+  return stats
+
+
+def export_records(kind, fmt):
+  """Yield the rows of `kind` as CSV or NDJSON text, one row at a time."""
+  model, _ = KINDS[kind]
+  # Shows include the archived ones
+  table = all_shows if model is Show else model.__table__
+  # updated_at, deleted_at and computed columns (genre_mask) are left out, so exports import back
+  columns = [
+    column for column in table.c
+    if column.name not in ('updated_at', 'deleted_at') and getattr(column, 'computed', None) is None
+  ]
+  # Show end times go out as the show form's duration, in minutes
+  names = ['duration' if model is Show and column.name == 'end_time' else column.name for column in columns]
+  # Nor deleted venues and artists, or their shows
+  if model is Show:
+    deleted = (table.c.venue_id.notin_(deleted_ids(Venue)), table.c.artist_id.notin_(deleted_ids(Artist)))
+  else:
+    deleted = (table.c.deleted_at.is_(None),)
+  rows = db.session.query(*columns).filter(*deleted).order_by(table.c.id).\
+    execution_options(stream_results=True).yield_per(1000)
+
+  def values(row):
+    for name, value in zip(names, row):
+      if name == 'duration':
+        value = (value - row.start_time) // timedelta(minutes=1)
+      elif hasattr(value, 'strftime'):
+        value = value.strftime(DATETIME_FORMAT)
+      yield name, value
+
+  if fmt == 'ndjson':
+    for row in rows:
+      yield json.dumps(dict(values(row))) + '\n'
+    return
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(names)
+  yield buffer.getvalue()
+  for row in rows:
+    buffer.seek(0)
+    buffer.truncate()
+    writer.writerow(LIST_SEPARATOR.join(value) if isinstance(value, list) else value for _, value in values(row))
+    yield buffer.getvalue()
@@ -0,0 +1,373 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show
+from fyyur_01.formatting import request_locale, request_timezone
+from fyyur_01.replicas import reading_from
+from flask import g, request, session, make_response
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+# Entries remember the version of every tag they depend on; invalidating a
+# tag gives it a new version, so every entry that depended on it misses.
+# Tag versions are never evicted, or a stale entry could become valid again.
+# Every entry also depends on the 'all' tag, bumped by bulk changes.
+# Versions start with the time of the invalidation: a page read from a
+# replica isn't stored while a change it depends on may not have reached
+# the replica yet.
+
+
+def _new_version():
+  return f'{time.time():.6f}:{uuid.uuid4().hex}'
+
+
+def _changed_since(versions, since):
+  # Versions without a time predate it
+  return any(version and ':' in version and float(version.split(':')[0]) > since for version in versions.values())
+
+
+class LRUCache:
+  """In-process cache bounded by entry count, with per-entry TTL."""
+
+  def __init__(self, max_entries=1024, ttl=300):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.tags = {}
+    self.lock = threading.Lock()
+    self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0}
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None or entry[0] < time.time():
+        self.counters['misses'] += 1
+        return None
+      self.entries.move_to_end(key)
+      self.counters['hits'] += 1
+      return entry[1]
+
+  def set(self, key, value):
+    with self.lock:
+      self.entries[key] = (time.time() + self.ttl, value)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+        self.counters['evictions'] += 1
+
+  def stale(self):
+    # A hit whose tags were invalidated since it was stored
+    with self.lock:
+      self.counters['hits'] -= 1
+      self.counters['misses'] += 1
+      self.counters['stale'] += 1
+
+  def tag_versions(self, tags):
+    with self.lock:
+      return {tag: self.tags.get(tag) for tag in tags}
+
+  def invalidate(self, *tags):
+    with self.lock:
+      for tag in tags:
+        self.tags[tag] = _new_version()
+      self.counters['invalidations'] += len(tags)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.tags.clear()
+
+  def stats(self):
+    with self.lock:
+      return dict(self.counters, entries=len(self.entries))
+
+
+class FileSystemCache:
+  """Cache in a directory shared by all workers on a host.
+
+  Entries are pickled files named by key hash; reads touch the file so
+  eviction can drop the least recently used ones once `max_entries` is
+  exceeded. Counters, and the running count of entries that saves
+  scanning the directory on every write, are per process.
+  """
+
+  def __init__(self, directory, max_entries=1024, ttl=300):
+    self.directory = directory
+    self.tag_directory = os.path.join(directory, 'tags')
+    os.makedirs(self.tag_directory, exist_ok=True)
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0}
+    # An upper bound, since a write may replace an entry; None until scanned
+    self.count = None
+
+  def _path(self, directory, key):
+    return os.path.join(directory, hashlib.sha1(key.encode()).hexdigest())
+
+  def _read(self, path):
+    try:
+      with open(path, 'rb') as f:
+        return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+      return None
+
+  def _write(self, path, value):
+    # Write then rename, so other workers never read a partial file
+    fd, tmp = tempfile.mkstemp(dir=self.directory)
+    with os.fdopen(fd, 'wb') as f:
+      pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+  def get(self, key):
+    path = self._path(self.directory, key)
+    entry = self._read(path)
+    with self.lock:
+      if entry is None or entry[0] < time.time():
+        self.counters['misses'] += 1
+        return None
+      self.counters['hits'] += 1
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      # Evicted or cleared by another worker since it was read
+      pass
+    return entry[1]
+
+  def set(self, key, value):
+    self._write(self._path(self.directory, key), (time.time() + self.ttl, value))
+    with self.lock:
+      if self.count is not None:
+        self.count += 1
+    self._evict()
+
+  def _evict(self):
+    with self.lock:
+      if self.count is not None and self.count <= self.max_entries:
+        return
+      files = []
+      for entry in os.scandir(self.directory):
+        try:
+          if entry.is_file() and not entry.name.startswith('tmp'):
+            files.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+          continue
+      if len(files) <= self.max_entries:
+        self.count = len(files)
+        return
+      files.sort()
+      # Evict down to 90% so the next few writes don't scan again
+      keep = int(self.max_entries * 0.9)
+      for _, path in files[:len(files) - keep]:
+        try:
+          os.remove(path)
+        except FileNotFoundError:
+          continue
+        self.counters['evictions'] += 1
+      self.count = keep
+
+  def stale(self):
+    # A hit whose tags were invalidated since it was stored
+    with self.lock:
+      self.counters['hits'] -= 1
+      self.counters['misses'] += 1
+      self.counters['stale'] += 1
+
+  def tag_versions(self, tags):
+    return {tag: self._read(self._path(self.tag_directory, tag)) for tag in tags}
+
+  def invalidate(self, *tags):
+    for tag in tags:
+      self._write(self._path(self.tag_directory, tag), _new_version())
+    with self.lock:
+      self.counters['invalidations'] += len(tags)
+
+  def clear(self):
+    for directory in (self.directory, self.tag_directory):
+      for entry in os.scandir(directory):
+        if entry.is_file():
+          try:
+            os.remove(entry.path)
+          except FileNotFoundError:
+            continue
+    with self.lock:
+      self.count = None
+
+  def stats(self):
+    with self.lock:
+      entries = sum(1 for entry in os.scandir(self.directory) if entry.is_file())
+      return dict(self.counters, entries=entries)
+
+
+def make_cache(config):
+  backend = config['PAGE_CACHE_BACKEND']
+  if backend == 'memory':
+    return LRUCache(config['PAGE_CACHE_MAX_ENTRIES'], config['PAGE_CACHE_TTL'])
+  if backend == 'filesystem':
+    return FileSystemCache(config['PAGE_CACHE_DIR'], config['PAGE_CACHE_MAX_ENTRIES'], config['PAGE_CACHE_TTL'])
+  return None
+
+
+page_cache = make_cache(app.config)
+
+
+def _lookup(key):
+  entry = page_cache.get(key)
+  if entry is not None:
+    value, versions = entry
+    if page_cache.tag_versions(versions) == versions:
+      return value
+    page_cache.stale()
+  return None
+
+
+def _begin(tags):
+  # Versions are read before building, so a change committed meanwhile
+  # leaves the new entry stale rather than valid
+  g.cache_tags = set(tags) | {'all'}
+  g.cache_versions = page_cache.tag_versions(g.cache_tags)
+
+
+def _store(key, value):
+  added = page_cache.tag_versions(g.cache_tags - set(g.cache_versions))
+  versions = dict(g.cache_versions, **added)
+  if reading_from() is not None and _changed_since(versions, time.time() - app.config['REPLICA_MAX_LAG']):
+    return
+  page_cache.set(key, (value, versions))
+
+
+def remember(key, tags, build):
+  """Return the cached value for `key`, or build and cache it.
+
+  `build()` may add more tags while it runs through cache_tags(), e.g. the
+  artists listed on a venue page. Without a cache backend this is build().
+  """
+  if page_cache is None:
+    return build()
+  value = _lookup(key)
+  if value is None:
+    _begin(tags)
+    value = build()
+    _store(key, value)
+  return value
+
+
+def cached(key):
+  """The cached value of `key`, or None (always, without a cache backend)."""
+  return None if page_cache is None else _lookup(key)
+
+
+def remember_stream(key, tags, build, value=None):
+  """Return an iterator over the chunks of `build()`, caching their
+  concatenation under `key` once it is exhausted.
+
+  As with remember(), the tag versions are read now, before building;
+  `value(body)`, if given, makes the cached value out of the body. Look
+  the value up with cached().
+  """
+  if page_cache is None:
+    return build()
+  _begin(tags)
+
+  def stream():
+    chunks = []
+    for chunk in build():
+      chunks.append(chunk)
+      yield chunk
+    body = ''.join(chunks)
+    _store(key, value(body) if value is not None else body)
+  return stream()
+
+
+def cache_tags(*tags):
+  """Record more tags the value being built by remember() depends on."""
+  if 'cache_tags' in g:
+    g.cache_tags.update(tags)
+
+
+def cached_page(*tags):
+  """Cache a GET view's rendered page, tagged by `tags`.
+
+  Tags are formatted with the view arguments, e.g. 'venue:{venue_id}'.
+  Pages with pending flash messages, errors and streamed responses are
+  not cached.
+  """
+  def decorator(view):
+    @wraps(view)
+    def wrapper(**kwargs):
+      if page_cache is None or '_flashes' in session:
+        return view(**kwargs)
+      # Pages differ by the locale and timezone their dates are shown in
+      key = f'page:{request_locale()}:{request_timezone()}:{request.full_path}'
+      page = _lookup(key)
+      if page is not None:
+        return app.response_class(page[0], mimetype=page[1])
+      _begin(tag.format(**kwargs) for tag in tags)
+      response = make_response(view(**kwargs))
+      if response.status_code == 200 and not response.is_streamed:
+        _store(key, (response.get_data(), response.mimetype))
+      return response
+    return wrapper
+  return decorator
+
+
+#  Invalidation
+#  ----------------------------------------------------------------
+
+def _changed_tags(target):
+  if isinstance(target, Venue):
+    return {'venues', f'venue:{target.id}'}
+  if isinstance(target, Artist):
+    return {'artists', f'artist:{target.id}'}
+  return {'shows', f'venue:{target.venue_id}', f'artist:{target.artist_id}'}
+
+
+def mark_changed(*tags):
+  """Invalidate `tags` when the current transaction commits.
+
+  For writes that bypass the ORM events below, e.g. Core bulk inserts.
+  """
+  db.session.info.setdefault('changed_cache_tags', set()).update(tags)
+
+
+def _collect_changed_tags(mapper, connection, target):
+  mark_changed(*_changed_tags(target))
+
+
+for _model in (Venue, Artist, Show):
+  for _event in ('after_insert', 'after_update', 'after_delete'):
+    db.event.listen(_model, _event, _collect_changed_tags)
+
+
+def _collect_bulk_change(context):
+  # Query.update()/delete() don't say which rows they touched: drop everything
+  # (but not for bookkeeping tables such as jobs, nor for the upcoming show
+  # counts, whose jobs mark the owners they recount)
+  if context.mapper is not None and context.mapper.class_ in (Venue, Artist, Show):
+    mark_changed('all')
+
+
+db.event.listen(db.session, 'after_bulk_update', _collect_bulk_change)
+db.event.listen(db.session, 'after_bulk_delete', _collect_bulk_change)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_tags(session):
+  # Invalidate only once the change is visible to other transactions
+  tags = session.info.pop('changed_cache_tags', None)
+  if tags and page_cache is not None:
+    page_cache.invalidate(*tags)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _discard_changed_tags(session):
+  session.info.pop('changed_cache_tags', None)
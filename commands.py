@@ -0,0 +1,173 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, refresh_upcoming_counts
+from fyyur_01.discovery import refresh_show_facets
+from fyyur_01.partitions import partitioned, roll_show_partitions
+from fyyur_01.bulk import KINDS, FORMATS, read_records, import_records, export_records
+from fyyur_01.assets import build_assets
+from fyyur_01.seed import SCALES, seed
+from fyyur_01.jobs import work
+from fyyur_01.payloads import venues_data, venue_data, artists_data, artist_data, search_data, shows_data
+from datetime import datetime, timedelta
+import click
+import re
+
+#----------------------------------------------------------------------------#
+# CLI commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('refresh-upcoming-counts')
+@click.option('--full', is_flag=True, help='Rebuild the whole counts table.')
+def refresh_upcoming_counts_command(full):
+  """Recount upcoming shows for venues/artists whose next show has started."""
+  click.echo(f'{refresh_upcoming_counts(full)} upcoming show counts refreshed')
+
+
+@app.cli.command('refresh-show-facets')
+def refresh_show_facets_command():
+  """Rebuild the upcoming show facet counts used by /discover/shows."""
+  click.echo(f'{refresh_show_facets()} show facet rows refreshed')
+
+
+@app.cli.command('roll-show-partitions')
+def roll_show_partitions_command():
+  """Create the coming months' show partitions and archive old months.
+
+  Queues the next run a day later, so running it once keeps a worker
+  rolling the partitions.
+  """
+  if not partitioned():
+    raise click.ClickException('the shows table is not partitioned (run `flask db upgrade` on Postgres)')
+  rolled = roll_show_partitions()
+  click.echo(f"{len(rolled['created'])} partitions created, {len(rolled['archived'])} archived")
+
+
+@app.cli.command('worker')
+@click.option('--burst', is_flag=True, help='Exit once no jobs are due.')
+def worker_command(burst):
+  """Run background jobs (set JOBS_WORKER = 'worker' to run them only here)."""
+  work(burst=burst)
+
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(KINDS))
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--chunk-size', type=int, help='Rows per insert batch.')
+@click.option('--keep-ids', is_flag=True, help='Insert the ids given in the file.')
+def import_command(kind, file, fmt, chunk_size, keep_ids):
+  """Import venues, artists or shows from a CSV or NDJSON file."""
+  fmt = fmt or ('ndjson' if file.name.endswith(('.ndjson', '.jsonl')) else 'csv')
+  on_error = lambda number, message: click.echo(f'record {number}: {message}', err=True)
+  stats = import_records(kind, read_records(file, fmt), chunk_size, keep_ids, on_error)
+  click.echo(f"{stats['imported']} of {stats['read']} {kind} imported, {stats['failed']} failed")
+
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(KINDS))
+@click.argument('file', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv')
+def export_command(kind, file, fmt):
+  """Export venues, artists or shows as CSV or NDJSON."""
+  for chunk in export_records(kind, fmt):
+    file.write(chunk)
+
+
+@app.cli.command('seed')
+@click.option('--scale', type=click.Choice(SCALES), default='small', show_default=True,
+              help='small: 1k shows, medium: 100k, large: 1M.')
+@click.option('--seed', 'seed_value', type=int, default=0, show_default=True, help='Random seed.')
+@click.option('--reset', is_flag=True, help='Delete all venues, artists and shows first.')
+@click.option('--chunk-size', type=int, help='Rows per insert batch.')
+def seed_command(scale, seed_value, reset, chunk_size):
+  """Fill the database with reproducible synthetic data."""
+  counts = seed(scale, seed_value, reset, chunk_size)
+  click.echo(', '.join(f'{count} {table}' for table, count in counts.items()) + ' inserted')
+
+
+@app.cli.command('roll-upcoming-index')
+@click.option('--days', default=7, show_default=True, help='Keep shows that started this many days ago.')
+def roll_upcoming_index_command(days):
+  """Rebuild the partial indexes over upcoming shows with a newer cutoff.
+
+  Partial index predicates can't use now(), so they cover shows after a
+  fixed date; run this periodically (e.g. weekly) to keep them small.
+  """
+  if partitioned():
+    raise click.ClickException('the shows table is partitioned by month: upcoming queries already skip past months')
+  cutoff = (datetime.utcnow() - timedelta(days=days)).date()
+  suffix = cutoff.strftime('%Y%m%d')
+  with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+    old = [name for name, in connection.execute(
+      "SELECT indexname FROM pg_indexes WHERE tablename = 'shows' AND indexname LIKE 'ix_shows_upcoming_%%'"
+    ) if not name.endswith(suffix)]
+    for column in ('venue_id', 'artist_id'):
+      connection.execute(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_shows_upcoming_{column}_{suffix} '
+        f"ON shows ({column}, start_time) WHERE start_time >= '{cutoff.isoformat()}'"
+      )
+    for name in old:
+      connection.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+  click.echo(f'upcoming show indexes now start at {cutoff.isoformat()}')
+
+
+@app.cli.command('db-explain')
+@click.option('--seq-scan', 'seq_scan_tables', multiple=True, default=['shows'], show_default=True,
+              help='Fail when a plan sequentially scans this table.')
+def db_explain_command(seq_scan_tables):
+  """EXPLAIN ANALYZE the queries behind each read route.
+
+  Exits with status 1 when a plan does a sequential scan of one of the
+  --seq-scan tables, so it can run in CI against a seeded database.
+  """
+  venue_id = db.session.query(db.func.min(Venue.id)).scalar()
+  artist_id = db.session.query(db.func.min(Artist.id)).scalar()
+  routes = [
+    ('/venues', venues_data),
+    (f'/venues/{venue_id}', lambda: venue_data(venue_id, page_size=app.config['SHOW_TIMELINE_PAGE_SIZE'])),
+    ('/venues/search', lambda: search_data(Venue, 'the')),
+    ('/artists', artists_data),
+    (f'/artists/{artist_id}', lambda: artist_data(artist_id, page_size=app.config['SHOW_TIMELINE_PAGE_SIZE'])),
+    ('/artists/search', lambda: search_data(Artist, 'the')),
+    ('/shows', lambda: list(shows_data(start=datetime.utcnow()))),
+  ]
+  postgres = db.engine.dialect.name == 'postgresql'
+  prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if postgres else 'EXPLAIN QUERY PLAN '
+
+  statements = []
+  def capture(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith('SELECT'):
+      statements.append((statement, parameters))
+
+  failed = False
+  for route, build in routes:
+    click.secho(route, bold=True)
+    statements.clear()
+    db.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+      with app.test_request_context(route):
+        build()
+    finally:
+      db.event.remove(db.engine, 'before_cursor_execute', capture)
+    for statement, parameters in list(statements):
+      # The captured statement and parameters are in the DBAPI's paramstyle
+      plan = [str(row[-1]) for row in db.engine.execute(prefix + statement, parameters)]
+      click.echo(statement.strip())
+      for line in plan:
+        scanned = re.search(r'Seq Scan on (\w+)', line)
+        # Monthly partitions count as their table (the default one is
+        # expected to stay near empty)
+        flagged = scanned and re.sub(r'_y\d{4}m\d{2}$', '', scanned.group(1)) in seq_scan_tables
+        failed = failed or bool(flagged)
+        click.secho('  ' + line, fg='red' if flagged else None)
+      click.echo()
+  db.session.rollback()
+  if failed:
+    raise SystemExit(1)
+
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Delete bundles of earlier builds.')
+def build_assets_command(clean):
+  """Bundle, minify, fingerprint and precompress the static CSS and JS."""
+  for name, filename in build_assets(clean).items():
+    click.echo(f'{name} -> {filename}')
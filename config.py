@@ -1,13 +1,204 @@
 import os
 
-SECRET_KEY = os.urandom(32)
+# Shared by every worker process, so sessions and flashed messages survive
+# across them and restarts; the development and testing profiles set one
+SECRET_KEY = os.environ.get('FYYUR_SECRET_KEY')
 
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-# Enable debug mode.
-DEBUG = True
+# Debug mode: see the development profile.
+DEBUG = False
 
 # DB config
-SQLALCHEMY_DATABASE_URI = 'postgres://localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgres://localhost:5432/fyyur')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool, per worker process: size the pool so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays under max_connections.
+# Pool checkout counts and wait times are served at /db/pool.
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 10
+DB_POOL_RECYCLE = 1800
+DB_POOL_PRE_PING = True
+# Milliseconds; 0 disables
+DB_STATEMENT_TIMEOUT = 5000
+# Running behind PgBouncer in transaction pooling mode: no connection
+# startup options, statement_timeout is set per transaction (psycopg2
+# never uses server-side prepared statements)
+DB_PGBOUNCER = False
+# Read replicas, e.g. ['postgresql://replica-1/fyyur']: GET requests and
+# searches read from them in turn. A client that wrote reads from the
+# primary for REPLICA_PIN_SECONDS (keep it above REPLICA_MAX_LAG). Replicas
+# more than REPLICA_MAX_LAG seconds behind, or unreachable, are left out
+# until a check, every REPLICA_CHECK_INTERVAL seconds, finds them caught up
+SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split() if uri]
+REPLICA_PIN_SECONDS = 10
+REPLICA_MAX_LAG = 5
+REPLICA_CHECK_INTERVAL = 10
+# Threads per process running a page's independent queries concurrently
+# (0: in turn), each holding a connection while it runs: keep request
+# threads + PAGE_QUERY_THREADS within DB_POOL_SIZE + DB_MAX_OVERFLOW
+PAGE_QUERY_THREADS = 4
+
+# Number of city/state groups per page on /venues?page=N
+VENUE_AREAS_PER_PAGE = 20
+
+# Shows per past/upcoming section on venue and artist pages (None for all)
+SHOW_TIMELINE_PAGE_SIZE = 50
+
+# Serve upcoming show counts from the materialized upcoming_show_counts table
+# (run `flask refresh-upcoming-counts` periodically when enabled)
+UPCOMING_COUNTS_TABLE = False
+
+# Venue/artist search results per page
+SEARCH_RESULTS_PER_PAGE = 20
+
+# Discovery (/discover) results per page. Facet counts of upcoming shows come
+# from the upcoming_show_facets table, rebuilt by a background job
+# SHOW_FACETS_REFRESH_DELAY seconds after shows change and SHOW_FACETS_MAX_AGE
+# seconds after each rebuild; pages count the shows instead when it is twice
+# that old, e.g. with no worker running (False: count the shows on every
+# request)
+DISCOVERY_RESULTS_PER_PAGE = 20
+SHOW_FACETS_TABLE = True
+SHOW_FACETS_REFRESH_DELAY = 10
+SHOW_FACETS_MAX_AGE = 300
+
+# Show durations in minutes: the default when none is given, and the
+# longest accepted. Overlap checks look back this far, so don't lower it
+# below the longest show already listed
+SHOW_DEFAULT_DURATION = 120
+SHOW_MAX_DURATION = 720
+
+# Monthly show partitions (Postgres): roll_show_partitions, queued daily
+# once `flask roll-show-partitions` has run, keeps SHOW_PARTITIONS_AHEAD
+# months of partitions ahead and moves shows to the shows_archive table
+# SHOW_ARCHIVE_AFTER_MONTHS months after their month
+SHOW_PARTITIONS_AHEAD = 12
+SHOW_ARCHIVE_AFTER_MONTHS = 12
+
+# Matchmaking (/api/v1/artists/<id>/matches, /api/v1/venues/<id>/matches):
+# the weight of each signal, the most frequent show partners kept per venue
+# and artist, and how long a process keeps its index before rebuilding it
+MATCHING_WEIGHTS = {'genres': 0.4, 'place': 0.25, 'shows': 0.25, 'seeking': 0.1}
+MATCHING_PARTNERS = 20
+MATCHING_INDEX_TTL = 600
+MATCHING_MAX_RESULTS = 50
+
+# Shows per page on /shows, and whether to stream the page by default
+SHOWS_PER_PAGE = 100
+SHOWS_STREAMING = False
+
+# Page cache: 'memory' (per process; use 'filesystem' with several workers so
+# invalidations reach all of them) or None to disable
+PAGE_CACHE_BACKEND = 'memory'
+PAGE_CACHE_TTL = 300
+PAGE_CACHE_MAX_ENTRIES = 1024
+PAGE_CACHE_DIR = os.path.join(basedir, 'cache', 'pages')
+
+# Calendar (iCalendar) and RSS feeds list the upcoming shows of the next
+# FEED_DAYS days, at most FEED_MAX_SHOWS of them
+FEED_DAYS = 180
+FEED_MAX_SHOWS = 1000
+
+# Bulk import: rows per executemany batch, and errors kept in upload reports
+BULK_CHUNK_SIZE = 1000
+BULK_MAX_REPORTED_ERRORS = 100
+
+# Dates are shown in the best Accept-Language match among SUPPORTED_LOCALES,
+# and in the timezone named by the `tz` cookie (None: as stored)
+DATETIME_LOCALE = 'en_US'
+SUPPORTED_LOCALES = ['en_US', 'en_GB', 'de', 'fr', 'es', 'el']
+DATETIME_TIMEZONE = None
+DATETIME_FORMAT_CACHE_SIZE = 4096
+
+# Templates are compiled when the app is created (TEMPLATE_PRELOAD), so
+# workers forked by gunicorn --preload share them, and their bytecode is
+# cached in TEMPLATE_CACHE_DIR (None to disable) across restarts
+TEMPLATE_PRELOAD = True
+TEMPLATE_CACHE_DIR = os.path.join(basedir, 'cache', 'templates')
+
+# Static asset bundles are built into static/<ASSETS_DIR> by `flask build-assets`;
+# until then templates link the source files
+ASSETS_DIR = 'dist'
+ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+
+# Request instrumentation: phase timings (sent as a Server-Timing header),
+# slow query logging, repeated statement (N+1) warnings and /metrics (see
+# DIAGNOSTIC_ROUTES)
+INSTRUMENTATION = True
+SLOW_QUERY_SECONDS = 0.25
+REPEATED_QUERY_THRESHOLD = 5
+
+# Profile this fraction of requests, keeping profiles of those slower than
+# PROFILE_THRESHOLD seconds (pyinstrument HTML if installed, else cProfile)
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_THRESHOLD = 0.5
+PROFILE_DIR = os.path.join(basedir, 'profiles')
+
+# Background jobs run in a thread of each web process ('thread'), or only in
+# `flask worker` processes ('worker'). Failed jobs are retried after
+# JOBS_RETRY_DELAY seconds, doubling per attempt.
+JOBS_WORKER = 'thread'
+JOBS_POLL_INTERVAL = 1.0
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 2
+# Seconds after which a running job is taken to have lost its worker
+JOBS_LOCK_TIMEOUT = 300
+JOBS_RETENTION_DAYS = 7
+
+# Serve the diagnostic routes, which show internals to anyone: /jobs and
+# /jobs/<id> (job arguments and errors), /metrics (SQL timings and pool
+# internals), /cache/stats and /db/pool. Enabled by the development and
+# testing profiles
+DIAGNOSTIC_ROUTES = False
+
+# Deleting a venue or artist hides it at once; DELETION_PURGE_DELAY seconds
+# later a job starts removing its shows, DELETION_BATCH_SIZE per
+# transaction, then the venue or artist itself. Until then it can be
+# undeleted (with the shows not yet purged).
+DELETION_PURGE_DELAY = 60
+DELETION_BATCH_SIZE = 500
+
+# Image proxy: venue/artist image_links are fetched by IMAGE_FETCHER ('http',
+# 'file' to read them from IMAGE_FETCH_DIR, or None to link them directly),
+# resized and cached on disk. Needs Pillow.
+IMAGE_FETCHER = 'http'
+IMAGE_FETCH_DIR = None
+IMAGE_FETCH_TIMEOUT = 5
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_CACHE_DIR = os.path.join(basedir, 'cache', 'images')
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+#----------------------------------------------------------------------------#
+# Profiles.
+#----------------------------------------------------------------------------#
+
+# create_app() applies the profile named by FYYUR_CONFIG (default: Production)
+# over the settings above. Production takes its secret key and database from
+# the environment (FYYUR_SECRET_KEY, DATABASE_URL), and won't start without
+# the key.
+
+class Development:
+  DEBUG = True
+  DIAGNOSTIC_ROUTES = True
+  SECRET_KEY = SECRET_KEY or 'development'
+  # Templates are reloaded as they change
+  TEMPLATE_PRELOAD = False
+
+
+class Testing:
+  TESTING = True
+  DIAGNOSTIC_ROUTES = True
+  SECRET_KEY = SECRET_KEY or 'testing'
+  WTF_CSRF_ENABLED = False
+  PROFILE_SAMPLE_RATE = 0.0
+
+
+class Production:
+  # Invalidations must reach every worker
+  PAGE_CACHE_BACKEND = 'filesystem'
@@ -0,0 +1,186 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, ShowArchive, UpcomingShowCount, all_shows
+from fyyur_01.jobs import job, enqueue
+from fyyur_01.cache import mark_changed
+from datetime import datetime
+
+#----------------------------------------------------------------------------#
+# Deletion.
+#----------------------------------------------------------------------------#
+
+# Deleting a venue or artist only sets its deleted_at, which hides it, and
+# through it its shows, from every query (see models.py): the request
+# doesn't wait on, or lock, its shows. DELETION_PURGE_DELAY seconds later
+# purge_deletion() starts deleting its shows and archived shows,
+# DELETION_BATCH_SIZE per transaction, each batch queueing the next, and
+# deletes the venue or artist once they are gone. A Deletion row records
+# the progress. Until the purge is done, undelete() restores the venue or
+# artist with the shows not purged yet.
+#
+# Page cache tags, search and match indexes and the facets table follow
+# from the venue or artist being updated, then deleted; undeleting drops
+# every cached page, as any page built meanwhile may have left it out. The
+# upcoming show counts of the venues or artists it had upcoming shows with
+# are recounted on deletion and undeletion. Purging hidden shows changes no
+# page, so the batches leave the caches alone.
+
+OWNERS = {'venue': Venue, 'artist': Artist}
+COUNTERPARTS = {'venue': 'artist', 'artist': 'venue'}
+
+PENDING = 'pending'
+PURGING = 'purging'
+DONE = 'done'
+UNDONE = 'undone'
+
+
+class Deletion(db.Model):
+  """The deletion of a venue or artist, and how far the purge of its shows
+  has got."""
+  __tablename__ = 'deletions'
+  __table_args__ = (
+    db.Index('ix_deletions_owner', 'owner_type', 'owner_id'),
+  )
+
+  id = db.Column(db.Integer, primary_key=True)
+  owner_type = db.Column(db.String(10), nullable=False)
+  owner_id = db.Column(db.Integer, nullable=False)
+  status = db.Column(db.String(10), nullable=False, default=PENDING)
+  # Shows and archived shows when it was deleted, and purged since
+  shows_total = db.Column(db.Integer, nullable=False)
+  shows_purged = db.Column(db.Integer, nullable=False, default=0)
+  # The venue's or artist's deleted_at
+  requested_at = db.Column(db.DateTime, nullable=False)
+  finished_at = db.Column(db.DateTime, nullable=True)
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+  @property
+  def undoable(self):
+    return self.status in (PENDING, PURGING)
+
+  def to_dict(self):
+    return {
+      'id': self.id,
+      'owner_type': self.owner_type,
+      'owner_id': self.owner_id,
+      'status': self.status,
+      'shows_total': self.shows_total,
+      'shows_purged': self.shows_purged,
+      'progress': 1.0 if self.status == DONE else round(min(self.shows_purged / (self.shows_total or 1), 1.0), 3),
+      'undoable': self.undoable,
+      'requested_at': self.requested_at.isoformat(),
+      'finished_at': self.finished_at.isoformat() if self.finished_at else None
+    }
+
+  def __repr__(self):
+    return f'Deletion {self.id}: {self.owner_type} {self.owner_id} ({self.status})'
+
+
+def _owner(owner_type, owner_id):
+  # The venue or artist, deleted or not, locked until the transaction ends
+  model = OWNERS[owner_type]
+  return model.query.execution_options(include_deleted=True).filter(model.id == owner_id).with_for_update().first()
+
+
+def _recount_counterparts(owner_type, owner_id):
+  # The counterparts' counts leave out shows with deleted venues or artists
+  if not app.config['UPCOMING_COUNTS_TABLE']:
+    return
+  counterpart_type = COUNTERPARTS[owner_type]
+  owner_fk, counterpart_fk = getattr(Show, f'{owner_type}_id'), getattr(Show, f'{counterpart_type}_id')
+  ids = [id for id, in db.session.query(counterpart_fk).filter(owner_fk == owner_id, Show.start_time > datetime.utcnow()).distinct()]
+  if ids:
+    enqueue('recount_upcoming', {'owner_type': counterpart_type, 'ids': ids})
+
+
+def soft_delete(owner_type, owner_id):
+  """Hide venue or artist `owner_id` and queue the purge of its shows.
+
+  Returns the Deletion, or None if there is no such venue or artist (or
+  it is already deleted). Applied when the session commits.
+  """
+  owner = _owner(owner_type, owner_id)
+  if owner is None or owner.deleted_at is not None:
+    return None
+  owner.deleted_at = datetime.utcnow()
+  owner_fk = all_shows.c[f'{owner_type}_id']
+  total = db.session.query(db.func.count()).select_from(all_shows).filter(owner_fk == owner_id).scalar()
+  deletion = Deletion(
+    owner_type=owner_type, owner_id=owner_id, status=PENDING, shows_total=total, shows_purged=0,
+    requested_at=owner.deleted_at
+  )
+  db.session.add(deletion)
+  db.session.flush()
+  enqueue(
+    'purge_deletion', {'deletion_id': deletion.id},
+    key=f'deletion:{deletion.id}', delay=app.config['DELETION_PURGE_DELAY']
+  )
+  _recount_counterparts(owner_type, owner_id)
+  return deletion
+
+
+def undelete(deletion):
+  """Restore the venue or artist of `deletion`, with its shows not purged
+  yet.
+
+  Returns False if it can't be undone any more: the purge is done, or it
+  was already undone. Applied when the session commits.
+  """
+  # Waits for a purge batch in progress, then sees where it got to
+  owner = _owner(deletion.owner_type, deletion.owner_id)
+  db.session.refresh(deletion)
+  if owner is None or owner.deleted_at != deletion.requested_at:
+    return False
+  owner.deleted_at = None
+  # Pages built while it was deleted don't carry its tag
+  mark_changed('all')
+  deletion.status = UNDONE
+  deletion.finished_at = datetime.utcnow()
+  _recount_counterparts(deletion.owner_type, deletion.owner_id)
+  return True
+
+
+@job('purge_deletion')
+def purge_deletion(deletion_id):
+  """Delete the next DELETION_BATCH_SIZE shows of a deleted venue or
+  artist and queue the next batch, or with none left, the venue or artist.
+
+  Returns the number of shows deleted.
+  """
+  deletion = Deletion.query.get(deletion_id)
+  if deletion is None or not deletion.undoable:
+    return 0
+  # Locked, so undelete() waits for this batch, or this batch for it
+  owner = _owner(deletion.owner_type, deletion.owner_id)
+  if owner is None or owner.deleted_at != deletion.requested_at:
+    return 0
+  limit = app.config['DELETION_BATCH_SIZE']
+  purged = 0
+  for model in (Show, ShowArchive):
+    if purged == limit:
+      break
+    owner_fk = getattr(model, f'{deletion.owner_type}_id')
+    rows = db.session.query(model.id, model.start_time).filter(owner_fk == owner.id).\
+      order_by(model.start_time).limit(limit - purged).all()
+    if not rows:
+      continue
+    # Core deletes: Query.delete() would invalidate every cached page. The
+    # start_time range prunes the shows partitions.
+    table = model.__table__
+    db.session.execute(table.delete().where(owner_fk == owner.id).where(
+      table.c.start_time.between(rows[0].start_time, rows[-1].start_time)
+    ).where(table.c.id.in_([row.id for row in rows])))
+    purged += len(rows)
+
+  deletion.shows_purged += purged
+  if purged == limit:
+    deletion.status = PURGING
+    enqueue('purge_deletion', {'deletion_id': deletion.id}, key=f'deletion:{deletion.id}')
+  else:
+    # Shows listed since, if any, go with it through ON DELETE CASCADE
+    counts = UpcomingShowCount.__table__
+    db.session.execute(counts.delete().where(counts.c.owner_type == deletion.owner_type).where(counts.c.owner_id == owner.id))
+    db.session.delete(owner)
+    deletion.status = DONE
+    deletion.finished_at = datetime.utcnow()
+  db.session.commit()
+  return purged
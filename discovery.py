@@ -0,0 +1,198 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, genres_filter, show_listing
+from fyyur_01.enums import GENRE_BITS, genre_mask
+from fyyur_01.jobs import job, enqueue
+from datetime import datetime, timedelta
+
+#----------------------------------------------------------------------------#
+# Discovery.
+#----------------------------------------------------------------------------#
+
+# Venues, artists and upcoming shows filtered by genres, state, city and
+# seeking flag, with the number of matches per genre and per state
+# (facets). A show's genres are its artist's, its state and city its
+# venue's. Genre filters use the GIN-indexed genres arrays; genre facets
+# add up the bits of the genre_mask columns in a single pass.
+#
+# Each facet leaves out its own filter, so it counts what picking another
+# value would give: genre counts apply every filter but the genres, state
+# counts every filter but state and city.
+
+SEEKING = {Venue: Venue.seeking_talent, Artist: Artist.seeking_venue}
+
+
+class ShowFacetCount(db.Model):
+  """Upcoming shows per venue state and city and artist genre mask.
+
+  Facet counts of upcoming shows (SHOW_FACETS_TABLE) add up these rows
+  instead of joining every upcoming show to its venue and artist. Rebuilt
+  by refresh_show_facets() after shows, or the venues and artists they
+  belong to, change, and every SHOW_FACETS_MAX_AGE seconds after that.
+  """
+  __tablename__ = 'upcoming_show_facets'
+
+  id = db.Column(db.Integer, primary_key=True)
+  state = db.Column(db.String(120))
+  city = db.Column(db.String(120))
+  genre_mask = db.Column(db.Integer, nullable=False)
+  num_shows = db.Column(db.Integer, nullable=False)
+  refreshed_at = db.Column(db.DateTime, nullable=False)
+
+  def __repr__(self):
+    return f'ShowFacetCount {self.city}, {self.state} {self.genre_mask}: {self.num_shows}'
+
+
+#  Filters and facets
+#  ----------------------------------------------------------------
+
+def _criteria(filters, state, city, genres=None, mask=None, seeking=None):
+  # Criteria by the facet they narrow: 'genres', 'place' or 'other'.
+  # Genres are matched on the `genres` array when given, else on `mask`.
+  criteria = {'genres': [], 'place': [], 'other': []}
+  if filters['genres']:
+    if genres is not None:
+      criteria['genres'].append(genres_filter(genres, filters['genres'], filters['match_all']))
+    else:
+      bits = genre_mask(filters['genres'])
+      matched = mask.op('&')(bits)
+      criteria['genres'].append(matched == bits if filters['match_all'] else matched != 0)
+  if filters['state']:
+    criteria['place'].append(state == filters['state'])
+  if filters['city']:
+    criteria['place'].append(city == filters['city'])
+  if filters['seeking'] is not None and seeking is not None:
+    criteria['other'].append(seeking == filters['seeking'])
+  return criteria
+
+
+def _except(criteria, facet=None):
+  return [criterion for name, group in criteria.items() if name != facet for criterion in group]
+
+
+def _facets(query, criteria, mask, state, weight):
+  """Genre and state counts over `query`, each `weight` per row."""
+  sums = [
+    db.func.coalesce(db.func.sum(mask.op('>>')(position).op('&')(1) * weight), 0)
+    for position in range(len(GENRE_BITS))
+  ]
+  genre_counts = query.filter(*_except(criteria, 'genres')).with_entities(*sums).one()
+  state_counts = query.filter(*_except(criteria, 'place')).\
+    with_entities(state, db.func.sum(weight)).group_by(state).order_by(state)
+  return {
+    'genres': {genre: count for genre, count in zip(GENRE_BITS, genre_counts) if count},
+    'states': {name: count for name, count in state_counts if name}
+  }
+
+
+#  Venues and artists
+#  ----------------------------------------------------------------
+
+def discover_owners(model, filters, page=1, per_page=None):
+  """Venues or artists matching `filters`, by name.
+
+  Returns `(count, rows, facets)`: the number of matches, the requested
+  page of (id, name, city, state, genres) rows and the facet counts.
+  """
+  per_page = per_page or app.config['DISCOVERY_RESULTS_PER_PAGE']
+  criteria = _criteria(filters, model.state, model.city, genres=model.genres, seeking=SEEKING[model])
+  rows = db.session.query(
+    model.id, model.name, model.city, model.state, model.genres, db.func.count().over().label('count')
+  ).filter(*_except(criteria)).order_by(model.name, model.id).limit(per_page).offset((page - 1) * per_page).all()
+  facets = _facets(db.session.query(model), criteria, model.genre_mask, model.state, db.literal(1))
+  return (rows[0].count if rows else 0), rows, facets
+
+
+#  Upcoming shows
+#  ----------------------------------------------------------------
+
+def discover_shows(filters, after=None, limit=None, now=None):
+  """Upcoming shows matching `filters`, as show_listing() rows."""
+  query = show_listing(
+    start=now or datetime.utcnow(), after=after, limit=limit or app.config['DISCOVERY_RESULTS_PER_PAGE'],
+    genres=filters['genres'] or None, match_all=filters['match_all'], state=filters['state'], city=filters['city']
+  )
+  # Not streamed: Postgres plans server-side cursors for the first rows,
+  # scanning shows by start time even when few match the filters
+  return query.execution_options(stream_results=False).all()
+
+
+def show_facets(filters, now=None):
+  """`(count, facets)` of the upcoming shows matching `filters`.
+
+  Counted from the upcoming_show_facets table when SHOW_FACETS_TABLE is
+  enabled and it has been refreshed lately, else from the shows
+  themselves. Read-only: the table is refreshed by jobs alone.
+  """
+  now = now or datetime.utcnow()
+  refreshed_at = None
+  if app.config['SHOW_FACETS_TABLE']:
+    # Refreshed at least every SHOW_FACETS_MAX_AGE seconds while a worker
+    # runs; older rows mean it doesn't, and aren't used
+    refreshed_at = db.session.query(db.func.max(ShowFacetCount.refreshed_at)).scalar()
+    if refreshed_at is not None and refreshed_at < now - timedelta(seconds=2 * app.config['SHOW_FACETS_MAX_AGE']):
+      refreshed_at = None
+  if refreshed_at is not None:
+    query = db.session.query(ShowFacetCount)
+    mask, state, city, weight = ShowFacetCount.genre_mask, ShowFacetCount.state, ShowFacetCount.city, ShowFacetCount.num_shows
+  else:
+    query = db.session.query(Show).join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id).\
+      filter(Show.start_time >= now, Venue.deleted_at.is_(None), Artist.deleted_at.is_(None))
+    mask, state, city, weight = Artist.genre_mask, Venue.state, Venue.city, db.literal(1)
+  criteria = _criteria(filters, state, city, mask=mask)
+  count = query.filter(*_except(criteria)).with_entities(db.func.coalesce(db.func.sum(weight), 0)).scalar()
+  return count, _facets(query, criteria, mask, state, weight)
+
+
+@job('refresh_show_facets')
+def refresh_show_facets():
+  """Rebuild the upcoming_show_facets table; returns the number of rows."""
+  now = datetime.utcnow()
+  query = db.session.query(Venue.state, Venue.city, Artist.genre_mask, db.func.count(Show.id)).\
+    select_from(Show).join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id).\
+    filter(Show.start_time >= now).group_by(Venue.state, Venue.city, Artist.genre_mask)
+  rows = [
+    {'state': state, 'city': city, 'genre_mask': mask, 'num_shows': num_shows, 'refreshed_at': now}
+    for state, city, mask, num_shows in query
+  ]
+  # Readers see the old rows until the new ones are committed
+  db.session.query(ShowFacetCount).delete(synchronize_session=False)
+  db.session.bulk_insert_mappings(ShowFacetCount, rows)
+  # Shows become past without changing: refresh again once these rows are
+  # SHOW_FACETS_MAX_AGE old, unless that refresh is already queued
+  enqueue('refresh_show_facets', key='facets:shows:expiry', delay=app.config['SHOW_FACETS_MAX_AGE'])
+  db.session.commit()
+  return len(rows)
+
+
+def queue_facets_refresh(delay=None, connection=None):
+  """Queue a rebuild of the facets table, unless one is already queued."""
+  if delay is None:
+    delay = app.config['SHOW_FACETS_REFRESH_DELAY']
+  enqueue('refresh_show_facets', key='facets:shows', delay=delay, connection=connection)
+
+
+def _queue_refresh(mapper, connection, target):
+  if app.config['SHOW_FACETS_TABLE']:
+    queue_facets_refresh(connection=connection)
+
+
+def _queue_refresh_if_moved(mapper, connection, target):
+  # Only a venue's or artist's place and genres are counted, and whether
+  # it is deleted
+  attrs = db.inspect(target).attrs
+  if any(attrs[name].history.has_changes() for name in ('state', 'city', 'genres', 'deleted_at')):
+    _queue_refresh(mapper, connection, target)
+
+
+def _queue_bulk_refresh(context):
+  if context.mapper is not None and context.mapper.class_ in (Venue, Artist, Show) and app.config['SHOW_FACETS_TABLE']:
+    queue_facets_refresh()
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+  db.event.listen(Show, _event, _queue_refresh)
+for _model in (Venue, Artist):
+  db.event.listen(_model, 'after_update', _queue_refresh_if_moved)
+  db.event.listen(_model, 'after_delete', _queue_refresh)
+db.event.listen(db.session, 'after_bulk_update', _queue_bulk_refresh)
+db.event.listen(db.session, 'after_bulk_delete', _queue_bulk_refresh)
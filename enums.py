@@ -82,3 +82,29 @@ class Genre(enum.Enum):
     @classmethod
     def choices(cls):
         return [(choice.value, choice.name) for choice in cls]
+
+
+# Genres as bits of an integer: a genre's bit is its position in Genre, so
+# new genres must be added at the end
+GENRE_BITS = {genre.value: 1 << position for position, genre in enumerate(Genre)}
+
+
+def genre_mask(genres):
+    """The bitmask of a list of genre values; unknown values are ignored."""
+    mask = 0
+    for genre in genres or ():
+        mask |= GENRE_BITS.get(genre, 0)
+    return mask
+
+
+def mask_genres(mask):
+    """The genre values whose bits are set in `mask`."""
+    return [genre for genre, bit in GENRE_BITS.items() if mask & bit]
+
+
+def genre_mask_sql(column):
+    """SQL computing the bitmask of the genre values in array `column`."""
+    return ' | '.join(
+        "(CASE WHEN '{}' = ANY({}) THEN {} ELSE 0 END)".format(genre.replace("'", "''"), column, bit)
+        for genre, bit in GENRE_BITS.items()
+    )
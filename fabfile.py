@@ -6,8 +6,9 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
+        # Runs each route benchmark once as a smoke test
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m pytest benchmarks -q --benchmark-disable", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
@@ -39,9 +40,9 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    # The benchmarks write to the database, so production only gets the
+    # read-only query plan check
+    local("heroku run flask db-explain")
 
 
 def deploy():
@@ -0,0 +1,269 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, genres_filter
+from fyyur_01.cache import cached, remember_stream, cache_tags
+from fyyur_01.api import not_modified
+from fyyur_01.deletion import Deletion
+from fyyur_01.enums import GENRE_BITS, State
+from flask import request, abort, url_for, stream_with_context
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime as rfc822_datetime
+from itertools import islice
+from xml.sax.saxutils import escape
+import hashlib
+
+#----------------------------------------------------------------------------#
+# Calendar and RSS feeds.
+#----------------------------------------------------------------------------#
+
+# The upcoming shows of a venue, an artist, a genre or a city, for the next
+# FEED_DAYS days (at most FEED_MAX_SHOWS), as iCalendar (calendar.ics) and
+# RSS (shows.rss). Feeds are streamed from the shows table as they are
+# rendered, and cached whole in the page cache, tagged like the pages
+# showing the same shows: a venue's feed is regenerated when its shows, or
+# the artists playing them, change.
+#
+# Each feed has an ETag and Last-Modified from the count and latest
+# updated_at of its shows, venues and artists, stored with the cached feed:
+# a calendar client polling a cached feed is answered 304 without a query.
+# Shows also leave a feed as they start, enter it FEED_DAYS before, and
+# leave it with their venue or artist when it is deleted, without any of
+# them changing: Last-Modified moves with those too.
+
+FORMATS = {
+  'ics': ('calendar.ics', 'text/calendar; charset=utf-8'),
+  'rss': ('shows.rss', 'application/rss+xml; charset=utf-8')
+}
+PRODID = '-//Fyyur//Upcoming shows//EN'
+# Shows per chunk of the response
+CHUNK_SIZE = 100
+
+
+class Feed:
+  """What a feed lists: its title and page, the criteria on its shows and,
+  for a venue or artist, its updated_at."""
+
+  def __init__(self, title, link, criteria, updated_at=None):
+    self.title = title
+    self.link = link
+    self.criteria = criteria
+    self.updated_at = updated_at
+
+
+def _matching(feed):
+  # Shows matching the feed's criteria, past ones too
+  return db.session.query(Show).join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id).\
+    filter(Venue.deleted_at.is_(None), Artist.deleted_at.is_(None), *feed.criteria)
+
+
+def _shows(feed, now):
+  # Upcoming shows in the feed's window
+  return _matching(feed).filter(Show.start_time > now, Show.start_time < now + timedelta(days=app.config['FEED_DAYS']))
+
+
+def _rows(feed, now):
+  return _shows(feed, now).with_entities(
+    Show.id, Show.start_time, Show.end_time, Show.updated_at,
+    Show.venue_id, Venue.name.label('venue_name'), Venue.city, Venue.state,
+    Show.artist_id, Artist.name.label('artist_name')
+  ).order_by(Show.start_time, Show.id).limit(app.config['FEED_MAX_SHOWS']).\
+    execution_options(stream_results=True).yield_per(500)
+
+
+def _stamp(feed, now):
+  # (ETag, Last-Modified) of the feed, from one aggregate query
+  started = _matching(feed).filter(Show.start_time <= now).with_entities(Show.start_time).\
+    order_by(Show.start_time.desc()).limit(1).as_scalar()
+  deleted = db.session.query(db.func.max(Deletion.updated_at)).as_scalar()
+  row = _shows(feed, now).with_entities(
+    db.func.count(Show.id), db.func.max(Show.start_time), started, deleted,
+    db.func.max(Show.updated_at), db.func.max(Venue.updated_at), db.func.max(Artist.updated_at)
+  ).one()
+  etag = hashlib.sha1(repr((request.path, feed.updated_at, tuple(row))).encode()).hexdigest()
+  latest, *updated = row[1:]
+  # When the latest show in the window entered it
+  entered = latest - timedelta(days=app.config['FEED_DAYS']) if latest is not None else None
+  updated = [value for value in (feed.updated_at, entered, *updated) if value is not None]
+  return etag, max(updated).replace(microsecond=0) if updated else None
+
+
+def _batches(rows):
+  # Lists of CHUNK_SIZE rows, each adding its venues' and artists' cache tags
+  rows = iter(rows)
+  for batch in iter(lambda: list(islice(rows, CHUNK_SIZE)), []):
+    cache_tags(*{f'venue:{row.venue_id}' for row in batch}, *{f'artist:{row.artist_id}' for row in batch})
+    yield batch
+
+
+def _summary(row):
+  return f'{row.artist_name} at {row.venue_name}'
+
+
+def _location(row):
+  return ', '.join(part for part in (row.venue_name, row.city, row.state) if part)
+
+
+#  iCalendar
+#  ----------------------------------------------------------------
+
+def _ics_text(value):
+  # TEXT values escape backslashes, semicolons, commas and newlines
+  return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_time(value):
+  # Stored datetimes are UTC
+  return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def _ics_line(name, value):
+  # Lines longer than 75 octets are folded, without splitting a character
+  line = f'{name}:{value}'.encode()
+  parts = []
+  while len(line) > 75:
+    cut = 75 if not parts else 74
+    while line[cut] & 0xC0 == 0x80:
+      cut -= 1
+    parts.append(line[:cut])
+    line = line[cut:]
+  parts.append(line)
+  return b'\r\n '.join(parts).decode() + '\r\n'
+
+
+def _ics_event(row):
+  return ''.join((
+    _ics_line('BEGIN', 'VEVENT'),
+    _ics_line('UID', f'show-{row.id}@{request.host}'),
+    _ics_line('DTSTAMP', _ics_time(row.updated_at)),
+    _ics_line('DTSTART', _ics_time(row.start_time)),
+    _ics_line('DTEND', _ics_time(row.end_time)),
+    _ics_line('SUMMARY', _ics_text(_summary(row))),
+    _ics_line('LOCATION', _ics_text(_location(row))),
+    _ics_line('URL', url_for('show_venue', venue_id=row.venue_id, _external=True)),
+    _ics_line('END', 'VEVENT')
+  ))
+
+
+def render_ics(feed, rows):
+  """Yield the iCalendar text of `feed` listing `rows`, in chunks."""
+  yield ''.join((
+    _ics_line('BEGIN', 'VCALENDAR'),
+    _ics_line('VERSION', '2.0'),
+    _ics_line('PRODID', PRODID),
+    _ics_line('CALSCALE', 'GREGORIAN'),
+    _ics_line('METHOD', 'PUBLISH'),
+    _ics_line('X-WR-CALNAME', _ics_text(feed.title))
+  ))
+  for batch in _batches(rows):
+    yield ''.join(_ics_event(row) for row in batch)
+  yield _ics_line('END', 'VCALENDAR')
+
+
+#  RSS
+#  ----------------------------------------------------------------
+
+def _rss_time(value):
+  return rfc822_datetime(value.replace(tzinfo=timezone.utc))
+
+
+def _rss_item(row):
+  return (
+    '<item>'
+    f'<title>{escape(_summary(row))}</title>'
+    f"<link>{escape(url_for('show_venue', venue_id=row.venue_id, _external=True))}</link>"
+    f'<guid isPermaLink="false">show-{row.id}</guid>'
+    f'<description>{escape(_location(row))}, {_rss_time(row.start_time)}</description>'
+    f'<pubDate>{_rss_time(row.start_time)}</pubDate>'
+    '</item>\n'
+  )
+
+
+def render_rss(feed, rows):
+  """Yield the RSS 2.0 document of `feed` listing `rows`, in chunks."""
+  yield (
+    '<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>'
+    f'<title>{escape(feed.title)}</title><link>{escape(feed.link)}</link>'
+    f'<description>{escape(feed.title)}</description>\n'
+  )
+  for batch in _batches(rows):
+    yield ''.join(_rss_item(row) for row in batch)
+  yield '</channel></rss>\n'
+
+
+RENDERERS = {'ics': render_ics, 'rss': render_rss}
+
+
+#  Routes
+#  ----------------------------------------------------------------
+
+def feed_route(rule, *tags):
+  """Register the feeds of `describe(**view_args)`, which returns a Feed
+  (or aborts), as `rule`/calendar.ics and `rule`/shows.rss.
+
+  Their cache entries are tagged by `tags`, formatted with the view
+  arguments, and by the venues and artists of the shows listed.
+  """
+  def decorator(describe):
+    def view(fmt, **kwargs):
+      key = f'feed:{request.path}'
+      entry = cached(key)
+      if entry is not None:
+        etag, last_modified, body = entry
+      else:
+        feed = describe(**kwargs)
+        now = datetime.utcnow()
+        # Tag versions are read before the stamp, so a change committed in
+        # between leaves the entry stale rather than its ETag
+        body = remember_stream(
+          key, [tag.format(**kwargs) for tag in tags], lambda: RENDERERS[fmt](feed, _rows(feed, now)),
+          lambda body: (etag, last_modified, body)
+        )
+        etag, last_modified = _stamp(feed, now)
+      if not_modified(etag, last_modified):
+        # Not generated, nor cached
+        response = app.response_class(status=304)
+      elif isinstance(body, str):
+        response = app.response_class(body, content_type=FORMATS[fmt][1])
+      else:
+        response = app.response_class(stream_with_context(body), content_type=FORMATS[fmt][1])
+      response.set_etag(etag)
+      response.last_modified = last_modified
+      return response
+
+    for fmt, (name, _) in FORMATS.items():
+      app.add_url_rule(f'{rule}/{name}', f'{describe.__name__}_{fmt}', view, defaults={'fmt': fmt})
+    return describe
+  return decorator
+
+
+@feed_route('/venues/<int:venue_id>', 'venue:{venue_id}')
+def venue_feed(venue_id):
+  venue = db.session.query(Venue.name, Venue.updated_at).filter(Venue.id == venue_id).first()
+  if venue is None:
+    abort(404)
+  link = url_for('show_venue', venue_id=venue_id, _external=True)
+  return Feed(f'Shows at {venue.name}', link, (Show.venue_id == venue_id,), venue.updated_at)
+
+
+@feed_route('/artists/<int:artist_id>', 'artist:{artist_id}')
+def artist_feed(artist_id):
+  artist = db.session.query(Artist.name, Artist.updated_at).filter(Artist.id == artist_id).first()
+  if artist is None:
+    abort(404)
+  link = url_for('show_artist', artist_id=artist_id, _external=True)
+  return Feed(f'Shows by {artist.name}', link, (Show.artist_id == artist_id,), artist.updated_at)
+
+
+@feed_route('/genres/<genre>', 'shows', 'venues', 'artists')
+def genre_feed(genre):
+  if genre not in GENRE_BITS:
+    abort(404)
+  link = url_for('discover', kind='shows', genre=genre, _external=True)
+  return Feed(f'{genre} shows', link, (genres_filter(Artist.genres, [genre]),))
+
+
+@feed_route('/cities/<state>/<city>', 'shows', 'venues', 'artists')
+def city_feed(state, city):
+  if state not in {choice.value for choice in State}:
+    abort(404)
+  link = url_for('discover', kind='shows', state=state, city=city, _external=True)
+  return Feed(f'Shows in {city}, {state}', link, (Venue.state == state, Venue.city == city))
@@ -0,0 +1,77 @@
+from fyyur_01.app import app
+from babel import Locale
+from babel.dates import parse_pattern, get_timezone, UTC
+from flask import request, has_request_context
+from functools import lru_cache
+
+#----------------------------------------------------------------------------#
+# Date formatting.
+#----------------------------------------------------------------------------#
+
+# Named patterns accepted by the `datetime` template filter
+PATTERNS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+
+@lru_cache(maxsize=64)
+def _pattern(format):
+  return parse_pattern(PATTERNS.get(format, format))
+
+
+@lru_cache(maxsize=64)
+def _locale(name):
+  return Locale.parse(name)
+
+
+@lru_cache(maxsize=64)
+def _timezone(name):
+  return get_timezone(name) if name else None
+
+
+def _format(dt, format, locale, timezone):
+  # Naive datetimes are taken as UTC, as babel.dates.format_datetime does
+  if dt.tzinfo is None:
+    dt = dt.replace(tzinfo=UTC)
+  tz = _timezone(timezone)
+  if tz is not None:
+    dt = tz.normalize(dt.astimezone(tz)) if hasattr(tz, 'normalize') else dt.astimezone(tz)
+  return _pattern(format).apply(dt, _locale(locale))
+
+
+# Timelines repeat the same few formats of the same timestamps, so the
+# formatted strings themselves are memoized
+_format = lru_cache(maxsize=app.config['DATETIME_FORMAT_CACHE_SIZE'])(_format)
+
+
+def request_locale():
+  """Locale for this request: the best Accept-Language match, or the default."""
+  default = app.config['DATETIME_LOCALE']
+  if not has_request_context():
+    return default
+  return request.accept_languages.best_match(app.config['SUPPORTED_LOCALES'], default)
+
+
+def request_timezone():
+  """Timezone name from the `tz` cookie when valid, else DATETIME_TIMEZONE."""
+  default = app.config['DATETIME_TIMEZONE']
+  name = request.cookies.get('tz') if has_request_context() else None
+  if name:
+    try:
+      _timezone(name)
+      return name
+    except LookupError:
+      pass
+  return default
+
+
+def format_datetime(dt, format='medium', locale=None, timezone=None):
+  return _format(dt, format, locale or request_locale(), timezone or request_timezone())
+
+
+def format_datetimes(values, format='medium', locale=None, timezone=None):
+  """Format a column of datetimes, resolving locale and timezone once."""
+  locale = locale or request_locale()
+  timezone = timezone or request_timezone()
+  return [_format(dt, format, locale, timezone) for dt in values]
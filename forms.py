@@ -1,11 +1,19 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL, Optional
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
 from fyyur_01.enums import State, Genre
+from fyyur_01.instrumentation import timed
 
 
-class ShowForm(FlaskForm):
+class TimedForm(FlaskForm):
+    # Validation time is reported in the request's 'forms' phase
+    def validate(self, extra_validators=None):
+        with timed('forms'):
+            return super().validate(extra_validators)
+
+
+class ShowForm(TimedForm):
     artist_id = StringField(
         'artist_id',
         validators=[DataRequired()]
@@ -17,11 +25,16 @@ class ShowForm(FlaskForm):
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
-        default= datetime.today(),
+        default= datetime.utcnow,
         format='%Y-%m-%d %H:%M'
     )
+    # Minutes; SHOW_DEFAULT_DURATION when left empty
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1)]
+    )
 
-class VenueForm(FlaskForm):
+class VenueForm(TimedForm):
     name = StringField(
         'name',
         validators=[DataRequired()]
@@ -62,7 +75,7 @@ class VenueForm(FlaskForm):
     seeking_description = StringField('seeking_description')
 
 
-class ArtistForm(FlaskForm):
+class ArtistForm(TimedForm):
     name = StringField(
         'name',
         validators=[DataRequired()]
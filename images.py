@@ -0,0 +1,333 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist
+from fyyur_01.jobs import job, enqueue
+from flask import abort, redirect, send_file, url_for
+from urllib.parse import urlsplit
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+
+try:
+  from PIL import Image, ImageOps
+except ImportError:
+  Image = None
+
+#----------------------------------------------------------------------------#
+# Image proxy.
+#----------------------------------------------------------------------------#
+
+# Venue and artist images are fetched from their image_link once, resized
+# to each size and format below, and served from a disk cache. The image
+# URLs carry a digest of the image_link, so they can be cached for good.
+
+SIZES = {
+  # Show tiles and lists
+  'thumb': (400, 400),
+  # Venue/artist pages
+  'detail': (1000, 1000)
+}
+FORMATS = {
+  'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+  'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+KINDS = {'venue': Venue, 'artist': Artist}
+
+
+class FetchError(Exception):
+  pass
+
+
+#  Fetchers
+#  ----------------------------------------------------------------
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+  def __init__(self, fetcher):
+    self.fetcher = fetcher
+
+  def redirect_request(self, req, fp, code, msg, headers, newurl):
+    self.fetcher._check_url(newurl)
+    return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class HTTPFetcher:
+  """Fetches http(s) URLs, refusing hosts on private or local networks."""
+
+  def __init__(self, timeout=5, max_bytes=10 * 1024 * 1024):
+    self.timeout = timeout
+    self.max_bytes = max_bytes
+    # Redirects are checked like the URLs themselves
+    self.opener = urllib.request.build_opener(_CheckedRedirectHandler(self))
+
+  def _check_url(self, url):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+      raise FetchError(f'not an http(s) URL: {url}')
+    self._check_host(parts.hostname)
+
+  def _check_host(self, host):
+    try:
+      addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError) as e:
+      raise FetchError(f'cannot resolve {host}: {e}')
+    for address in addresses:
+      ip = ipaddress.ip_address(address.split('%')[0])
+      if not ip.is_global:
+        raise FetchError(f'{host} resolves to non-public address {ip}')
+
+  def fetch(self, url):
+    self._check_url(url)
+    request = urllib.request.Request(url, headers={'User-Agent': 'Fyyur image proxy'})
+    try:
+      with self.opener.open(request, timeout=self.timeout) as response:
+        data = response.read(self.max_bytes + 1)
+    except (OSError, ValueError) as e:
+      raise FetchError(f'fetching {url} failed: {e}')
+    if len(data) > self.max_bytes:
+      raise FetchError(f'{url} is larger than {self.max_bytes} bytes')
+    return data
+
+
+class FileFetcher:
+  """Reads each URL's last path segment from a local directory.
+
+  A stand-in for HTTPFetcher in tests and offline development.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def fetch(self, url):
+    name = os.path.basename(urlsplit(url).path)
+    try:
+      with open(os.path.join(self.directory, name), 'rb') as f:
+        return f.read()
+    except OSError as e:
+      raise FetchError(f'no local file for {url}: {e}')
+
+
+def make_fetcher(config):
+  fetcher = config['IMAGE_FETCHER']
+  if fetcher == 'http':
+    return HTTPFetcher(config['IMAGE_FETCH_TIMEOUT'], config['IMAGE_MAX_BYTES'])
+  if fetcher == 'file':
+    return FileFetcher(config['IMAGE_FETCH_DIR'])
+  # None disables the proxy; anything else is used as a fetcher object
+  return fetcher
+
+
+#  Disk cache
+#  ----------------------------------------------------------------
+
+class ImageStore:
+  """Originals and resized images on disk, named by content hash.
+
+  `urls/` maps an image URL to the hash of its original, so the same
+  image under several URLs is stored and resized once. Reads update the
+  access time; once the files exceed `max_bytes`, the least recently used
+  are deleted.
+  """
+
+  def __init__(self, directory, fetcher, max_bytes):
+    self.directory = directory
+    self.fetcher = fetcher
+    self.max_bytes = max_bytes
+    for name in ('urls', 'originals', 'resized'):
+      os.makedirs(os.path.join(directory, name), exist_ok=True)
+    self.lock = threading.Lock()
+    self.size = None
+
+  def _path(self, *parts):
+    return os.path.join(self.directory, *parts)
+
+  def _touch(self, path):
+    # Recency is kept in the access time: the modification time is part
+    # of the ETag of served files
+    try:
+      os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except FileNotFoundError:
+      return False
+    return True
+
+  def _read(self, path):
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+    except FileNotFoundError:
+      return None
+    self._touch(path)
+    return data
+
+  def _write(self, path, data):
+    # Write then rename, so other workers never read a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.replace(tmp, path)
+    with self.lock:
+      if self.size is not None:
+        self.size += len(data)
+    self._evict()
+
+  def _files(self):
+    for name in ('originals', 'resized'):
+      yield from (entry for entry in os.scandir(self._path(name)) if entry.is_file() and not entry.name.startswith('tmp'))
+
+  def _evict(self):
+    with self.lock:
+      if self.size is not None and self.size <= self.max_bytes:
+        return
+      files = sorted(((entry.stat(), entry.path) for entry in self._files()), key=lambda file: file[0].st_atime)
+      size = sum(stat.st_size for stat, _ in files)
+      # Evict down to 90% so the next few writes don't evict again
+      for stat, path in files:
+        if size <= self.max_bytes * 0.9:
+          break
+        try:
+          os.remove(path)
+        except FileNotFoundError:
+          pass
+        size -= stat.st_size
+      self.size = size
+
+  def original(self, url):
+    """(content hash, bytes) of the image at `url`, fetched on a miss."""
+    url_path = self._path('urls', hashlib.sha1(url.encode()).hexdigest())
+    digest = self._read(url_path)
+    if digest is not None:
+      data = self._read(self._path('originals', digest.decode()))
+      if data is not None:
+        return digest.decode(), data
+    data = self.fetcher.fetch(url)
+    digest = hashlib.sha256(data).hexdigest()
+    self._write(self._path('originals', digest), data)
+    self._write(url_path, digest.encode())
+    return digest, data
+
+  def resized(self, url, size, fmt):
+    """Path of `url`'s image resized to `size` in `fmt`, made on a miss."""
+    digest = self._read(self._path('urls', hashlib.sha1(url.encode()).hexdigest()))
+    if digest is not None:
+      path = self._path('resized', f'{digest.decode()}-{size}.{fmt}')
+      if self._touch(path):
+        return path
+    digest, data = self.original(url)
+    path = self._path('resized', f'{digest}-{size}.{fmt}')
+    if not os.path.exists(path):
+      self._write(path, resize(data, SIZES[size], fmt))
+    return path
+
+
+def resize(data, box, fmt):
+  """Encode image bytes `data` in `fmt`, scaled down to fit `box`."""
+  try:
+    image = Image.open(io.BytesIO(data))
+    image.draft('RGB', box)
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(box, Image.LANCZOS)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+      # JPEG has no alpha: flatten onto white
+      background = Image.new('RGB', image.size, 'white')
+      image = image.convert('RGBA')
+      background.paste(image, mask=image.split()[-1])
+      image = background
+    output = io.BytesIO()
+    format, _, options = FORMATS[fmt]
+    image.save(output, format, **options)
+  except (OSError, ValueError, Image.DecompressionBombError) as e:
+    raise FetchError(f'cannot resize image: {e}')
+  return output.getvalue()
+
+
+_store = {}
+
+
+def image_store():
+  """The process's ImageStore, made from the app config on first use.
+
+  None when images aren't proxied (no fetcher, or Pillow isn't installed).
+  """
+  if 'store' not in _store:
+    fetcher = make_fetcher(app.config)
+    if fetcher is None or Image is None:
+      _store['store'] = None
+    else:
+      _store['store'] = ImageStore(app.config['IMAGE_CACHE_DIR'], fetcher, app.config['IMAGE_CACHE_MAX_BYTES'])
+  return _store['store']
+
+
+#  Views
+#  ----------------------------------------------------------------
+
+def link_digest(link):
+  return hashlib.sha1(link.encode()).hexdigest()[:12]
+
+
+@app.template_global()
+def image_url(kind, id, link, size, fmt='jpeg'):
+  """URL of the proxied image, or None when images aren't proxied."""
+  if image_store() is None or not link:
+    return None
+  return url_for('image', kind=kind, id=id, size=size, digest=link_digest(link), fmt=fmt)
+
+
+@app.route('/images/<kind>/<int:id>/<size>.<digest>.<fmt>')
+def image(kind, id, size, digest, fmt):
+  store = image_store()
+  if store is None or kind not in KINDS or size not in SIZES or fmt not in FORMATS:
+    abort(404)
+  model = KINDS[kind]
+  link = db.session.query(model.image_link).filter(model.id == id).scalar()
+  if not link:
+    abort(404)
+  if digest != link_digest(link):
+    # The image_link changed since the page was rendered
+    return redirect(image_url(kind, id, link, size, fmt))
+  try:
+    path = store.resized(link, size, fmt)
+  except FetchError as e:
+    # Fall back to the original, and try again a little later
+    app.logger.warning('image proxy: %s', e)
+    response = redirect(link)
+    response.cache_control.max_age = 60
+    return response
+  response = send_file(path, mimetype=FORMATS[fmt][1], conditional=True)
+  response.cache_control.public = True
+  response.cache_control.max_age = app.config['IMAGE_MAX_AGE']
+  response.cache_control.immutable = True
+  return response
+
+
+#  Prefetching
+#  ----------------------------------------------------------------
+
+@job('prefetch_image')
+def prefetch_image(kind, id):
+  """Fetch and resize a venue's or artist's image ahead of its first view."""
+  store = image_store()
+  model = KINDS[kind]
+  link = db.session.query(model.image_link).filter(model.id == id).scalar()
+  if store is None or not link:
+    return
+  for size in SIZES:
+    for fmt in FORMATS:
+      store.resized(link, size, fmt)
+
+
+def _queue_prefetch(mapper, connection, target):
+  if image_store() is None or not target.image_link:
+    return
+  if not db.inspect(target).attrs.image_link.history.has_changes():
+    return
+  kind = type(target).__name__.lower()
+  enqueue('prefetch_image', {'kind': kind, 'id': target.id}, key=f'image:{kind}:{target.id}', connection=connection)
+
+
+for _model in KINDS.values():
+  db.event.listen(_model, 'after_insert', _queue_prefetch)
+  db.event.listen(_model, 'after_update', _queue_prefetch)
@@ -0,0 +1,285 @@
+from flask import g, request, current_app, has_app_context
+from flask_sqlalchemy import BaseQuery
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+
+try:
+  import pyinstrument
+except ImportError:
+  pyinstrument = None
+
+#----------------------------------------------------------------------------#
+# Request instrumentation.
+#----------------------------------------------------------------------------#
+
+# Each request's wall time is split into exclusive phases: time spent in a
+# nested phase (e.g. SQL issued while a template renders) is not counted
+# again in the outer one. Whatever is left over is reported as 'app'.
+PHASES = ('sql', 'orm', 'template', 'forms')
+
+
+class RequestTimings:
+  """Phase timings and executed statements of one request."""
+
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.phases = defaultdict(float)
+    self.stack = []
+    self.statements = Counter()
+
+  def enter(self, phase):
+    now = time.perf_counter()
+    if self.stack:
+      self.phases[self.stack[-1][0]] += now - self.stack[-1][1]
+    self.stack.append([phase, now])
+
+  def exit(self, phase):
+    if not self.stack or self.stack[-1][0] != phase:
+      return
+    now = time.perf_counter()
+    self.phases[phase] += now - self.stack.pop()[1]
+    if self.stack:
+      self.stack[-1][1] = now
+
+  def elapsed(self):
+    return time.perf_counter() - self.start
+
+
+def current_timings():
+  return g.get('timings') if has_app_context() else None
+
+
+@contextmanager
+def timed(phase):
+  timings = current_timings()
+  if timings is None:
+    yield
+    return
+  timings.enter(phase)
+  try:
+    yield
+  finally:
+    timings.exit(phase)
+
+
+def timed_iter(iterable, phase):
+  """Iterate `iterable`, counting the time spent producing items as `phase`."""
+  timings = current_timings()
+  if timings is None:
+    yield from iterable
+    return
+  iterator = iter(iterable)
+  while True:
+    timings.enter(phase)
+    try:
+      item = next(iterator)
+    except StopIteration:
+      return
+    finally:
+      timings.exit(phase)
+    yield item
+
+
+class TimedQuery(BaseQuery):
+  # Building entities from rows happens while the result is iterated
+  def __iter__(self):
+    with timed('orm'):
+      rows = super().__iter__()
+    return timed_iter(rows, 'orm')
+
+
+class TimedTemplate(Template):
+
+  def render(self, *args, **kwargs):
+    with timed('template'):
+      return super().render(*args, **kwargs)
+
+  def generate(self, *args, **kwargs):
+    return timed_iter(super().generate(*args, **kwargs), 'template')
+
+
+#  SQL
+#  ----------------------------------------------------------------
+
+def statement_shape(statement):
+  # Collapse placeholder lists so IN (...) of any length has one shape
+  return re.sub(r'(%\(\w+\)s|\?)(\s*,\s*(%\(\w+\)s|\?))+', r'\1, ...', ' '.join(statement.split()))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('query_start', []).append(time.perf_counter())
+  timings = current_timings()
+  if timings is not None:
+    timings.statements[statement_shape(statement)] += 1
+    timings.enter('sql')
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  duration = time.perf_counter() - conn.info['query_start'].pop()
+  timings = current_timings()
+  if timings is not None:
+    timings.exit('sql')
+  if has_app_context() and duration >= current_app.config['SLOW_QUERY_SECONDS']:
+    metrics.count_slow_query()
+    current_app.logger.warning(
+      'slow query (%.3fs) on %s: %s; parameters: %.500r',
+      duration, request.endpoint if timings is not None else 'cli', ' '.join(statement.split()), parameters
+    )
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+  connection = context.connection
+  if connection is not None and connection.info.get('query_start'):
+    connection.info['query_start'].pop()
+  timings = current_timings()
+  if timings is not None:
+    timings.exit('sql')
+
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+class Metrics:
+  """Per-endpoint request metrics of one process, in Prometheus text format."""
+
+  def __init__(self, buckets):
+    self.lock = threading.Lock()
+    self.buckets = tuple(sorted(buckets))
+    self.latency = {}
+    self.phases = defaultdict(float)
+    self.queries = defaultdict(int)
+    self.repeated = defaultdict(int)
+    self.slow_queries = 0
+
+  def observe(self, endpoint, method, status, duration, timings):
+    with self.lock:
+      histogram = self.latency.setdefault((endpoint, method, status), [[0] * len(self.buckets), 0, 0.0])
+      for i, bound in enumerate(self.buckets):
+        if duration <= bound:
+          histogram[0][i] += 1
+      histogram[1] += 1
+      histogram[2] += duration
+      for phase, seconds in timings.phases.items():
+        self.phases[endpoint, phase] += seconds
+      self.queries[endpoint] += sum(timings.statements.values())
+
+  def count_repeated(self, endpoint):
+    with self.lock:
+      self.repeated[endpoint] += 1
+
+  def count_slow_query(self):
+    with self.lock:
+      self.slow_queries += 1
+
+  def render(self, extra=()):
+    lines = ['# TYPE fyyur_request_duration_seconds histogram']
+    with self.lock:
+      for (endpoint, method, status), (counts, count, total) in sorted(self.latency.items()):
+        labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+        for bound, bucket in zip(self.buckets, counts):
+          lines.append(f'fyyur_request_duration_seconds_bucket{{{labels},le="{bound}"}} {bucket}')
+        lines.append(f'fyyur_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'fyyur_request_duration_seconds_count{{{labels}}} {count}')
+        lines.append(f'fyyur_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+      lines.append('# TYPE fyyur_request_phase_seconds_total counter')
+      for (endpoint, phase), seconds in sorted(self.phases.items()):
+        lines.append(f'fyyur_request_phase_seconds_total{{endpoint="{endpoint}",phase="{phase}"}} {seconds:.6f}')
+      lines.append('# TYPE fyyur_sql_queries_total counter')
+      for endpoint, count in sorted(self.queries.items()):
+        lines.append(f'fyyur_sql_queries_total{{endpoint="{endpoint}"}} {count}')
+      lines.append('# TYPE fyyur_sql_repeated_statement_requests_total counter')
+      for endpoint, count in sorted(self.repeated.items()):
+        lines.append(f'fyyur_sql_repeated_statement_requests_total{{endpoint="{endpoint}"}} {count}')
+      lines.append('# TYPE fyyur_sql_slow_queries_total counter')
+      lines.append(f'fyyur_sql_slow_queries_total {self.slow_queries}')
+    for name, kind, value in extra:
+      lines.append(f'# TYPE {name} {kind}')
+      lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics((0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+
+#  Profiling
+#  ----------------------------------------------------------------
+
+def _start_profiler():
+  if pyinstrument is not None:
+    profiler = pyinstrument.Profiler()
+  else:
+    profiler = cProfile.Profile()
+  try:
+    profiler.start() if pyinstrument is not None else profiler.enable()
+  except ValueError:
+    # Another profiler is already active on this thread
+    return None
+  return profiler
+
+
+def _dump_profile(profiler, duration, directory):
+  name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{int(duration * 1000)}ms"
+  os.makedirs(directory, exist_ok=True)
+  if pyinstrument is not None:
+    with open(os.path.join(directory, name + '.html'), 'w', encoding='utf-8') as f:
+      f.write(profiler.output_html())
+  else:
+    profiler.dump_stats(os.path.join(directory, name + '.prof'))
+
+
+#  Request hooks
+#  ----------------------------------------------------------------
+
+def init_app(app):
+  """Time the requests of `app`, timing templates and queries through it."""
+  if not app.config['INSTRUMENTATION']:
+    return
+  app.jinja_env.template_class = TimedTemplate
+
+  @app.before_request
+  def start_timings():
+    g.timings = RequestTimings()
+    if random.random() < app.config['PROFILE_SAMPLE_RATE']:
+      g.profiler = _start_profiler()
+
+  @app.after_request
+  def record_timings(response):
+    timings = g.pop('timings', None)
+    if timings is None:
+      return response
+    duration = timings.elapsed()
+    endpoint = request.endpoint or 'unmatched'
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+      profiler.stop() if pyinstrument is not None else profiler.disable()
+      if duration >= app.config['PROFILE_THRESHOLD']:
+        _dump_profile(profiler, duration, app.config['PROFILE_DIR'])
+
+    repeated = [(count, shape) for shape, count in timings.statements.items() if count >= app.config['REPEATED_QUERY_THRESHOLD']]
+    if repeated:
+      metrics.count_repeated(endpoint)
+      for count, shape in sorted(repeated, reverse=True):
+        app.logger.warning('statement repeated %d times in %s %s (N+1?): %s', count, request.method, request.path, shape)
+
+    metrics.observe(endpoint, request.method, response.status_code, duration, timings)
+    # Streamed bodies are generated after this, so their time isn't included
+    other = duration - sum(timings.phases.values())
+    response.headers['Server-Timing'] = ', '.join(
+      [f'{phase};dur={timings.phases[phase] * 1000:.2f}' for phase in PHASES if phase in timings.phases] +
+      [f'app;dur={max(other, 0) * 1000:.2f}', f'total;dur={duration * 1000:.2f}']
+    )
+    response.headers['X-Query-Count'] = str(sum(timings.statements.values()))
+    return response
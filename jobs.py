@@ -0,0 +1,285 @@
+from fyyur_01.app import app, db
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+import json
+import os
+import random
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Background jobs.
+#----------------------------------------------------------------------------#
+
+# Jobs are rows of the jobs table, in the application database. A job
+# queued in a request's session commits or rolls back with the request's
+# own writes. Workers, either a thread of each web process or separate
+# `flask worker` processes, claim due jobs one at a time, run the
+# registered handler and retry failures with exponential backoff.
+#
+# Handlers may run more than once (after a crash or a retry), so they must
+# be idempotent: recompute derived data rather than increment it.
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job(db.Model):
+  __tablename__ = 'jobs'
+  __table_args__ = (
+    db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    # At most one queued job per key; enqueue() relies on it
+    db.Index('ix_jobs_queued_key', 'key', unique=True,
+             postgresql_where=db.text("status = 'queued'"), sqlite_where=db.text("status = 'queued'")),
+  )
+
+  id = db.Column(db.Integer, primary_key=True)
+  name = db.Column(db.String(80), nullable=False)
+  # JSON keyword arguments of the handler
+  args = db.Column(db.Text, nullable=False, default='{}')
+  # Idempotency key: while a job with this key is queued, enqueueing
+  # another one returns it instead
+  key = db.Column(db.String(200), nullable=True)
+  status = db.Column(db.String(10), nullable=False, default=QUEUED)
+  attempts = db.Column(db.Integer, nullable=False, default=0)
+  max_attempts = db.Column(db.Integer, nullable=False)
+  run_at = db.Column(db.DateTime, nullable=False)
+  locked_at = db.Column(db.DateTime, nullable=True)
+  last_error = db.Column(db.Text, nullable=True)
+  created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+  def to_dict(self):
+    return {
+      'id': self.id,
+      'name': self.name,
+      'args': json.loads(self.args),
+      'key': self.key,
+      'status': self.status,
+      'attempts': self.attempts,
+      'max_attempts': self.max_attempts,
+      'run_at': self.run_at.isoformat(),
+      'last_error': self.last_error,
+      'created_at': self.created_at.isoformat(),
+      'updated_at': self.updated_at.isoformat()
+    }
+
+  def __repr__(self):
+    return f'Job {self.id}: {self.name} ({self.status})'
+
+
+#  Queueing
+#  ----------------------------------------------------------------
+
+HANDLERS = {}
+
+# Set when a commit queued jobs, so an in-process worker starts on them
+# without waiting for its next poll
+_wakeup = threading.Event()
+
+
+def job(name):
+  """Register the decorated function as the handler of jobs called `name`."""
+  def decorator(handler):
+    HANDLERS[name] = handler
+    return handler
+  return decorator
+
+
+def enqueue(name, args=None, key=None, delay=0, max_attempts=None, connection=None):
+  """Queue job `name` with keyword arguments `args`; returns its id.
+
+  The job is inserted through the current session, or through
+  `connection` from inside a flush (e.g. in mapper events), and becomes
+  visible to workers when that transaction commits. With `key`, an
+  already queued job with the same key is reused.
+  """
+  table = Job.__table__
+  connection = connection if connection is not None else db.session.connection()
+  now = datetime.utcnow()
+  values = {
+    'name': name,
+    'args': json.dumps(args or {}),
+    'key': key,
+    'status': QUEUED,
+    'attempts': 0,
+    'max_attempts': max_attempts or app.config['JOBS_MAX_ATTEMPTS'],
+    'run_at': now + timedelta(seconds=delay),
+    'created_at': now,
+    'updated_at': now
+  }
+  if key is None:
+    job_id = connection.execute(table.insert().values(values)).inserted_primary_key[0]
+  else:
+    job_id = _enqueue_once(connection, table, values)
+  db.session.info['jobs_queued'] = True
+  return job_id
+
+
+def _enqueue_once(connection, table, values):
+  # The queued job with the key, or a new one. ix_jobs_queued_key makes
+  # the insert a no-op when another transaction queued one first; it's
+  # read on the next pass, unless a worker claimed it already.
+  queued = db.select([table.c.id]).where(table.c.key == values['key']).where(table.c.status == QUEUED)
+  while True:
+    job_id = connection.execute(queued).scalar()
+    if job_id is not None:
+      return job_id
+    if connection.dialect.name != 'postgresql':
+      return connection.execute(table.insert().values(values)).inserted_primary_key[0]
+    job_id = connection.execute(
+      postgresql.insert(table).values(values).on_conflict_do_nothing(
+        index_elements=[table.c.key], index_where=table.c.status == QUEUED
+      ).returning(table.c.id)
+    ).scalar()
+    if job_id is not None:
+      return job_id
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _wake_worker(session):
+  if session.info.pop('jobs_queued', False):
+    _wakeup.set()
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_jobs(session):
+  session.info.pop('jobs_queued', None)
+
+
+#  Running
+#  ----------------------------------------------------------------
+
+def _due(now):
+  # Queued jobs whose time has come, and jobs whose worker died mid-run
+  stale = now - timedelta(seconds=app.config['JOBS_LOCK_TIMEOUT'])
+  return db.or_(
+    (Job.status == QUEUED) & (Job.run_at <= now),
+    (Job.status == RUNNING) & (Job.locked_at < stale)
+  )
+
+
+def claim():
+  """Mark the next due job as running and return it, or None."""
+  now = datetime.utcnow()
+  query = db.session.query(Job.id).filter(_due(now)).order_by(Job.run_at, Job.id).limit(1)
+  if db.engine.dialect.name == 'postgresql':
+    query = query.with_for_update(skip_locked=True)
+  job_id = query.scalar()
+  if job_id is None:
+    db.session.rollback()
+    return None
+  # The repeated condition keeps two workers from claiming the same job
+  # where rows can't be locked (SQLite)
+  claimed = db.session.query(Job).filter(Job.id == job_id, _due(now)).update({
+    Job.status: RUNNING,
+    Job.locked_at: now,
+    Job.attempts: Job.attempts + 1,
+    Job.updated_at: now
+  }, synchronize_session=False)
+  db.session.commit()
+  return Job.query.get(job_id) if claimed else None
+
+
+def run(job):
+  """Run a claimed job, then mark it done, or queued again with a backoff."""
+  job_id, attempts, max_attempts = job.id, job.attempts, job.max_attempts
+  try:
+    handler = HANDLERS[job.name]
+    handler(**json.loads(job.args))
+    db.session.commit()
+    values = {Job.status: DONE, Job.last_error: None}
+  except Exception as e:
+    db.session.rollback()
+    app.logger.exception('job %s (%s) failed, attempt %s of %s', job_id, job.name, attempts, max_attempts)
+    values = {Job.last_error: f'{type(e).__name__}: {e}'[:2000]}
+    if attempts < max_attempts:
+      # Exponential backoff with jitter, so failing jobs don't retry in step
+      delay = app.config['JOBS_RETRY_DELAY'] * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+      values.update({Job.status: QUEUED, Job.run_at: datetime.utcnow() + timedelta(seconds=delay)})
+    else:
+      values[Job.status] = FAILED
+  values.update({Job.locked_at: None, Job.updated_at: datetime.utcnow()})
+  try:
+    db.session.query(Job).filter(Job.id == job_id).update(values, synchronize_session=False)
+    db.session.commit()
+  except IntegrityError:
+    # Another job with its key was queued while it ran, and will retry the
+    # same work
+    db.session.rollback()
+    values[Job.status] = FAILED
+    db.session.query(Job).filter(Job.id == job_id).update(values, synchronize_session=False)
+    db.session.commit()
+  return values[Job.status]
+
+
+def purge(days=None):
+  """Delete finished jobs older than JOBS_RETENTION_DAYS; returns how many."""
+  cutoff = datetime.utcnow() - timedelta(days=days if days is not None else app.config['JOBS_RETENTION_DAYS'])
+  deleted = db.session.query(Job).filter(Job.status.in_((DONE, FAILED)), Job.updated_at < cutoff).\
+    delete(synchronize_session=False)
+  db.session.commit()
+  return deleted
+
+
+def work(stop=None, burst=False):
+  """Run jobs until `stop` is set, or with `burst` until none are due.
+
+  Each job runs in its own app context, so its session is discarded after.
+  """
+  stop = stop or threading.Event()
+  last_purge = 0
+  while not stop.is_set():
+    try:
+      with app.app_context():
+        job = claim()
+        if job is not None:
+          run(job)
+          continue
+        if time.monotonic() - last_purge > 3600:
+          purge()
+          last_purge = time.monotonic()
+    except Exception:
+      # e.g. the database is unreachable; keep the worker alive
+      app.logger.exception('job worker error')
+    if burst:
+      return
+    _wakeup.wait(app.config['JOBS_POLL_INTERVAL'])
+    _wakeup.clear()
+
+
+def job_stats():
+  """Job counts by status, and the latest failures."""
+  counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED), 0)
+  counts.update(db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status))
+  failed = Job.query.filter(Job.status == FAILED).order_by(Job.updated_at.desc()).limit(10)
+  return {'counts': counts, 'failed': [job.to_dict() for job in failed]}
+
+
+#  In-process worker
+#  ----------------------------------------------------------------
+
+_worker = {'thread': None, 'pid': None}
+_worker_lock = threading.Lock()
+
+
+def start_worker_thread():
+  """Start this process's worker thread unless it is already running."""
+  with _worker_lock:
+    thread = _worker['thread']
+    # A forked child inherits the record but not the thread
+    if thread is not None and thread.is_alive() and _worker['pid'] == os.getpid():
+      return thread
+    thread = threading.Thread(target=work, name='fyyur-jobs', daemon=True)
+    thread.start()
+    _worker.update(thread=thread, pid=os.getpid())
+    return thread
+
+
+@app.before_request
+def _ensure_worker():
+  if app.config['JOBS_WORKER'] != 'thread' or app.testing:
+    return
+  thread = _worker['thread']
+  if thread is None or not thread.is_alive() or _worker['pid'] != os.getpid():
+    start_worker_thread()
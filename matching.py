@@ -0,0 +1,219 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, all_shows, deleted_ids
+from fyyur_01.deletion import Deletion, UNDONE
+from collections import defaultdict
+from datetime import datetime
+from itertools import groupby
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#----------------------------------------------------------------------------#
+
+# Ranks venues for an artist and artists for a venue. Each candidate scores
+# between 0 and 1 on every signal, weighted by MATCHING_WEIGHTS:
+#   genres:  shared genres over combined genres, from the genre masks
+#   place:   1 in the same city, 0.5 in the same state
+#   shows:   the show history, archived shows included: venues where
+#            artists who played the artist's venues also played (and the
+#            other way around)
+#   seeking: the candidate is looking (seeking_talent/seeking_venue)
+# Candidates are the venues or artists reachable through the show history
+# and those in the same state.
+#
+# Scoring reads the features of a per-process MatchIndex. The show history
+# keeps each venue's and artist's MATCHING_PARTNERS most frequent partners.
+# Venues, artists and shows added since the last query are folded in
+# before each query, and venues and artists deleted since then dropped
+# (undoing a deletion rebuilds the index); other changes made in this
+# process rebuild the index, and every process rebuilds it after
+# MATCHING_INDEX_TTL seconds.
+
+
+def popcount(mask):
+  return bin(mask).count('1')
+
+
+class _Side:
+  """Features of all venues or all artists, by id."""
+
+  def __init__(self, model, seeking):
+    self.model = model
+    self.seeking_column = seeking
+    self.genres = {}
+    self.place = {}
+    self.seeking = {}
+    self.by_state = defaultdict(set)
+    # id -> ((partner id, shows together), ...), most frequent first
+    self.partners = {}
+    self.last_id = 0
+
+  def load(self):
+    """Read venues or artists added since the last load."""
+    model = self.model
+    rows = db.session.query(model.id, model.city, model.state, model.genre_mask, self.seeking_column).\
+      filter(model.id > self.last_id)
+    for id, city, state, mask, seeking in rows:
+      self.genres[id] = mask or 0
+      self.place[id] = (city, state)
+      self.seeking[id] = bool(seeking)
+      self.by_state[state].add(id)
+      self.last_id = max(self.last_id, id)
+
+  def drop(self, id):
+    """Forget deleted venue or artist `id`."""
+    if id in self.place:
+      self.by_state[self.place[id][1]].discard(id)
+    for features in (self.genres, self.place, self.seeking, self.partners):
+      features.pop(id, None)
+
+  def load_partners(self, own, other, ids=None):
+    """Recount the most frequent partners of `ids` (default: all), over
+    the shows and the archived shows; `own` and `other` are 'venue_id' and
+    'artist_id', or the other way around."""
+    own, other = all_shows.c[own], all_shows.c[other]
+    shows = db.func.count()
+    rank = db.func.row_number().over(partition_by=own, order_by=(shows.desc(), other))
+    pairs = db.session.query(own.label('id'), other.label('partner'), shows.label('shows'), rank.label('rank')).\
+      select_from(all_shows).group_by(own, other).filter(
+        # Not the shows of deleted venues and artists waiting to be purged
+        all_shows.c.venue_id.notin_(deleted_ids(Venue)), all_shows.c.artist_id.notin_(deleted_ids(Artist))
+      )
+    if ids is not None:
+      pairs = pairs.filter(own.in_(ids))
+    pairs = pairs.subquery()
+    rows = db.session.query(pairs.c.id, pairs.c.partner, pairs.c.shows).\
+      filter(pairs.c.rank <= app.config['MATCHING_PARTNERS']).order_by(pairs.c.id, pairs.c.rank)
+    for id, group in groupby(rows, key=lambda row: row.id):
+      self.partners[id] = tuple((row.partner, row.shows) for row in group)
+
+
+class MatchIndex:
+  """Genre masks, places, seeking flags and show partners of every venue
+  and artist."""
+
+  def __init__(self):
+    self.venues = _Side(Venue, Venue.seeking_talent)
+    self.artists = _Side(Artist, Artist.seeking_venue)
+    self.built_at = time.monotonic()
+    # Read first: update() drops the owners of later deletions, even if the
+    # index already left them out
+    self.deletions_seen = db.session.query(db.func.max(Deletion.updated_at)).scalar() or datetime.min
+    # Shows before venues and artists, so every partner has its features
+    self.last_show_id = db.session.query(db.func.max(Show.id)).scalar() or 0
+    self.venues.load_partners('venue_id', 'artist_id')
+    self.artists.load_partners('artist_id', 'venue_id')
+    self.venues.load()
+    self.artists.load()
+
+  def update(self):
+    """Fold in the venues, artists and shows added since the last update,
+    and drop the venues and artists deleted since.
+
+    Returns False, having changed nothing, when a deletion was undone: the
+    index must be rebuilt.
+    """
+    deletions = db.session.query(Deletion.owner_type, Deletion.owner_id, Deletion.status, Deletion.updated_at).\
+      filter(Deletion.updated_at > self.deletions_seen).all()
+    if any(deletion.status == UNDONE for deletion in deletions):
+      return False
+    for deletion in deletions:
+      (self.venues if deletion.owner_type == 'venue' else self.artists).drop(deletion.owner_id)
+      self.deletions_seen = max(self.deletions_seen, deletion.updated_at)
+    shows = db.session.query(Show.id, Show.venue_id, Show.artist_id).filter(Show.id > self.last_show_id).all()
+    if shows:
+      self.last_show_id = max(show.id for show in shows)
+      self.venues.load_partners('venue_id', 'artist_id', {show.venue_id for show in shows})
+      self.artists.load_partners('artist_id', 'venue_id', {show.artist_id for show in shows})
+    self.venues.load()
+    self.artists.load()
+    return True
+
+  def _sides(self, model):
+    # (the side of `model`, the side of its candidates)
+    return (self.artists, self.venues) if model is Artist else (self.venues, self.artists)
+
+  def _history(self, own, other, id):
+    # Candidates two hops away in the show history: the partners of the
+    # partners of this venue's (artist's) partners, by number of paths
+    paths = defaultdict(int)
+    for partner, _ in own.partners.get(id, ()):
+      for peer, _ in other.partners.get(partner, ()):
+        if peer == id:
+          continue
+        for candidate, _ in own.partners.get(peer, ()):
+          paths[candidate] += 1
+    most = max(paths.values(), default=0)
+    return {candidate: count / most for candidate, count in paths.items()}
+
+  def matches(self, model, id, limit=10, seeking=None):
+    """Best venues for artist `id` (model Artist), or artists for venue `id`.
+
+    Returns a list of (candidate id, score, {signal: score}), best first;
+    with `seeking`, only candidates that are looking are ranked. None when
+    the venue or artist doesn't exist.
+    """
+    own, other = self._sides(model)
+    if id not in own.genres:
+      return None
+    weights = app.config['MATCHING_WEIGHTS']
+    mask = own.genres[id]
+    city, state = own.place[id]
+    history = self._history(own, other, id)
+
+    ranked = []
+    for candidate in history.keys() | (other.by_state.get(state, set()) if state else set()):
+      if candidate not in other.genres:
+        # Deleted, but still a partner of partners loaded before
+        continue
+      if seeking and not other.seeking[candidate]:
+        continue
+      candidate_mask = other.genres[candidate]
+      combined = popcount(mask | candidate_mask)
+      candidate_city, candidate_state = other.place[candidate]
+      signals = {
+        'genres': popcount(mask & candidate_mask) / combined if combined else 0.0,
+        'place': 1.0 if state and (city, state) == (candidate_city, candidate_state) else 0.5 if state and state == candidate_state else 0.0,
+        'shows': history.get(candidate, 0.0),
+        'seeking': 1.0 if other.seeking[candidate] else 0.0
+      }
+      score = sum(weights[signal] * value for signal, value in signals.items())
+      ranked.append((-score, candidate, signals))
+    ranked.sort(key=lambda match: match[:2])
+    return [(candidate, -score, signals) for score, candidate, signals in ranked[:limit]]
+
+
+_index = {'index': None}
+_index_lock = threading.Lock()
+
+
+def match_index():
+  """This process's MatchIndex, built or brought up to date."""
+  with _index_lock:
+    index = _index['index']
+    if index is None or time.monotonic() - index.built_at > app.config['MATCHING_INDEX_TTL'] or not index.update():
+      index = _index['index'] = MatchIndex()
+    return index
+
+
+def invalidate_match_index():
+  """Drop this process's MatchIndex; it is rebuilt on the next query."""
+  _index['index'] = None
+
+
+def _invalidate(*args):
+  invalidate_match_index()
+
+
+def _invalidate_bulk(context):
+  if context.mapper is not None and context.mapper.class_ in (Venue, Artist, Show):
+    invalidate_match_index()
+
+
+# Inserts are picked up by MatchIndex.update()
+for _model in (Venue, Artist, Show):
+  for _event in ('after_update', 'after_delete'):
+    db.event.listen(_model, _event, _invalidate)
+db.event.listen(db.session, 'after_bulk_update', _invalidate_bulk)
+db.event.listen(db.session, 'after_bulk_delete', _invalidate_bulk)
@@ -0,0 +1,42 @@
+"""search indexes
+
+Revision ID: 3c1f0e9a2b7d
+Revises: 785996edde7e
+Create Date: 2026-10-18 19:45:12.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0e9a2b7d'
+down_revision = '785996edde7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # array_to_string() is only STABLE, so wrap the search document in an
+    # IMMUTABLE function that expression indexes can use
+    op.execute("""
+        CREATE OR REPLACE FUNCTION fyyur_search_text(name text, city text, state text, genres varchar[])
+        RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT lower(concat_ws(' ', name, city, state, array_to_string(genres, ' ')))
+        $$
+    """)
+    op.execute(
+        'CREATE INDEX ix_venues_search_trgm ON venues '
+        'USING gin (fyyur_search_text(name, city, state, genres) gin_trgm_ops)'
+    )
+    op.execute(
+        'CREATE INDEX ix_artists_search_trgm ON artists '
+        'USING gin (fyyur_search_text(name, city, state, genres) gin_trgm_ops)'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_artists_search_trgm', table_name='artists')
+    op.drop_index('ix_venues_search_trgm', table_name='venues')
+    op.execute('DROP FUNCTION IF EXISTS fyyur_search_text(text, text, text, varchar[])')
@@ -0,0 +1,39 @@
+"""hot query indexes
+
+Revision ID: 5e8a13f6c2d9
+Revises: 9b2d4c71e0a5
+Create Date: 2026-10-18 20:58:03.771904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a13f6c2d9'
+down_revision = '9b2d4c71e0a5'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], {}),
+    ('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], {}),
+    ('ix_shows_start_time_id', 'shows', ['start_time', 'id'], {}),
+    ('ix_venues_state_city', 'venues', ['state', 'city'], {}),
+    ('ix_venues_genres', 'venues', ['genres'], {'postgresql_using': 'gin'}),
+    ('ix_artists_genres', 'artists', ['genres'], {'postgresql_using': 'gin'}),
+]
+
+
+def upgrade():
+    # CONCURRENTLY keeps the tables writable while the indexes build, and
+    # cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, kw in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, **kw)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, kw in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,26 @@
+"""row update timestamps
+
+Revision ID: 9b2d4c71e0a5
+Revises: 3c1f0e9a2b7d
+Create Date: 2026-10-18 20:21:40.518332
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d4c71e0a5'
+down_revision = '3c1f0e9a2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists', 'shows'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=False))
+
+
+def downgrade():
+    for table in ('shows', 'artists', 'venues'):
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,45 @@
+"""soft deletion
+
+Revision ID: a7c2e94d1f53
+Revises: f3c8d15a9e42
+Create Date: 2026-10-18 23:52:18.640127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c2e94d1f53'
+down_revision = 'f3c8d15a9e42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nullable without a default: no table rewrite
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        op.create_index(f'ix_{table}_deleted_at', table, ['deleted_at'], unique=False,
+                        postgresql_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_table('deletions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('owner_type', sa.String(length=10), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('shows_total', sa.Integer(), nullable=False),
+    sa.Column('shows_purged', sa.Integer(), nullable=False),
+    sa.Column('requested_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_deletions_owner', 'deletions', ['owner_type', 'owner_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_deletions_owner', table_name='deletions')
+    op.drop_table('deletions')
+    for table in ('artists', 'venues'):
+        op.drop_index(f'ix_{table}_deleted_at', table_name=table)
+        op.drop_column(table, 'deleted_at')
@@ -0,0 +1,34 @@
+"""unique queued job keys
+
+Revision ID: b5d3f8a2c6e1
+Revises: a7c2e94d1f53
+Create Date: 2026-10-19 09:12:40.318562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d3f8a2c6e1'
+down_revision = 'a7c2e94d1f53'
+branch_labels = None
+depends_on = None
+
+QUEUED = sa.text("status = 'queued'")
+
+
+def upgrade():
+    # Duplicates queued before the index do the same work: keep the oldest
+    op.execute(
+        "DELETE FROM jobs WHERE status = 'queued' AND key IS NOT NULL AND id NOT IN "
+        "(SELECT min(id) FROM jobs WHERE status = 'queued' AND key IS NOT NULL GROUP BY key)"
+    )
+    op.drop_index('ix_jobs_key', table_name='jobs')
+    op.create_index('ix_jobs_queued_key', 'jobs', ['key'], unique=True,
+                    postgresql_where=QUEUED, sqlite_where=QUEUED)
+
+
+def downgrade():
+    op.drop_index('ix_jobs_queued_key', table_name='jobs')
+    op.create_index('ix_jobs_key', 'jobs', ['key'], unique=False)
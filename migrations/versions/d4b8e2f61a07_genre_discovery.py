@@ -0,0 +1,49 @@
+"""genre discovery
+
+Revision ID: d4b8e2f61a07
+Revises: c7f2a9d4e1b3
+Create Date: 2026-10-18 22:31:47.380512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8e2f61a07'
+down_revision = 'c7f2a9d4e1b3'
+branch_labels = None
+depends_on = None
+
+# enums.Genre at this revision, in bit order
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+    'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+    'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other'
+]
+GENRE_MASK = ' | '.join(
+    f"(CASE WHEN '{genre}' = ANY(genres) THEN {1 << position} ELSE 0 END)"
+    for position, genre in enumerate(GENRES)
+)
+
+
+def upgrade():
+    # Stored generated columns: computed on every write, including bulk
+    # inserts that bypass the ORM
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('genre_mask', sa.Integer(), sa.Computed(GENRE_MASK, persisted=True)))
+    op.create_table('upcoming_show_facets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=True),
+    sa.Column('city', sa.String(length=120), nullable=True),
+    sa.Column('genre_mask', sa.Integer(), nullable=False),
+    sa.Column('num_shows', sa.Integer(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('upcoming_show_facets')
+    for table in ('artists', 'venues'):
+        op.drop_column(table, 'genre_mask')
@@ -0,0 +1,31 @@
+"""show durations
+
+Revision ID: e6a91c3f7b20
+Revises: d4b8e2f61a07
+Create Date: 2026-10-18 20:41:12.903177
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a91c3f7b20'
+down_revision = 'd4b8e2f61a07'
+branch_labels = None
+depends_on = None
+
+# SHOW_DEFAULT_DURATION when this revision was written
+DEFAULT_DURATION = 120
+
+
+def upgrade():
+    op.add_column('shows', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.execute(f"UPDATE shows SET end_time = start_time + interval '{DEFAULT_DURATION} minutes'")
+    op.alter_column('shows', 'end_time', nullable=False)
+    op.create_check_constraint('ck_shows_end_after_start', 'shows', 'end_time > start_time')
+
+
+def downgrade():
+    op.drop_constraint('ck_shows_end_after_start', 'shows', type_='check')
+    op.drop_column('shows', 'end_time')
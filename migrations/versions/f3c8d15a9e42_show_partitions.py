@@ -0,0 +1,108 @@
+"""show partitions
+
+Revision ID: f3c8d15a9e42
+Revises: e6a91c3f7b20
+Create Date: 2026-10-18 21:27:05.114830
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d15a9e42'
+down_revision = 'e6a91c3f7b20'
+branch_labels = None
+depends_on = None
+
+# Monthly partitions are created up to this many months from now; later
+# ones by roll_show_partitions()
+MONTHS_AHEAD = 12
+
+COLUMNS = 'id, artist_id, venue_id, start_time, end_time, updated_at'
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _create_indexes(table):
+    op.create_foreign_key(f'{table}_artist_id_fkey', table, 'artists', ['artist_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key(f'{table}_venue_id_fkey', table, 'venues', ['venue_id'], ['id'], ondelete='CASCADE')
+    op.create_index(f'ix_{table}_venue_id_start_time', table, ['venue_id', 'start_time'])
+    op.create_index(f'ix_{table}_artist_id_start_time', table, ['artist_id', 'start_time'])
+    op.create_index(f'ix_{table}_start_time_id', table, ['start_time', 'id'])
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.execute('ALTER TABLE shows RENAME TO shows_unpartitioned')
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY NONE')
+    op.execute("""
+        CREATE TABLE shows (
+            id integer NOT NULL DEFAULT nextval('shows_id_seq'),
+            artist_id integer,
+            venue_id integer,
+            start_time timestamp without time zone NOT NULL,
+            end_time timestamp without time zone NOT NULL,
+            updated_at timestamp without time zone NOT NULL DEFAULT timezone('utc', now()),
+            CONSTRAINT ck_shows_end_after_start CHECK (end_time > start_time)
+        ) PARTITION BY RANGE (start_time)
+    """)
+
+    # A partition per month from the first show to a few months ahead;
+    # later shows go to the default partition
+    first = bind.execute('SELECT min(start_time) FROM shows_unpartitioned').scalar()
+    now = datetime.utcnow()
+    month = datetime(min(first or now, now).year, min(first or now, now).month, 1)
+    while month <= _add_months(now, MONTHS_AHEAD):
+        end = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE shows_y{month.year:04}m{month.month:02} PARTITION OF shows "
+            f"FOR VALUES FROM ('{month.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+        )
+        month = end
+    op.execute('CREATE TABLE shows_default PARTITION OF shows DEFAULT')
+
+    op.execute(f'INSERT INTO shows ({COLUMNS}) SELECT {COLUMNS} FROM shows_unpartitioned')
+    op.execute('DROP TABLE shows_unpartitioned')
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY shows.id')
+    # Indexes and keys are built after the copy, and cascade to the partitions
+    op.create_primary_key('shows_pkey', 'shows', ['id', 'start_time'])
+    _create_indexes('shows')
+
+    op.create_table('shows_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=True),
+        sa.Column('venue_id', sa.Integer(), nullable=True),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.Column('end_time', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    _create_indexes('shows_archive')
+
+
+def downgrade():
+    op.execute('ALTER TABLE shows RENAME TO shows_partitioned')
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY NONE')
+    op.execute("""
+        CREATE TABLE shows (
+            id integer NOT NULL DEFAULT nextval('shows_id_seq'),
+            artist_id integer,
+            venue_id integer,
+            start_time timestamp without time zone NOT NULL,
+            end_time timestamp without time zone NOT NULL,
+            updated_at timestamp without time zone NOT NULL DEFAULT timezone('utc', now()),
+            CONSTRAINT ck_shows_end_after_start CHECK (end_time > start_time)
+        )
+    """)
+    op.execute(f'INSERT INTO shows ({COLUMNS}) SELECT {COLUMNS} FROM shows_partitioned')
+    op.execute(f'INSERT INTO shows ({COLUMNS}) SELECT {COLUMNS} FROM shows_archive')
+    op.drop_table('shows_archive')
+    op.execute('DROP TABLE shows_partitioned')
+    op.execute('ALTER SEQUENCE shows_id_seq OWNED BY shows.id')
+    op.create_primary_key('shows_pkey', 'shows', ['id'])
+    _create_indexes('shows')
@@ -1,11 +1,21 @@
-from fyyur_01.app import db
-from datetime import datetime
+from fyyur_01.app import app, db
+from fyyur_01.jobs import job, enqueue
+from fyyur_01.enums import genre_mask_sql
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Query
+from datetime import datetime, timedelta
+from itertools import groupby
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_state_city', 'state', 'city'),
+        db.Index('ix_venues_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_venues_deleted_at', 'deleted_at', postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -16,10 +26,16 @@ class Venue(db.Model):
     image_link = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120), nullable=True)
     website = db.Column(db.String(120), nullable=True)
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(ARRAY(db.String), nullable=False)
+    # Bitmask of genres (enums.GENRE_BITS), computed by the database
+    genre_mask = db.Column(db.Integer, db.Computed(genre_mask_sql('genres'), persisted=True))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120), nullable=True)
-    shows = db.relationship('Show', backref=db.backref('venues', cascade='all,  delete'))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.text("timezone('utc', now())"))
+    # Set while the venue's shows are purged, see deletion.py
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    # Shows are removed by the purge, or by the foreign key's ON DELETE CASCADE
+    shows = db.relationship('Show', backref='venue', passive_deletes=True)
 
     def __repr__(self):
       return f'Venue {self.id}: {self.name} @ {self.city}, {self.state}'
@@ -27,42 +43,463 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        db.Index('ix_artists_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_artists_deleted_at', 'deleted_at', postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String))
+    genres = db.Column(ARRAY(db.String))
+    genre_mask = db.Column(db.Integer, db.Computed(genre_mask_sql('genres'), persisted=True))
     image_link = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120), nullable=True)
     website = db.Column(db.String(120), nullable=True)
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120), nullable=True)
-    shows = db.relationship('Show', backref=db.backref('artists', cascade='all, delete'))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.text("timezone('utc', now())"))
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    shows = db.relationship('Show', backref='artist', passive_deletes=True)
 
     def __repr__(self):
       return f'Arist {self.id}: {self.name} @ {self.city}, {self.state}'
 
 
+def _default_end_time(context):
+  # Shows listed without a duration last SHOW_DEFAULT_DURATION minutes
+  return context.get_current_parameters()['start_time'] + timedelta(minutes=app.config['SHOW_DEFAULT_DURATION'])
+
+
 class Show(db.Model):
+  """A show; on Postgres stored in monthly partitions by start_time (see
+  partitions.py), so the primary key includes start_time."""
   __tablename__ = 'shows'
+  __table_args__ = (
+    db.PrimaryKeyConstraint('id', 'start_time', name='shows_pkey'),
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+    db.CheckConstraint('end_time > start_time', name='ck_shows_end_after_start'),
+    {'postgresql_partition_by': 'RANGE (start_time)'}
+  )
 
-  id = db.Column(db.Integer, primary_key=True)
+  id = db.Column(db.Integer, autoincrement=True)
   artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'))
   venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'))
   start_time = db.Column(db.DateTime, nullable=False)
+  end_time = db.Column(db.DateTime, nullable=False, default=_default_end_time)
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.text("timezone('utc', now())"))
+
+  # Ids are unique on their own
+  __mapper_args__ = {'primary_key': [id]}
 
   def __repr__(self):
     return f'Show {self.id}: {self.artist.name} @ {self.venue.name} on {self.start_time.strftime("%Y-%m-%d %H:%M")}'
 
 
+# Until roll_show_partitions() adds monthly partitions, shows go here
+db.event.listen(
+  Show.__table__, 'after_create',
+  db.DDL('CREATE TABLE shows_default PARTITION OF shows DEFAULT').execute_if(dialect='postgresql')
+)
+
+
+class ShowArchive(db.Model):
+  """Shows of past months, moved out of the shows partitions by
+  roll_show_partitions(). Only written by the archiving; read through
+  all_shows."""
+  __tablename__ = 'shows_archive'
+  __table_args__ = (
+    db.Index('ix_shows_archive_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_archive_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_archive_start_time_id', 'start_time', 'id'),
+  )
+
+  id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+  artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'))
+  venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'))
+  start_time = db.Column(db.DateTime, nullable=False)
+  end_time = db.Column(db.DateTime, nullable=False)
+  updated_at = db.Column(db.DateTime, nullable=False)
+
+  def __repr__(self):
+    return f'ShowArchive {self.id} on {self.start_time.strftime("%Y-%m-%d %H:%M")}'
+
+
+# Shows and archived shows, for queries that reach into the past. Postgres
+# pushes filters, and the order of ORDER BY ... LIMIT, down to both
+# tables' indexes.
+all_shows = db.union_all(
+  db.select([Show.id, Show.artist_id, Show.venue_id, Show.start_time, Show.end_time, Show.updated_at]),
+  db.select([
+    ShowArchive.id, ShowArchive.artist_id, ShowArchive.venue_id, ShowArchive.start_time, ShowArchive.end_time,
+    ShowArchive.updated_at
+  ])
+).alias('all_shows')
+
+
+#  Soft deletion
+#  ----------------------------------------------------------------
+
+# A deleted venue or artist keeps its row, with deleted_at set, until its
+# shows are purged in the background (see deletion.py). ORM queries that
+# select it, or any of its columns, leave deleted rows out unless run with
+# execution_options(include_deleted=True); queries that only reach it
+# through shows filter with deleted_ids().
+
+SOFT_DELETED = (Venue, Artist)
+
+
+@db.event.listens_for(Query, 'before_compile', retval=True, bake_ok=True)
+def _leave_out_deleted(query):
+  if query._execution_options.get('include_deleted'):
+    return query
+  entities = {description['entity'] for description in query.column_descriptions}
+  for model in SOFT_DELETED:
+    if model in entities:
+      query = query.enable_assertions(False).filter(model.deleted_at.is_(None))
+  return query
+
+
+def deleted_ids(model):
+  """Select of the ids of deleted `model` rows whose shows aren't purged
+  yet; usually empty, and read from a partial index."""
+  return db.select([model.id]).where(model.deleted_at.isnot(None))
+
+
+class UpcomingShowCount(db.Model):
+  """Materialized upcoming show count per venue/artist (UPCOMING_COUNTS_TABLE).
+
+  Kept current by the recount jobs that the Show insert/delete listeners
+  below queue; `next_start_time` is the soonest upcoming show, so
+  refresh_upcoming_counts() only has to recount owners with a show that
+  has started since the last refresh.
+  """
+  __tablename__ = 'upcoming_show_counts'
+
+  owner_type = db.Column(db.String(6), primary_key=True)
+  owner_id = db.Column(db.Integer, primary_key=True)
+  num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0)
+  next_start_time = db.Column(db.DateTime, nullable=True)
+
+  def __repr__(self):
+    return f'UpcomingShowCount {self.owner_type} {self.owner_id}: {self.num_upcoming_shows}'
+
+
+# "now" is bound at execution time, not when this module is imported
+_now = db.bindparam('now', callable_=datetime.utcnow, type_=db.DateTime)
+
 Artist.num_upcoming_shows = db.column_property(
   db.select([db.func.count(Show.id)]).\
-    where(Show.artist_id==Artist.id).where(Show.start_time > datetime.now())
+    where(Show.artist_id==Artist.id).where(Show.start_time > _now),
+  deferred=True
 )
 
 Venue.num_upcoming_shows = db.column_property(
   db.select([db.func.count(Show.id)]).\
-    where(Show.venue_id==Venue.id).where(Show.start_time > datetime.now())
+    where(Show.venue_id==Venue.id).where(Show.start_time > _now),
+  deferred=True
 )
+
+
+def _owners(show):
+  return (('venue', show.venue_id), ('artist', show.artist_id))
+
+
+@db.event.listens_for(Show, 'after_insert')
+@db.event.listens_for(Show, 'after_delete')
+def _queue_upcoming_recount(mapper, connection, show):
+  # Recounted by a background job; a queued recount of the same owner
+  # covers this change too
+  if not app.config['UPCOMING_COUNTS_TABLE'] or show.start_time <= datetime.utcnow():
+    return
+  for owner_type, owner_id in _owners(show):
+    enqueue(
+      'recount_upcoming', {'owner_type': owner_type, 'ids': [owner_id]},
+      key=f'upcoming:{owner_type}:{owner_id}', connection=connection
+    )
+
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def venue_areas(page=None, per_page=None):
+  """Venues grouped by (city, state), built from a single projection query.
+
+  Only id, name, city, state and the upcoming show count are selected, and
+  rows come back ordered by area so grouping is a single pass. When `page`
+  is given, only `per_page` areas (not venues) are returned.
+  """
+  now = datetime.utcnow()
+  upcoming = db.session.query(
+    Show.venue_id, db.func.count(Show.id).label('num_upcoming_shows')
+  ).filter(Show.start_time > now).group_by(Show.venue_id).subquery()
+  # Less those of deleted artists, until they are purged
+  hidden = db.session.query(
+    Show.venue_id, db.func.count(Show.id).label('num_upcoming_shows')
+  ).filter(Show.start_time > now, Show.artist_id.in_(deleted_ids(Artist))).group_by(Show.venue_id).subquery()
+
+  area_no = db.func.dense_rank().over(order_by=(Venue.state, Venue.city)).label('area_no')
+  rows = db.session.query(
+    Venue.id, Venue.name, Venue.city, Venue.state,
+    (db.func.coalesce(upcoming.c.num_upcoming_shows, 0) - db.func.coalesce(hidden.c.num_upcoming_shows, 0)).\
+      label('num_upcoming_shows'),
+    area_no
+  ).outerjoin(upcoming, upcoming.c.venue_id == Venue.id).outerjoin(hidden, hidden.c.venue_id == Venue.id).subquery()
+
+  query = db.session.query(rows)
+  if page is not None:
+    first = (page - 1) * per_page + 1
+    query = query.filter(rows.c.area_no.between(first, first + per_page - 1))
+  query = query.order_by(rows.c.area_no, rows.c.name, rows.c.id)
+
+  return [{
+    'city': city,
+    'state': state,
+    'venues': [{
+      'id': row.id,
+      'name': row.name,
+      'num_upcoming_shows': row.num_upcoming_shows
+    } for row in area_rows]
+  } for (city, state), area_rows in groupby(query, key=lambda row: (row.city, row.state))]
+
+
+def show_timeline(owner, owner_id, now=None, page_size=None, past_before=None, upcoming_after=None):
+  """Past and upcoming shows of a venue or artist, loaded in a single query.
+
+  `owner` is Venue or Artist; each show row carries the id, name and image
+  link of the counterpart (the artist for a venue, the venue for an artist),
+  prefixed accordingly. Shows are split into past/upcoming at one `now`.
+  With `page_size`, each side is keyset-paginated on (start_time, id), so
+  shows starting at the same time aren't skipped: past shows newest first
+  before the (start_time, id) `past_before`, upcoming shows soonest first
+  after `upcoming_after`. Counts are always totals for the whole timeline,
+  archived shows included.
+  """
+  now = now or datetime.utcnow()
+  shows = all_shows.c
+  if owner is Venue:
+    owner_fk, counterpart, fk, prefix = shows.venue_id, Artist, shows.artist_id, 'artist'
+  else:
+    owner_fk, counterpart, fk, prefix = shows.artist_id, Venue, shows.venue_id, 'venue'
+
+  is_upcoming = shows.start_time > now
+  counted = lambda *criteria: db.session.query(
+    db.func.count(db.case([(is_upcoming, None)], else_=shows.id)).label('past_count'),
+    db.func.count(db.case([(is_upcoming, shows.id)])).label('upcoming_count')
+  ).select_from(all_shows).filter(owner_fk == owner_id, *criteria).subquery()
+  counts = counted()
+  # Shows with a deleted counterpart, until they are purged; subtracted,
+  # since filtering them out would read the counterpart of every show
+  hidden = counted(fk.in_(deleted_ids(counterpart)))
+
+  page = db.session.query(
+    shows.id,
+    shows.start_time,
+    counterpart.id.label('counterpart_id'),
+    counterpart.name.label('counterpart_name'),
+    counterpart.image_link.label('counterpart_image_link'),
+    is_upcoming.label('is_upcoming'),
+    db.func.row_number().over(
+      partition_by=is_upcoming,
+      order_by=(
+        db.case([(is_upcoming, shows.start_time)]).asc(), shows.start_time.desc(),
+        db.case([(is_upcoming, shows.id)]).asc(), shows.id.desc()
+      )
+    ).label('rn')
+  ).select_from(all_shows).join(counterpart, counterpart.id == fk).filter(owner_fk == owner_id)
+  if past_before is not None:
+    page = page.filter(db.or_(is_upcoming, db.tuple_(shows.start_time, shows.id) < db.tuple_(*past_before)))
+  if upcoming_after is not None:
+    page = page.filter(db.or_(~is_upcoming, db.tuple_(shows.start_time, shows.id) > db.tuple_(*upcoming_after)))
+  page = page.subquery()
+
+  on = db.true() if page_size is None else page.c.rn <= page_size
+  rows = db.session.query(
+    (counts.c.past_count - hidden.c.past_count).label('past_count'),
+    (counts.c.upcoming_count - hidden.c.upcoming_count).label('upcoming_count'),
+    page
+  ).select_from(counts).join(hidden, db.true()).outerjoin(page, on).order_by(page.c.rn).all()
+
+  timeline = {
+    'past_shows': [],
+    'upcoming_shows': [],
+    'past_shows_count': rows[0].past_count,
+    'upcoming_shows_count': rows[0].upcoming_count
+  }
+  last = {}
+  for row in rows:
+    if row.start_time is None:
+      continue
+    side = 'upcoming_shows' if row.is_upcoming else 'past_shows'
+    last[side] = (row.start_time, row.id)
+    timeline[side].append({
+      f'{prefix}_id': row.counterpart_id,
+      f'{prefix}_name': row.counterpart_name,
+      f'{prefix}_image_link': row.counterpart_image_link,
+      'start_time': row.start_time
+    })
+
+  # (start_time, id) cursors for the next page of each side, when there may be one
+  cursor = lambda side: last[side] if page_size is not None and len(timeline[side]) == page_size else None
+  timeline['past_before'] = cursor('past_shows')
+  timeline['upcoming_after'] = cursor('upcoming_shows')
+  return timeline
+
+
+def _count_query(owner, now):
+  if owner is Venue:
+    owner_fk, counterpart, fk = Show.venue_id, Artist, Show.artist_id
+  else:
+    owner_fk, counterpart, fk = Show.artist_id, Venue, Show.venue_id
+  return db.session.query(
+    owner_fk.label('owner_id'),
+    db.func.count(Show.id).label('num_upcoming_shows'),
+    db.func.min(Show.start_time).label('next_start_time')
+  ).filter(Show.start_time > now, fk.notin_(deleted_ids(counterpart))).group_by(owner_fk), owner_fk
+
+
+def upcoming_show_counts(owner, ids, now=None):
+  """Map of id -> upcoming show count for the given Venue or Artist ids.
+
+  One GROUP BY query for a whole result page, or a lookup in the
+  materialized counts table when UPCOMING_COUNTS_TABLE is enabled.
+  Ids without upcoming shows map to 0.
+  """
+  counts = dict.fromkeys(ids, 0)
+  if not counts:
+    return counts
+  if app.config['UPCOMING_COUNTS_TABLE']:
+    rows = db.session.query(UpcomingShowCount.owner_id, UpcomingShowCount.num_upcoming_shows).\
+      filter(UpcomingShowCount.owner_type == owner.__name__.lower()).\
+      filter(UpcomingShowCount.owner_id.in_(counts))
+  else:
+    query, owner_fk = _count_query(owner, now or datetime.utcnow())
+    rows = query.filter(owner_fk.in_(counts)).with_entities(owner_fk, db.func.count(Show.id))
+  counts.update(rows)
+  return counts
+
+
+@job('refresh_upcoming_counts')
+def refresh_upcoming_counts(full=False):
+  """Recount the materialized table for owners whose next show has started.
+
+  With `full`, the table is rebuilt from scratch. Returns the number of
+  count rows written.
+  """
+  now = datetime.utcnow()
+  recounted = 0
+  for owner in (Venue, Artist):
+    owner_type = owner.__name__.lower()
+    query, owner_fk = _count_query(owner, now)
+    stale = UpcomingShowCount.query.filter(UpcomingShowCount.owner_type == owner_type)
+    if not full:
+      stale = stale.filter(UpcomingShowCount.next_start_time <= now)
+      ids = [owner_id for owner_id, in stale.with_entities(UpcomingShowCount.owner_id)]
+      if not ids:
+        continue
+      query = query.filter(owner_fk.in_(ids))
+    stale.delete(synchronize_session=False)
+    rows = [{'owner_type': owner_type, **row._asdict()} for row in query]
+    db.session.bulk_insert_mappings(UpcomingShowCount, rows)
+    recounted += len(rows)
+    if not full:
+      _mark_recounted(owner_type, ids)
+  if full:
+    _mark_recounted()
+  db.session.commit()
+  return recounted
+
+
+@job('recount_upcoming')
+def recount_upcoming(owner_type, ids):
+  """Recount the materialized upcoming show counts of some venues or artists.
+
+  Returns the number of count rows written.
+  """
+  owner = Venue if owner_type == 'venue' else Artist
+  query, owner_fk = _count_query(owner, datetime.utcnow())
+  UpcomingShowCount.query.filter(UpcomingShowCount.owner_type == owner_type).\
+    filter(UpcomingShowCount.owner_id.in_(ids)).delete(synchronize_session=False)
+  rows = [{'owner_type': owner_type, **row._asdict()} for row in query.filter(owner_fk.in_(ids))]
+  db.session.bulk_insert_mappings(UpcomingShowCount, rows)
+  _mark_recounted(owner_type, ids)
+  db.session.commit()
+  return len(rows)
+
+
+def _mark_recounted(owner_type=None, ids=()):
+  # Cached pages showing these counts (all of them, without `owner_type`)
+  # are invalidated on commit; cache.py imports this module
+  from fyyur_01.cache import mark_changed
+  if owner_type is None:
+    mark_changed('all')
+  else:
+    mark_changed(f'{owner_type}s', *(f'{owner_type}:{id}' for id in ids))
+
+
+def genres_filter(column, genres, match_all=False):
+  """Rows of `column` with any of `genres`, or with `match_all`, all of them.
+
+  Both are answered from the GIN index on the genres column.
+  """
+  genres = db.cast(list(genres), column.type)
+  return column.contains(genres) if match_all else column.overlap(genres)
+
+
+def show_listing(start=None, end=None, venue_id=None, artist_id=None, genre=None, after=None, limit=None,
+                 genres=None, match_all=False, state=None, city=None, with_updated_at=False):
+  """Shows joined with their venue and artist columns, for /shows.
+
+  Ordered by (start_time, id) and keyset-paginated: `after` is the
+  (start_time, id) of the last show of the previous page. Optionally
+  filtered by a start/end datetime range, venue, artist and artist genre,
+  artists with any (or with `match_all`, all) of `genres`, and venue
+  state and city. Archived shows are listed too, unless `start` is in the
+  current month or later. With `with_updated_at`, rows also carry the
+  updated_at of the show, its venue and its artist, to stamp the page.
+  Returns a query of rows; iterate it to stream results in batches.
+  """
+  # Only months before the current one are archived
+  month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+  source = Show.__table__ if start is not None and start >= month else all_shows
+  shows = source.c
+  query = db.session.query(
+    shows.id,
+    shows.start_time,
+    shows.venue_id,
+    Venue.name.label('venue_name'),
+    shows.artist_id,
+    Artist.name.label('artist_name'),
+    Artist.image_link.label('artist_image_link')
+  ).select_from(source).join(Venue, Venue.id == shows.venue_id).join(Artist, Artist.id == shows.artist_id)
+  if with_updated_at:
+    query = query.add_columns(
+      shows.updated_at, Venue.updated_at.label('venue_updated_at'), Artist.updated_at.label('artist_updated_at')
+    )
+  if start is not None:
+    query = query.filter(shows.start_time >= start)
+  if end is not None:
+    query = query.filter(shows.start_time < end)
+  if venue_id is not None:
+    query = query.filter(shows.venue_id == venue_id)
+  if artist_id is not None:
+    query = query.filter(shows.artist_id == artist_id)
+  if genre is not None:
+    query = query.filter(genres_filter(Artist.genres, [genre]))
+  if genres:
+    query = query.filter(genres_filter(Artist.genres, genres, match_all))
+  if state is not None:
+    query = query.filter(Venue.state == state)
+  if city is not None:
+    query = query.filter(Venue.city == city)
+  if after is not None:
+    query = query.filter(db.tuple_(shows.start_time, shows.id) > db.tuple_(*after))
+  query = query.order_by(shows.start_time, shows.id)
+  if limit is not None:
+    query = query.limit(limit)
+  return query.execution_options(stream_results=True).yield_per(500)
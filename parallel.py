@@ -0,0 +1,62 @@
+from fyyur_01.app import app
+from fyyur_01.instrumentation import timed
+from fyyur_01.replicas import reading_from, read_from
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+#----------------------------------------------------------------------------#
+# Concurrent queries.
+#----------------------------------------------------------------------------#
+
+# The independent queries of a page (a venue and its show timeline, the
+# upcoming shows and their facet counts) run at the same time: the first
+# in the request's thread, the others on a per-process pool of
+# PAGE_QUERY_THREADS threads, each in its own app context and so with its
+# own session and pooled connection (on the request's replica, if it reads
+# from one). psycopg2 releases the GIL while it waits for Postgres, so a
+# page takes about as long as its slowest query.
+#
+# Only for reads: the other threads don't see the request's uncommitted
+# writes.
+
+_pool = {'executor': None, 'key': None}
+_pool_lock = threading.Lock()
+
+
+def _executor():
+  threads = app.config['PAGE_QUERY_THREADS']
+  if not threads:
+    return None
+  # A forked child inherits the executor but not its threads
+  key = (os.getpid(), threads)
+  with _pool_lock:
+    if _pool['key'] != key:
+      if _pool['executor'] is not None and _pool['key'][0] == key[0]:
+        _pool['executor'].shutdown(wait=False)
+      _pool.update(executor=ThreadPoolExecutor(threads, thread_name_prefix='fyyur-queries'), key=key)
+    return _pool['executor']
+
+
+def _in_app_context(call, replica):
+  # The session is removed when the context is popped
+  with app.app_context():
+    read_from(replica)
+    return call()
+
+
+def gather(*calls):
+  """Run `calls`, functions taking no arguments, concurrently; returns
+  their results in order. Raises the exception of the first call that
+  failed. With PAGE_QUERY_THREADS = 0 they run in turn.
+  """
+  executor = _executor()
+  if executor is None or len(calls) < 2:
+    return [call() for call in calls]
+  # Reading from the same replica as the request
+  replica = reading_from()
+  futures = [executor.submit(_in_app_context, call, replica) for call in calls[1:]]
+  first = calls[0]()
+  # Their statements aren't counted per request; the wait is
+  with timed('sql'):
+    return [first] + [future.result() for future in futures]
@@ -0,0 +1,116 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import ShowArchive
+from fyyur_01.jobs import job, enqueue
+from datetime import datetime
+import re
+
+#----------------------------------------------------------------------------#
+# Show partitions.
+#----------------------------------------------------------------------------#
+
+# On Postgres, the shows table is partitioned by start_time, one partition
+# per month (shows_y2021m05), with a default partition (shows_default)
+# catching shows outside them. Upcoming show queries only touch the
+# current and later months.
+#
+# roll_show_partitions() keeps SHOW_PARTITIONS_AHEAD months of partitions
+# ahead of the current one, moving any of their shows out of the default
+# partition, and moves the months that ended SHOW_ARCHIVE_AFTER_MONTHS
+# ago to the shows_archive table. Past show queries read both tables
+# through models.all_shows. The job queues its next run a day later.
+
+PARTITION_NAME = re.compile(r'^shows_y(\d{4})m(\d{2})$')
+DEFAULT_PARTITION = 'shows_default'
+
+
+def _month(value):
+  return datetime(value.year, value.month, 1)
+
+
+def _add_months(month, count):
+  index = month.year * 12 + month.month - 1 + count
+  return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+  return f'shows_y{month.year:04}m{month.month:02}'
+
+
+def partitioned():
+  """Whether the shows table is partitioned (only on Postgres)."""
+  if db.engine.dialect.name != 'postgresql':
+    return False
+  return bool(db.session.execute(
+    "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('shows')"
+  ).scalar())
+
+
+def show_partitions():
+  """The months with a partition, in order."""
+  names = db.session.execute(
+    "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+    "WHERE pg_inherits.inhparent = to_regclass('shows')"
+  )
+  months = [PARTITION_NAME.match(name) for name, in names]
+  return sorted(datetime(int(match.group(1)), int(match.group(2)), 1) for match in months if match)
+
+
+def create_show_partition(month):
+  """Add the partition of `month`, moving its shows out of the default
+  partition (which would otherwise block the new partition)."""
+  start, end = month.isoformat(sep=' '), _add_months(month, 1).isoformat(sep=' ')
+  db.session.execute(
+    f"CREATE TEMPORARY TABLE moved_shows AS WITH moved AS ("
+    f"DELETE FROM {DEFAULT_PARTITION} WHERE start_time >= '{start}' AND start_time < '{end}' RETURNING *"
+    f") SELECT * FROM moved"
+  )
+  db.session.execute(f"CREATE TABLE {partition_name(month)} PARTITION OF shows FOR VALUES FROM ('{start}') TO ('{end}')")
+  db.session.execute('INSERT INTO shows SELECT * FROM moved_shows')
+  db.session.execute('DROP TABLE moved_shows')
+
+
+def archive_show_partition(month):
+  """Move the shows of `month` to shows_archive and drop its partition."""
+  columns = ', '.join(column.name for column in ShowArchive.__table__.c)
+  name = partition_name(month)
+  db.session.execute(f'INSERT INTO shows_archive ({columns}) SELECT {columns} FROM {name}')
+  db.session.execute(f'ALTER TABLE shows DETACH PARTITION {name}')
+  db.session.execute(f'DROP TABLE {name}')
+
+
+@job('roll_show_partitions')
+def roll_show_partitions(now=None):
+  """Create the partitions of the coming months and archive old ones.
+
+  Returns {'created': [...], 'archived': [...]} partition names. Does
+  nothing unless the shows table is partitioned.
+  """
+  rolled = {'created': [], 'archived': []}
+  if not partitioned():
+    return rolled
+  current = _month(now or datetime.utcnow())
+  cutoff = _add_months(current, -app.config['SHOW_ARCHIVE_AFTER_MONTHS'])
+  existing = show_partitions()
+
+  # Each partition is created or archived in its own transaction, so a
+  # failure (and the job's retry) only repeats the remaining ones
+  month = cutoff
+  while month <= _add_months(current, app.config['SHOW_PARTITIONS_AHEAD']):
+    if month not in existing:
+      create_show_partition(month)
+      db.session.commit()
+      rolled['created'].append(partition_name(month))
+    month = _add_months(month, 1)
+  for month in existing:
+    if month < cutoff:
+      archive_show_partition(month)
+      db.session.commit()
+      rolled['archived'].append(partition_name(month))
+  columns = ', '.join(column.name for column in ShowArchive.__table__.c)
+  db.session.execute(
+    f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE start_time < '{cutoff.isoformat(sep=' ')}' RETURNING {columns}) "
+    f"INSERT INTO shows_archive ({columns}) SELECT {columns} FROM moved"
+  )
+  enqueue('roll_show_partitions', key='partitions:shows', delay=24 * 60 * 60)
+  db.session.commit()
+  return rolled
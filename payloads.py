@@ -0,0 +1,235 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, venue_areas, show_timeline, upcoming_show_counts, show_listing
+from fyyur_01.search import search
+from fyyur_01.discovery import discover_owners, discover_shows, show_facets
+from fyyur_01.matching import match_index
+from fyyur_01.scheduling import free_slots
+from fyyur_01.enums import GENRE_BITS
+from fyyur_01.cache import cache_tags
+from fyyur_01.parallel import gather
+from flask import abort
+from datetime import datetime, timedelta
+
+#----------------------------------------------------------------------------#
+# Payloads.
+#----------------------------------------------------------------------------#
+
+# The dicts the pages render, shared by the HTML routes and the JSON API.
+# Argument parsers take the request's args MultiDict.
+
+def _parse_datetime(value):
+  return datetime.fromisoformat(value)
+
+
+def timeline_args(args):
+  # (start_time, id) keyset cursors for show timelines, e.g.
+  # ?past_before=2021-01-01T20:00:00&past_before_id=42
+  cursor = lambda name: (args.get(name, type=_parse_datetime), args.get(name + '_id', type=int))
+  past_before, upcoming_after = cursor('past_before'), cursor('upcoming_after')
+  return {
+    'page_size': app.config['SHOW_TIMELINE_PAGE_SIZE'],
+    'past_before': past_before if None not in past_before else None,
+    'upcoming_after': upcoming_after if None not in upcoming_after else None
+  }
+
+
+def show_listing_args(args):
+  # Filters and (start_time, id) keyset cursor for /shows
+  filters = {
+    'start': args.get('start', type=_parse_datetime),
+    'end': args.get('end', type=_parse_datetime),
+    'venue_id': args.get('venue_id', type=int),
+    'artist_id': args.get('artist_id', type=int),
+    'genre': args.get('genre') or None
+  }
+  after = (args.get('after_time', type=_parse_datetime), args.get('after_id', type=int))
+  filters['after'] = after if None not in after else None
+  return filters
+
+
+def discovery_args(args):
+  # Filters and pagination for /discover, e.g.
+  # ?genre=Jazz&genre=Blues&match=all&state=NY&city=New York&seeking=1
+  after = (args.get('after_time', type=_parse_datetime), args.get('after_id', type=int))
+  return {
+    'filters': {
+      'genres': [genre for genre in args.getlist('genre') if genre in GENRE_BITS],
+      'match_all': args.get('match') == 'all',
+      'state': args.get('state') or None,
+      'city': args.get('city') or None,
+      'seeking': {'1': True, '0': False}.get(args.get('seeking'))
+    },
+    'page': max(args.get('page', 1, type=int), 1),
+    'after': after if None not in after else None
+  }
+
+
+def free_slots_args(args):
+  # ?start=2030-01-01T00:00:00&end=...&duration=90, at most a year apart;
+  # the next 30 days from now by default
+  start = args.get('start', type=_parse_datetime) or datetime.utcnow().replace(second=0, microsecond=0)
+  end = args.get('end', type=_parse_datetime) or start + timedelta(days=30)
+  return {
+    'start': start,
+    'end': min(end, start + timedelta(days=366)),
+    'duration': max(args.get('duration', app.config['SHOW_DEFAULT_DURATION'], type=int), 1)
+  }
+
+
+def matching_args(args):
+  # Number of matches and, with ?seeking=1, only those looking
+  return {
+    'limit': min(max(args.get('limit', 10, type=int), 1), app.config['MATCHING_MAX_RESULTS']),
+    'seeking': args.get('seeking') == '1'
+  }
+
+
+def venues_data(page=None):
+  # Group venues by city/state in one query; `page` limits to a slice of areas
+  if page:
+    return venue_areas(page, app.config['VENUE_AREAS_PER_PAGE'])
+  return venue_areas()
+
+
+def venue_data(venue_id, **timeline):
+  # The venue and its timeline are read concurrently
+  new_data, shows = gather(lambda: _venue(venue_id), lambda: show_timeline(Venue, venue_id, **timeline))
+  new_data.update(shows)
+  cache_tags(*{f"artist:{show['artist_id']}" for show in new_data['past_shows'] + new_data['upcoming_shows']})
+  return new_data
+
+
+def _venue(venue_id):
+  venue = Venue.query.filter_by(id=venue_id).first_or_404()
+  return {
+    'id': venue.id,
+    'name': venue.name,
+    'genres': venue.genres,
+    'address': venue.address,
+    'city': venue.city,
+    'state': venue.state,
+    'phone': venue.phone,
+    'website': venue.website,
+    'facebook_link': venue.facebook_link,
+    'image_link': venue.image_link,
+    'seeking_talent': venue.seeking_talent,
+    'seeking_description': venue.seeking_description
+  }
+
+
+def artists_data():
+  return [
+    {'id': artist.id, 'name': artist.name}
+    for artist in db.session.query(Artist.id, Artist.name)
+  ]
+
+
+def artist_data(artist_id, **timeline):
+  new_data, shows = gather(lambda: _artist(artist_id), lambda: show_timeline(Artist, artist_id, **timeline))
+  new_data.update(shows)
+  cache_tags(*{f"venue:{show['venue_id']}" for show in new_data['past_shows'] + new_data['upcoming_shows']})
+  return new_data
+
+
+def _artist(artist_id):
+  artist = Artist.query.filter_by(id=artist_id).first_or_404()
+  return {
+    'id': artist.id,
+    'name': artist.name,
+    'genres': artist.genres,
+    'city': artist.city,
+    'state': artist.state,
+    'phone': artist.phone,
+    'website': artist.website,
+    'facebook_link': artist.facebook_link,
+    'image_link': artist.image_link,
+    'seeking_venue': artist.seeking_venue,
+    'seeking_description': artist.seeking_description
+  }
+
+
+def search_data(model, search_term, page=1):
+  # Lookup by name, city, state or genre and return a page of matches
+  page = max(page, 1)
+  count, rows = search(model, search_term, page)
+  num_upcoming_shows = upcoming_show_counts(model, [row.id for row in rows])
+  return {
+    'count': count,
+    'page': page,
+    'per_page': app.config['SEARCH_RESULTS_PER_PAGE'],
+    'data': [
+      {'id': row.id, 'name': row.name, 'num_upcoming_shows': num_upcoming_shows[row.id]}
+      for row in rows
+    ]
+  }
+
+
+def shows_data(**filters):
+  # A generator, so callers can stream the page
+  rows = show_listing(limit=app.config['SHOWS_PER_PAGE'], **filters)
+  return (row._asdict() for row in rows)
+
+
+def free_slots_data(venue_id, start, end, duration):
+  # Gaps between the venue's shows long enough for a show of `duration` minutes
+  Venue.query.filter_by(id=venue_id).with_entities(Venue.id).first_or_404()
+  return {
+    'venue_id': venue_id,
+    'start': start,
+    'end': end,
+    'duration': duration,
+    'data': [{'start': slot_start, 'end': slot_end} for slot_start, slot_end in free_slots(venue_id, start, end, duration)]
+  }
+
+
+def discover_data(kind, filters, page=1, after=None):
+  # Venues and artists page by offset, upcoming shows by (start_time, id)
+  per_page = app.config['DISCOVERY_RESULTS_PER_PAGE']
+  if kind == 'shows':
+    (count, facets), data = gather(
+      lambda: show_facets(filters), lambda: [row._asdict() for row in discover_shows(filters, after)]
+    )
+  else:
+    model = Venue if kind == 'venues' else Artist
+    count, rows, facets = discover_owners(model, filters, page)
+    num_upcoming_shows = upcoming_show_counts(model, [row.id for row in rows])
+    data = [{
+      'id': row.id,
+      'name': row.name,
+      'city': row.city,
+      'state': row.state,
+      'genres': row.genres,
+      'num_upcoming_shows': num_upcoming_shows[row.id]
+    } for row in rows]
+  return {
+    'kind': kind,
+    'filters': filters,
+    'count': count,
+    'page': page,
+    'per_page': per_page,
+    'data': data,
+    'facets': facets
+  }
+
+
+def matches_data(model, id, limit=10, seeking=False):
+  # Best venues for an artist (model Artist), or artists for a venue
+  matches = match_index().matches(model, id, limit, seeking)
+  if matches is None:
+    abort(404)
+  other = Venue if model is Artist else Artist
+  rows = db.session.query(other.id, other.name, other.city, other.state, other.genres).\
+    filter(other.id.in_([candidate for candidate, _, _ in matches]))
+  rows = {row.id: row for row in rows}
+  return {
+    'id': id,
+    'data': [{
+      'id': candidate,
+      'name': rows[candidate].name,
+      'city': rows[candidate].city,
+      'state': rows[candidate].state,
+      'genres': rows[candidate].genres,
+      'score': round(score, 4),
+      'signals': {signal: round(value, 4) for signal, value in signals.items()}
+    } for candidate, score, signals in matches if candidate in rows]
+  }
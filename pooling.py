@@ -0,0 +1,153 @@
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import SelectBase
+from sqlalchemy import event, orm
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Connection pool.
+#----------------------------------------------------------------------------#
+
+class PoolStats:
+  """Checkout counts and wait times of one process's connection pool."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.checkouts = 0
+    self.timeouts = 0
+    self.connects = 0
+    self.invalidations = 0
+    self.wait_total = 0.0
+    self.wait_max = 0.0
+
+  def reset(self):
+    self.__init__()
+
+  def record_wait(self, seconds, timed_out=False):
+    with self.lock:
+      if timed_out:
+        self.timeouts += 1
+      else:
+        self.checkouts += 1
+      self.wait_total += seconds
+      self.wait_max = max(self.wait_max, seconds)
+
+  def snapshot(self, pool=None):
+    with self.lock:
+      stats = {
+        'checkouts': self.checkouts,
+        'timeouts': self.timeouts,
+        'connects': self.connects,
+        'invalidations': self.invalidations,
+        'wait_seconds_total': round(self.wait_total, 6),
+        'wait_seconds_max': round(self.wait_max, 6)
+      }
+    if isinstance(pool, QueuePool):
+      stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return stats
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+  """QueuePool that records how long each checkout waited for a connection."""
+
+  def _do_get(self):
+    start = time.perf_counter()
+    try:
+      connection = super()._do_get()
+    except Exception:
+      pool_stats.record_wait(time.perf_counter() - start, timed_out=True)
+      raise
+    pool_stats.record_wait(time.perf_counter() - start)
+    return connection
+
+
+def postgres_engine_options(config):
+  """create_engine() options for Postgres built from the DB_* config keys."""
+  options = {
+    'poolclass': TimedQueuePool,
+    'pool_size': config['DB_POOL_SIZE'],
+    'max_overflow': config['DB_MAX_OVERFLOW'],
+    'pool_timeout': config['DB_POOL_TIMEOUT'],
+    'pool_recycle': config['DB_POOL_RECYCLE'],
+    'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    'executemany_mode': 'values'
+  }
+  if not config['DB_PGBOUNCER'] and config['DB_STATEMENT_TIMEOUT']:
+    # PgBouncer rejects the `options` startup parameter; see FyyurSQLAlchemy
+    options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"}
+  return options
+
+
+class RoutingSession(SignallingSession):
+  """Session reading from the replica bind named by info['replica'], if any.
+
+  Flushes, bulk updates and deletes, locking reads and textual statements
+  go to the primary, and so does every statement once the session has
+  written. info['wrote'] records a write until the transaction ends.
+  """
+
+  def get_bind(self, mapper=None, clause=None):
+    if self._flushing or isinstance(clause, UpdateBase):
+      self.info['wrote'] = True
+    replica = self.info.get('replica')
+    if replica is not None and not self.info.get('wrote') and \
+        isinstance(clause, SelectBase) and getattr(clause, '_for_update_arg', None) is None:
+      return get_state(self.app).db.get_engine(self.app, bind=replica)
+    return super().get_bind(mapper, clause)
+
+
+class FyyurSQLAlchemy(SQLAlchemy):
+  """SQLAlchemy with pool settings from config, pool instrumentation and
+  replica routing (RoutingSession).
+
+  Explicit SQLALCHEMY_ENGINE_OPTIONS still take priority over these.
+  """
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+  def apply_driver_hacks(self, app, sa_url, options):
+    rv = super().apply_driver_hacks(app, sa_url, options)
+    if sa_url.drivername.startswith('postgres'):
+      options.update(postgres_engine_options(app.config))
+    return rv
+
+  def create_engine(self, sa_url, engine_opts):
+    engine = super().create_engine(sa_url, engine_opts)
+
+    @event.listens_for(engine, 'connect')
+    def count_connect(dbapi_connection, connection_record):
+      with pool_stats.lock:
+        pool_stats.connects += 1
+
+    @event.listens_for(engine, 'invalidate')
+    def count_invalidate(dbapi_connection, connection_record, exception):
+      with pool_stats.lock:
+        pool_stats.invalidations += 1
+
+    return engine
+
+
+_inherited_pools = []
+
+
+def reset_pools(app):
+  """In a forked child: give the engines of `app` new, empty pools.
+
+  The parent's pooled connections share their sockets with the parent,
+  so the child must never close them: Engine.dispose(), or the driver
+  when the connection is garbage collected, would end the parent's
+  session. The old pools are kept, unused, for the life of the process.
+  """
+  pool_stats.reset()
+  state = app.extensions.get('sqlalchemy')
+  for connector in (state.connectors.values() if state is not None else ()):
+    engine = connector._engine
+    if engine is not None:
+      _inherited_pools.append(engine.pool)
+      engine.pool = engine.pool.recreate()
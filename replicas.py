@@ -0,0 +1,142 @@
+from fyyur_01.app import app, db
+from flask import request, session, has_request_context
+import itertools
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#----------------------------------------------------------------------------#
+
+# With SQLALCHEMY_REPLICA_URIS set, GET requests and the views marked
+# @replica_reads (searches) read from the replicas, in turn; everything
+# else, and every write, uses the primary (SQLALCHEMY_DATABASE_URI). Each
+# replica is a Flask-SQLAlchemy bind ('replica0', ...) and RoutingSession
+# picks it per statement.
+#
+# Read your writes: a request that commits a write pins its client, by a
+# timestamp in the session cookie, to the primary for REPLICA_PIN_SECONDS,
+# so the page it is redirected to shows the change.
+#
+# Every REPLICA_CHECK_INTERVAL seconds one request thread per process
+# measures each replica's replay lag; replicas further behind than
+# REPLICA_MAX_LAG seconds, or unreachable, are left out until they catch up.
+
+REPLICA_BINDS = [f'replica{number}' for number in range(len(app.config['SQLALCHEMY_REPLICA_URIS']))]
+app.config['SQLALCHEMY_BINDS'] = dict(
+  app.config['SQLALCHEMY_BINDS'] or {}, **dict(zip(REPLICA_BINDS, app.config['SQLALCHEMY_REPLICA_URIS']))
+)
+
+# Seconds behind the primary: 0 when caught up (or not a standby), None
+# when unknown (no transaction replayed yet)
+LAG_SQL = (
+  "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+  "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def replica_lag(bind):
+  """Seconds `bind` lags behind the primary, or None if it can't be told."""
+  engine = db.get_engine(app, bind=bind)
+  try:
+    with engine.connect() as connection:
+      if engine.dialect.name != 'postgresql':
+        connection.execute('SELECT 1')
+        return 0.0
+      lag = connection.execute(LAG_SQL).scalar()
+  except Exception as e:
+    app.logger.warning('replica %s unreachable: %s', bind, e)
+    return None
+  return None if lag is None else float(lag)
+
+
+class ReplicaSet:
+  """This process's replicas and their last measured lag."""
+
+  def __init__(self, binds):
+    self.binds = binds
+    self.lag = dict.fromkeys(binds, 0.0)
+    self.checked_at = None
+    self.lock = threading.Lock()
+    self.turns = itertools.count()
+
+  def refresh(self):
+    """Measure the lag of every replica, unless it was measured less than
+    REPLICA_CHECK_INTERVAL seconds ago or another thread is at it."""
+    now = time.monotonic()
+    if self.checked_at is not None and now - self.checked_at < app.config['REPLICA_CHECK_INTERVAL']:
+      return
+    if not self.lock.acquire(blocking=False):
+      return
+    try:
+      self.checked_at = now
+      for bind in self.binds:
+        self.lag[bind] = replica_lag(bind)
+    finally:
+      self.lock.release()
+
+  def available(self):
+    limit = app.config['REPLICA_MAX_LAG']
+    return [bind for bind in self.binds if self.lag[bind] is not None and self.lag[bind] <= limit]
+
+  def choose(self):
+    """The next replica in rotation, or None to read from the primary."""
+    self.refresh()
+    available = self.available()
+    return available[next(self.turns) % len(available)] if available else None
+
+  def stats(self):
+    return {
+      'available': self.available(),
+      'lag_seconds': dict(self.lag),
+      'checked_seconds_ago': None if self.checked_at is None else round(time.monotonic() - self.checked_at, 3)
+    }
+
+
+replica_set = ReplicaSet(REPLICA_BINDS)
+
+
+def replica_reads(view):
+  """Let a view that doesn't write read from a replica whatever its method,
+  e.g. a search form's POST."""
+  view.replica_reads = True
+  return view
+
+
+def pinned_to_primary():
+  """Whether this client wrote recently enough to need the primary."""
+  return session.get('primary_until', 0) > time.time()
+
+
+def reading_from():
+  """The replica bind the current session reads from, or None."""
+  return db.session.info.get('replica')
+
+
+def read_from(bind):
+  """Send the current session's reads to replica `bind` (None: primary)."""
+  db.session.info['replica'] = bind
+
+
+@app.before_request
+def _route_reads():
+  if not replica_set.binds:
+    return
+  view = app.view_functions.get(request.endpoint)
+  if request.method not in ('GET', 'HEAD') and not getattr(view, 'replica_reads', False):
+    return
+  if not pinned_to_primary():
+    read_from(replica_set.choose())
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _pin_writer(db_session):
+  # Not for bookkeeping writes of GET requests, e.g. queued jobs
+  if db_session.info.pop('wrote', False) and replica_set.binds and has_request_context() and \
+      request.method not in ('GET', 'HEAD'):
+    session['primary_until'] = time.time() + app.config['REPLICA_PIN_SECONDS']
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _forget_writes(db_session):
+  db_session.info.pop('wrote', None)
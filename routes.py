@@ -1,26 +1,51 @@
 from fyyur_01.app import app, db
 from fyyur_01.models import Venue, Show, Artist
 from datetime import datetime
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, stream_with_context, jsonify, abort
 from flask_wtf import Form
 from fyyur_01.forms import ShowForm, VenueForm, ArtistForm
-import babel
+from fyyur_01.cache import cached_page, page_cache
+from fyyur_01.pooling import pool_stats
+from fyyur_01.replicas import replica_set, replica_reads
+from fyyur_01.instrumentation import metrics
+from fyyur_01.jobs import Job, job_stats
+from fyyur_01.deletion import Deletion, soft_delete, undelete
+from fyyur_01.formatting import format_datetime, format_datetimes
+from fyyur_01.bulk import KINDS, FORMATS, read_records, import_records, export_records
+from fyyur_01.scheduling import ScheduleError, check_show, show_end
+from fyyur_01.payloads import (
+  timeline_args, show_listing_args, discovery_args, venues_data, venue_data, artists_data, artist_data, search_data,
+  shows_data, discover_data
+)
+from fyyur_01.enums import Genre, State
+import io
+import sys
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(dt, format='medium'):
-  #date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(dt, format)
-
 app.jinja_env.filters['datetime'] = format_datetime
 
 
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def stream_template(template_name, **context):
+  # Render a template as a generator so the response streams while it renders
+  app.update_template_context(context)
+  return app.jinja_env.get_template(template_name).generate(context)
+
+
+def format_timeline(new_data):
+  # Format all show times of a venue/artist page in one batch
+  shows = new_data['past_shows'] + new_data['upcoming_shows']
+  for show, start_time in zip(shows, format_datetimes([show['start_time'] for show in shows], 'full')):
+    show['start_time_display'] = start_time
+  return new_data
+
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -33,83 +58,27 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 @app.route('/venues')
+@cached_page('venues', 'shows')
 def venues():
 
-  # Get list of distinct cities/states to group venues by
-  places = Venue.query.distinct(Venue.city, Venue.state).all()
-  venues = Venue.query.all()
-
-  new_data = [] 
-  for place in places:
-    new_data.append({
-      'city': place.city,
-      'state': place.state,
-      'venues': [{
-        'id': venue.id,
-        'name': venue.name
-      } for venue in venues if venue.city == place.city and venue.state == place.state]
-    })
-  
-  return render_template('pages/venues.html', areas=new_data)
+  page = request.args.get('page', type=int)
+  return render_template('pages/venues.html', areas=venues_data(page), page=page)
 
 
 @app.route('/venues/search', methods=['POST'])
+@replica_reads
 def search_venues():
 
-  # Lookup venues by name and return any matching records
   search_term = request.form.get('search_term', '')
-  venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-  new_response = {
-    'count': len(venues),
-    'data': [
-      {'id': venue.id, 'name': venue.name, 'num_upcoming_shows': venue.num_upcoming_shows}
-      for venue in venues
-    ]
-  }
-
+  new_response = search_data(Venue, search_term, request.form.get('page', 1, type=int))
   return render_template('pages/search_venues.html', results=new_response, search_term=search_term)
 
 
 @app.route('/venues/<int:venue_id>')
+@cached_page('venue:{venue_id}')
 def show_venue(venue_id):
 
-  # venue = Venue.query.get(venue_id)
-  venue = Venue.query.filter_by(id=venue_id).first_or_404()
-  new_data = {
-    'id': venue.id,
-    'name': venue.name,
-    'genres': venue.genres,
-    'address': venue.address,
-    'city': venue.city,
-    'state': venue.state,
-    'phone': venue.phone,
-    'website': venue.website,
-    'facebook_link': venue.facebook_link,
-    'image_link': venue.image_link,
-    'seeking_talent': venue.seeking_talent,
-    'seeking_description': venue.seeking_description
-  }
-
-  # past_shows = Show.query.filter(Show.venue_id == venue_id).filter(Show.startTime < datetime.now()).all()
-  past_shows = db.session.query(Show).join(Venue).filter(Venue.id == venue_id).filter(Show.start_time < datetime.now()).all()
-  new_data['past_shows'] = [{
-    'artist_id': show.artists.id,
-    'artist_name': show.artists.name,
-    'artist_image_link': show.artists.image_link,
-    'start_time': show.start_time
-  } for show in past_shows]
-  new_data['past_shows_count'] = len(past_shows)
-
-  # upcoming_shows = Show.query.filter(Show.venue_id == venue.id).filter(Show.startTime > datetime.now()).all()
-  upcoming_shows = db.session.query(Show).join(Venue).filter(Venue.id == venue_id).filter(Show.start_time > datetime.now()).all()
-  new_data['upcoming_shows'] = [{
-    'artist_id': show.artists.id,
-    'artist_name': show.artists.name,
-    'artist_image_link': show.artists.image_link,
-    'start_time': show.start_time
-  } for show in upcoming_shows]
-  new_data['upcoming_shows_count'] = len(upcoming_shows)
-
+  new_data = format_timeline(venue_data(venue_id, **timeline_args(request.args)))
   return render_template('pages/show_venue.html', venue=new_data)
 
 
@@ -133,9 +102,7 @@ def create_venue_submission():
       flash('Venue ' + request.form['name'] + ' was successfully listed!')
     except:
       db.session.rollback()
-      flash(f'Failed to list venue {request.form["venue"]}!')
-    finally:
-      db.session.close()
+      flash(f'Failed to list venue {request.form["name"]}!')
   else:
     msg = []
     for field, err in form.errors.items():
@@ -145,26 +112,31 @@ def create_venue_submission():
   return render_template('pages/home.html')
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
-def delete_venue(venue_id):
+def delete_owner(owner_type, owner_id):
+  # The venue or artist disappears now, its shows in the background
   try:
-    Venue.query.filter(Venue.id==venue_id).delete()
+    deletion = soft_delete(owner_type, owner_id)
     db.session.commit()
-    flash(f'Venue {venue_id} deleted!')
-  except:
+  except Exception:
+    app.logger.exception('deleting %s %s failed', owner_type, owner_id)
     db.session.rollback()
-    print(sys.exc_info())
-    flash(f'Failed to delete venue {venue_id}')
-  finally:
-    db.session.close()
+    flash(f'Failed to delete {owner_type} {owner_id}')
+    return jsonify({'error': f'failed to delete {owner_type} {owner_id}'}), 500
+  if deletion is None:
+    abort(404)
+  flash(f'{owner_type.capitalize()} {owner_id} deleted!')
+  return jsonify(deletion.to_dict()), 202
 
-  return 'OK'
+
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
+def delete_venue(venue_id):
+  return delete_owner('venue', venue_id)
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   
-  venue = Venue.query.first_or_404(venue_id)
+  venue = Venue.query.filter_by(id=venue_id).first_or_404()
   form = VenueForm(obj=venue, meta={'csrf': False})
   return render_template('forms/edit_venue.html', form=form, venue_id=venue_id, venue_name=venue.name)
 
@@ -172,7 +144,7 @@ def edit_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
 
-  venue = Venue.query.first_or_404(venue_id)
+  venue = Venue.query.filter_by(id=venue_id).first_or_404()
   form = VenueForm(request.form, meta={'csrf': False})
   if form.validate():
     try:
@@ -183,8 +155,6 @@ def edit_venue_submission(venue_id):
       db.session.rollback()
       print(sys.exc_info())
       flash(f'Failed to updated venue {venue_id}')
-    finally:
-      db.session.close()
   else:
     msg = []
     for field, err in form.errors.items():
@@ -197,86 +167,43 @@ def edit_venue_submission(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@cached_page('artists')
 def artists():
 
-  artists = Artist.query.all()
-  new_data = [
-    {'id': artist.id, 'name': artist.name}
-    for artist in artists
-  ]
-  return render_template('pages/artists.html', artists=new_data)
+  return render_template('pages/artists.html', artists=artists_data())
 
 
 @app.route('/artists/search', methods=['POST'])
+@replica_reads
 def search_artists():
 
   search_term = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
-  new_response = {
-    'count': len(artists),
-    'data': [
-      {'id': artist.id, 'name': artist.name, 'num_upcoming_shows': artist.num_upcoming_shows}
-      for artist in artists
-    ]
-  }
+  new_response = search_data(Artist, search_term, request.form.get('page', 1, type=int))
   return render_template('pages/search_artists.html', results=new_response, search_term=search_term)
 
 
 @app.route('/artists/<int:artist_id>')
+@cached_page('artist:{artist_id}')
 def show_artist(artist_id):
 
-  artist = Artist.query.get(artist_id)
-  new_data = {
-    'id': artist.id,
-    'name': artist.name,
-    'genres': artist.genres,
-    'city': artist.city,
-    'state': artist.state,
-    'phone': artist.phone,
-    'website': artist.website,
-    'facebook_link': artist.facebook_link,
-    'image_link': artist.image_link,
-    'seeking_venue': artist.seeking_venue,
-    'seeking_description': artist.seeking_description
-  }
-
-  # past_shows = Show.query.filter(Show.artist_id == artist_id).filter(Show.startTime < datetime.now()).all()
-  past_shows = db.session.query(Show).join(Artist).filter(Artist.id == artist_id).filter(Show.start_time < datetime.now()).all()
-  new_data['past_shows'] = [{
-    'venue_id': show.venue_id,
-    'venue_name': show.venues.name,
-    'venue_image_link': show.venues.image_link,
-    'start_time': show.start_time
-  } for show in past_shows]
-  new_data['past_shows_count'] = len(past_shows)
-
-  # upcoming_shows = Show.query.filter(Show.artist_id == artist_id).filter(Show.startTime > datetime.now()).all()
-  upcoming_shows = db.session.query(Show).join(Artist).filter(Artist.id == artist_id).filter(Show.start_time > datetime.now()).all()
-  new_data['upcoming_shows'] = [{
-    'venue_id': show.venues.id,
-    'venue_name': show.venues.name,
-    'venue_image_link': show.venues.image_link,
-    'start_time': show.start_time
-  } for show in upcoming_shows]
-  new_data['upcoming_shows_count'] = len(upcoming_shows)
-
+  new_data = format_timeline(artist_data(artist_id, **timeline_args(request.args)))
   return render_template('pages/show_artist.html', artist=new_data)
 
 
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
 
-  artist = Artist.query.first_or_404(artist_id)
-  form = ArtistForm(artist, meta={'csrf': False})
+  artist = Artist.query.filter_by(id=artist_id).first_or_404()
+  form = ArtistForm(obj=artist, meta={'csrf': False})
   return render_template('forms/edit_artist.html', form=form, artist_id=artist_id, artist_name=artist.name)
 
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
 
-  artist = Artist.query.first_or_404(artist_id)
+  artist = Artist.query.filter_by(id=artist_id).first_or_404()
   form = ArtistForm(request.form, meta={'csrf': False})
-  if form.validat():
+  if form.validate():
     try:
       form.populate_obj(artist)
       db.session.commit()
@@ -285,8 +212,6 @@ def edit_artist_submission(artist_id):
       db.session.rollback()
       print(sys.exc_info())
       flash(f'Failed to update artist {artist_id}')
-    finally:
-      db.session.close()
   else:
     msg = []
     for field, err in form.errors.items():
@@ -296,20 +221,9 @@ def edit_artist_submission(artist_id):
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 
-@app.route('/artists/<artist_id>', methods=['DELETE'])
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
 def delete_artist(artist_id):
-  try:
-    Artist.query.filter(Artist.id==artist_id).delete()
-    db.session.commit()
-    flash(f'Artist {artist_id} deleted!')
-  except:
-    db.session.rollback()
-    print(sys.exc_info())
-    flash(f'Failed to delete artist {artist_id}')
-  finally:
-    db.session.close()
-
-  return 'OK'
+  return delete_owner('artist', artist_id)
 
 
 @app.route('/artists/create', methods=['GET'])
@@ -331,11 +245,9 @@ def create_artist_submission():
       # on successful db insert, flash success
       flash('Artist ' + request.form['name'] + ' was successfully listed!')
     except:
-      print(e)
       db.session.rollback()
+      print(sys.exc_info())
       flash(f'Failed to list artist {request.form["name"]}!')
-    finally:
-      db.session.close()
   else:
     msg = []
     for field, err in form.errors.items():
@@ -348,20 +260,19 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 @app.route('/shows')
+@cached_page('shows', 'venues', 'artists')
 def shows():
 
-  all_shows = Show.query.all()
-  new_data = [{
-    'venue_id': show.venue_id,
-    'venue_name': show.venues.name,
-    'artist_id': show.artist_id,
-    'artist_name': show.artists.name,
-    'artist_image_link': show.artists.image_link,
-    'start_time': show.start_time
+  # Filters are kept in the pagination links; ?stream=1 streams the page
+  context = {
+    'shows': shows_data(**show_listing_args(request.args)),
+    'per_page': app.config['SHOWS_PER_PAGE'],
+    'filters': {key: value for key, value in request.args.items() if key not in ('after_time', 'after_id')}
   }
-  for show in all_shows]    
-
-  return render_template('pages/shows.html', shows=new_data)
+  if request.args.get('stream', app.config['SHOWS_STREAMING'], type=int):
+    return Response(stream_with_context(stream_template('pages/shows.html', **context)))
+  context['shows'] = list(context['shows'])
+  return render_template('pages/shows.html', **context)
 
 
 @app.route('/shows/create')
@@ -377,17 +288,19 @@ def create_show_submission():
   form = ShowForm(request.form, meta={'csrf': False})
   if form.validate():
     try:
-      show = Show()
-      form.populate_obj(show)
+      show = Show(artist_id=int(form.artist_id.data), venue_id=int(form.venue_id.data), start_time=form.start_time.data)
+      show.end_time = show_end(show.start_time, form.duration.data)
+      check_show(show)
       db.session.add(show)
       db.session.commit()
       # on successful db insert, flash success
       flash('Show was successfully listed!')
+    except ScheduleError as e:
+      db.session.rollback()
+      flash(f'Could not list Show: {e}')
     except:
       db.session.rollback()
       flash('Failed to list Show!')
-    finally:
-      db.session.close()
   else:
     msg = []
     for field, err in form.errors.items():
@@ -397,6 +310,112 @@ def create_show_submission():
   return render_template('pages/home.html')
 
 
+#  Discovery
+#  ----------------------------------------------------------------
+@app.route('/discover/<any(venues, artists, shows):kind>')
+@cached_page('venues', 'artists', 'shows')
+def discover(kind):
+
+  args = discovery_args(request.args)
+  return render_template(
+    'pages/discover.html', results=discover_data(kind, **args),
+    genres=[genre.value for genre in Genre], states=[state.value for state in State]
+  )
+
+
+#  Bulk import/export
+#  ----------------------------------------------------------------
+@app.route('/import/<kind>', methods=['POST'])
+def import_upload(kind):
+
+  upload = request.files.get('file')
+  if kind not in KINDS or upload is None:
+    return jsonify({'error': 'expected venues, artists or shows and a file upload'}), 400
+  fmt = request.form.get('format') or ('ndjson' if upload.filename.endswith(('.ndjson', '.jsonl')) else 'csv')
+  if fmt not in FORMATS:
+    return jsonify({'error': f'unknown format {fmt}'}), 400
+
+  # Only the first errors are kept so the report stays small
+  errors = []
+  def on_error(number, message):
+    if len(errors) < app.config['BULK_MAX_REPORTED_ERRORS']:
+      errors.append({'record': number, 'error': message})
+
+  lines = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+  stats = import_records(kind, read_records(lines, fmt), request.form.get('chunk_size', type=int), on_error=on_error)
+  return jsonify(dict(stats, errors=errors))
+
+
+@app.route('/export/<kind>.<fmt>')
+def export_download(kind, fmt):
+  if kind not in KINDS or fmt not in FORMATS:
+    return render_template('errors/404.html'), 404
+  mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+  return Response(
+    stream_with_context(export_records(kind, fmt)),
+    mimetype=mimetype,
+    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'}
+  )
+
+
+#  Monitoring
+#  ----------------------------------------------------------------
+def diagnostic_route(rule):
+  # app.route(rule) with DIAGNOSTIC_ROUTES, else the view isn't served
+  if app.config['DIAGNOSTIC_ROUTES']:
+    return app.route(rule)
+  return lambda view: view
+
+
+@diagnostic_route('/cache/stats')
+def cache_stats():
+  return jsonify(page_cache.stats() if page_cache is not None else {})
+
+
+@diagnostic_route('/db/pool')
+def db_pool_stats():
+  stats = pool_stats.snapshot(db.engine.pool)
+  if replica_set.binds:
+    stats['replicas'] = replica_set.stats()
+  return jsonify(stats)
+
+
+@diagnostic_route('/jobs')
+def jobs_stats():
+  return jsonify(job_stats())
+
+
+@diagnostic_route('/jobs/<int:job_id>')
+def job_status(job_id):
+  return jsonify(Job.query.get_or_404(job_id).to_dict())
+
+
+@app.route('/deletions/<int:deletion_id>')
+def deletion_status(deletion_id):
+  return jsonify(Deletion.query.get_or_404(deletion_id).to_dict())
+
+
+@app.route('/deletions/<int:deletion_id>/undo', methods=['POST'])
+def undo_deletion(deletion_id):
+  deletion = Deletion.query.get_or_404(deletion_id)
+  if not undelete(deletion):
+    db.session.rollback()
+    return jsonify({'error': f'deletion {deletion_id} is {deletion.status}, it can no longer be undone'}), 409
+  db.session.commit()
+  return jsonify(deletion.to_dict())
+
+
+@diagnostic_route('/metrics')
+def metrics_text():
+  extra = []
+  for name, value in pool_stats.snapshot(db.engine.pool).items():
+    if name in ('checkouts', 'timeouts', 'connects', 'invalidations'):
+      extra.append((f'fyyur_db_pool_{name}_total', 'counter', value))
+    else:
+      extra.append((f'fyyur_db_pool_{name}', 'counter' if name.endswith('_total') else 'gauge', value))
+  return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+
 #  Error handlers
 #  ----------------------------------------------------------------
 @app.errorhandler(404)
@@ -0,0 +1,180 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, deleted_ids
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timedelta
+
+#----------------------------------------------------------------------------#
+# Scheduling.
+#----------------------------------------------------------------------------#
+
+# A venue hosts, and an artist plays, one show at a time: a new show may
+# not overlap [start_time, end_time) of another show at its venue or by
+# its artist. No show lasts longer than SHOW_MAX_DURATION, so the shows
+# overlapping [start, end) are those starting in (start - max duration,
+# end) and ending after start: a range scan of the (venue_id, start_time)
+# and (artist_id, start_time) indexes, in the database as in IntervalIndex.
+#
+# Checks and inserts run under a transaction-level advisory lock per venue
+# and artist on Postgres, so two requests can't book the same slot.
+
+class ScheduleError(Exception):
+  """A show that can't be listed; the message says why."""
+  pass
+
+
+def max_duration():
+  return timedelta(minutes=app.config['SHOW_MAX_DURATION'])
+
+
+def show_end(start_time, duration=None):
+  """End of a show starting at `start_time` lasting `duration` minutes."""
+  return start_time + timedelta(minutes=duration or app.config['SHOW_DEFAULT_DURATION'])
+
+
+def describe(show):
+  # e.g. "show 12, 2021-05-01 20:00-22:00"
+  return f"show {show.id}, {show.start_time.strftime('%Y-%m-%d %H:%M')}-{show.end_time.strftime('%H:%M')}"
+
+
+#  Database checks
+#  ----------------------------------------------------------------
+
+def lock_schedules(venue_ids=(), artist_ids=()):
+  """Hold the schedules of these venues and artists until the transaction ends."""
+  if db.engine.dialect.name != 'postgresql':
+    return
+  # Always in the same order, so concurrent lockers can't deadlock
+  keys = sorted([f'venue:{id}' for id in set(venue_ids)] + [f'artist:{id}' for id in set(artist_ids)])
+  for key in keys:
+    db.session.execute(db.select([db.func.pg_advisory_xact_lock(db.func.hashtext(key))]))
+
+
+def overlapping(start, end, venue_id=None, artist_id=None, exclude_id=None):
+  """Query of the shows at `venue_id` or by `artist_id` overlapping [start, end)."""
+  owners = []
+  if venue_id is not None:
+    owners.append(Show.venue_id == venue_id)
+  if artist_id is not None:
+    owners.append(Show.artist_id == artist_id)
+  query = Show.query.filter(
+    db.or_(*owners), Show.start_time > start - max_duration(), Show.start_time < end, Show.end_time > start,
+    # Not the shows of deleted venues and artists waiting to be purged
+    Show.venue_id.notin_(deleted_ids(Venue)), Show.artist_id.notin_(deleted_ids(Artist))
+  )
+  if exclude_id is not None:
+    query = query.filter(Show.id != exclude_id)
+  return query.order_by(Show.start_time, Show.id)
+
+
+def check_show(show):
+  """Raise ScheduleError unless `show` can be listed.
+
+  Locks the venue's and artist's schedules first; insert the show in the
+  same transaction.
+  """
+  if show.end_time - show.start_time > max_duration():
+    raise ScheduleError(f"shows can't last longer than {app.config['SHOW_MAX_DURATION']} minutes")
+  if show.end_time <= show.start_time:
+    raise ScheduleError('a show must end after it starts')
+  for model, id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+    if not db.session.query(db.exists().where(model.id == id).where(model.deleted_at.is_(None))).scalar():
+      raise ScheduleError(f'no {model.__name__.lower()} with id {id}')
+  lock_schedules([show.venue_id], [show.artist_id])
+  conflicts = overlapping(show.start_time, show.end_time, show.venue_id, show.artist_id, show.id).limit(3).all()
+  if conflicts:
+    raise ScheduleError('; '.join(
+      f"{'the venue' if conflict.venue_id == show.venue_id else 'the artist'} is already booked: {describe(conflict)}"
+      for conflict in conflicts
+    ))
+
+
+def free_slots(venue_id, start, end, duration=None):
+  """[(from, to), ...] gaps of at least `duration` minutes at `venue_id`
+  between `start` and `end`."""
+  length = timedelta(minutes=duration or app.config['SHOW_DEFAULT_DURATION'])
+  slots = []
+  cursor = start
+  for show_start, show_end in overlapping(start, end, venue_id=venue_id).with_entities(Show.start_time, Show.end_time):
+    if show_start - cursor >= length:
+      slots.append((cursor, show_start))
+    cursor = max(cursor, show_end)
+  if end - cursor >= length:
+    slots.append((cursor, end))
+  return slots
+
+
+#  Bulk checks
+#  ----------------------------------------------------------------
+
+class IntervalIndex:
+  """Shows by venue and by artist, sorted by start time.
+
+  An overlap lookup bisects to the last show starting before the end and
+  walks back over the shows starting within SHOW_MAX_DURATION before the
+  start.
+  """
+
+  def __init__(self, max_duration):
+    self.max_duration = max_duration
+    # ('venue_id' or 'artist_id', id) -> [(start, end, label), ...]
+    self.intervals = defaultdict(list)
+
+  def add(self, key, start, end, label):
+    insort(self.intervals[key], (start, end, label))
+
+  def overlaps(self, key, start, end):
+    """Labels of the intervals under `key` overlapping [start, end)."""
+    intervals = self.intervals.get(key, ())
+    found = []
+    i = bisect_left(intervals, (end,)) - 1
+    while i >= 0 and intervals[i][0] > start - self.max_duration:
+      if intervals[i][1] > start:
+        found.append(intervals[i][2])
+      i -= 1
+    return found
+
+
+def check_schedule(rows):
+  """Check (record number, show row) pairs, as bulk imports read them,
+  against each other and the database.
+
+  Rows are taken in order: a row overlapping a show, or an earlier row,
+  fails. Returns {record number: message}. Locks the schedules involved;
+  insert the rows in the same transaction.
+  """
+  errors = {}
+  if not rows:
+    return errors
+  limit = max_duration()
+  index = IntervalIndex(limit)
+  venue_ids = {row['venue_id'] for _, row in rows}
+  artist_ids = {row['artist_id'] for _, row in rows}
+  lock_schedules(venue_ids, artist_ids)
+  start = min(row['start_time'] for _, row in rows) - limit
+  end = max(row['end_time'] for _, row in rows)
+  for key, column, ids in (('venue_id', Show.venue_id, venue_ids), ('artist_id', Show.artist_id, artist_ids)):
+    shows = db.session.query(Show.id, column, Show.start_time, Show.end_time).filter(
+      column.in_(ids), Show.start_time > start, Show.start_time < end,
+      # As in overlapping()
+      Show.venue_id.notin_(deleted_ids(Venue)), Show.artist_id.notin_(deleted_ids(Artist))
+    )
+    for show in shows:
+      index.add((key, show[1]), show.start_time, show.end_time, describe(show))
+
+  for number, row in rows:
+    if row['end_time'] - row['start_time'] > limit:
+      errors[number] = f"shows can't last longer than {app.config['SHOW_MAX_DURATION']} minutes"
+      continue
+    conflicts = [
+      f'{booked} is already booked: {label}'
+      for key, booked in (('venue_id', 'the venue'), ('artist_id', 'the artist'))
+      for label in index.overlaps((key, row[key]), row['start_time'], row['end_time'])
+    ]
+    if conflicts:
+      errors[number] = '; '.join(conflicts)
+      continue
+    label = f"record {number}, {row['start_time'].strftime('%Y-%m-%d %H:%M')}-{row['end_time'].strftime('%H:%M')}"
+    for key in ('venue_id', 'artist_id'):
+      index.add((key, row[key]), row['start_time'], row['end_time'], label)
+  return errors
@@ -0,0 +1,36 @@
+from fyyur_01.app import app, db
+import re
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+def search(model, term, page=1, per_page=None):
+  """Ranked search over name, city, state and genres of venues or artists.
+
+  Returns `(count, rows)` where `count` is the number of matches and `rows`
+  the requested page of (id, name) rows. Matching is substring, prefix and
+  typo tolerant, answered from the pg_trgm expression indexes created by
+  the `search indexes` migration.
+  """
+  per_page = per_page or app.config['SEARCH_RESULTS_PER_PAGE']
+  term = ' '.join(term.lower().split())
+  document = db.func.fyyur_search_text(model.name, model.city, model.state, model.genres)
+  query = db.session.query(model.id, model.name, db.func.count().over().label('count'))
+  if term:
+    rank = db.func.word_similarity(term, document)
+    # `<%` is pg_trgm's word similarity operator; doubled for psycopg2's paramstyle
+    query = query.filter(db.or_(
+      db.literal(term).op('<%%')(document),
+      document.like(f'%{_escape_like(term)}%', escape='\\')
+    )).order_by(
+      model.name.ilike(f'{_escape_like(term)}%', escape='\\').desc(),
+      rank.desc()
+    )
+  rows = query.order_by(model.name, model.id).limit(per_page).offset((page - 1) * per_page).all()
+  count = rows[0].count if rows else 0
+  return count, rows
+
+
+def _escape_like(term):
+  return re.sub(r'([\\%_])', r'\\\1', term)
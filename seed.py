@@ -0,0 +1,172 @@
+from fyyur_01.app import app, db
+from fyyur_01.models import Venue, Artist, Show, ShowArchive, refresh_upcoming_counts
+from fyyur_01.discovery import refresh_show_facets
+from fyyur_01.partitions import roll_show_partitions
+from fyyur_01.enums import Genre
+from fyyur_01.cache import mark_changed
+from datetime import datetime, timedelta
+from itertools import accumulate
+import random
+
+#----------------------------------------------------------------------------#
+# Synthetic data.
+#----------------------------------------------------------------------------#
+
+# Rows generated per scale: (venues, artists, shows)
+SCALES = {
+  'small': (100, 300, 1000),
+  'medium': (2000, 6000, 100000),
+  'large': (10000, 30000, 1000000)
+}
+
+# Cities weighted roughly by the size of their live music scene
+CITIES = [
+  ('New York', 'NY', 30), ('Los Angeles', 'CA', 25), ('Chicago', 'IL', 14),
+  ('Nashville', 'TN', 12), ('Austin', 'TX', 12), ('San Francisco', 'CA', 10),
+  ('Seattle', 'WA', 8), ('Atlanta', 'GA', 8), ('New Orleans', 'LA', 7),
+  ('Boston', 'MA', 7), ('Philadelphia', 'PA', 6), ('Denver', 'CO', 5),
+  ('Portland', 'OR', 5), ('Minneapolis', 'MN', 4), ('Detroit', 'MI', 4),
+  ('Miami', 'FL', 4), ('Houston', 'TX', 4), ('Memphis', 'TN', 3),
+  ('Kansas City', 'MO', 2), ('Burlington', 'VT', 1)
+]
+
+ADJECTIVES = [
+  'Blue', 'Velvet', 'Electric', 'Golden', 'Midnight', 'Silver', 'Crimson', 'Wild',
+  'Lonesome', 'Neon', 'Hollow', 'Copper', 'Rusty', 'Gentle', 'Savage', 'Quiet'
+]
+NOUNS = [
+  'Room', 'Owl', 'Lantern', 'Harbor', 'Garden', 'Tiger', 'River', 'Fox',
+  'Anchor', 'Canyon', 'Engine', 'Orchard', 'Parlor', 'Saint', 'Crow', 'Moon'
+]
+VENUE_KINDS = ['Hall', 'Club', 'Tavern', 'Lounge', 'Theatre', 'Ballroom', 'Bar', 'Cellar']
+
+# Show times fall within this window around the seeding time
+PAST_DAYS = 730
+UPCOMING_DAYS = 365
+
+
+def _weights(count, skew):
+  # Zipf-like weights: the first item is the most common
+  return list(accumulate(1 / (rank + 1) ** skew for rank in range(count)))
+
+
+GENRES = [genre.value for genre in Genre]
+GENRE_WEIGHTS = _weights(len(GENRES), 0.8)
+CITY_WEIGHTS = list(accumulate(weight for _, _, weight in CITIES))
+
+
+def _genres(rng):
+  return sorted(set(rng.choices(GENRES, cum_weights=GENRE_WEIGHTS, k=rng.randint(1, 3))))
+
+
+def _phone(rng):
+  return f'{rng.randint(200, 999)}-{rng.randint(200, 999)}-{rng.randint(0, 9999):04}'
+
+
+def _slug(name):
+  return ''.join(c for c in name.lower() if c.isalnum())
+
+
+def venue_rows(rng, count):
+  for i in range(count):
+    city, state, _ = rng.choices(CITIES, cum_weights=CITY_WEIGHTS)[0]
+    name = f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(VENUE_KINDS)} {i + 1}'
+    seeking = rng.random() < 0.3
+    yield {
+      'name': name,
+      'city': city,
+      'state': state,
+      'address': f'{rng.randint(1, 2999)} {rng.choice(NOUNS)} Street',
+      'phone': _phone(rng),
+      'image_link': f'https://images.example.com/venues/{i + 1}.jpg',
+      'facebook_link': f'https://www.facebook.com/{_slug(name)}',
+      'website': f'https://www.{_slug(name)}.example.com',
+      'genres': _genres(rng),
+      'seeking_talent': seeking,
+      'seeking_description': 'Looking for local acts for weekend nights.' if seeking else None
+    }
+
+
+def artist_rows(rng, count):
+  for i in range(count):
+    city, state, _ = rng.choices(CITIES, cum_weights=CITY_WEIGHTS)[0]
+    name = f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}s {i + 1}'
+    seeking = rng.random() < 0.4
+    yield {
+      'name': name,
+      'city': city,
+      'state': state,
+      'phone': _phone(rng),
+      'genres': _genres(rng),
+      'image_link': f'https://images.example.com/artists/{i + 1}.jpg',
+      'facebook_link': f'https://www.facebook.com/{_slug(name)}',
+      'website': f'https://www.{_slug(name)}.example.com',
+      'seeking_venue': seeking,
+      'seeking_description': 'Touring next season, open to new venues.' if seeking else None
+    }
+
+
+def show_rows(rng, count, venue_ids, artist_ids, now):
+  # A few venues and artists get most of the shows
+  venue_weights = _weights(len(venue_ids), 1.1)
+  artist_weights = _weights(len(artist_ids), 1.1)
+  start = now - timedelta(days=PAST_DAYS)
+  for _ in range(count):
+    day = rng.randrange(PAST_DAYS + UPCOMING_DAYS)
+    yield {
+      'venue_id': rng.choices(venue_ids, cum_weights=venue_weights)[0],
+      'artist_id': rng.choices(artist_ids, cum_weights=artist_weights)[0],
+      'start_time': start + timedelta(days=day, hours=rng.choice((19, 20, 21, 22)), minutes=rng.choice((0, 30)))
+    }
+
+
+def _insert(model, rows, chunk_size):
+  inserted = 0
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) == chunk_size:
+      db.session.execute(model.__table__.insert(), chunk)
+      inserted += len(chunk)
+      chunk = []
+  if chunk:
+    db.session.execute(model.__table__.insert(), chunk)
+    inserted += len(chunk)
+  return inserted
+
+
+def seed(scale='small', seed=0, reset=False, chunk_size=None, now=None):
+  """Fill the database with reproducible synthetic venues, artists and shows.
+
+  `scale` names one of SCALES or is a (venues, artists, shows) tuple; shows
+  need venues and artists. The same scale and seed always produce the same rows; show times are
+  laid out relative to `now`, truncated to midnight. Returns the number
+  of rows inserted per table.
+  """
+  venues, artists, shows = SCALES[scale] if isinstance(scale, str) else scale
+  rng = random.Random(seed)
+  chunk_size = chunk_size or app.config['BULK_CHUNK_SIZE']
+  now = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+  if reset:
+    for model in (ShowArchive, Show, Venue, Artist):
+      db.session.query(model).delete(synchronize_session=False)
+  counts = {
+    'venues': _insert(Venue, venue_rows(rng, venues), chunk_size),
+    'artists': _insert(Artist, artist_rows(rng, artists), chunk_size)
+  }
+  venue_ids = [id for id, in db.session.query(Venue.id).order_by(Venue.id)]
+  artist_ids = [id for id, in db.session.query(Artist.id).order_by(Artist.id)]
+  # Popular venues and artists are spread over the whole id range
+  rng.shuffle(venue_ids)
+  rng.shuffle(artist_ids)
+  counts['shows'] = _insert(Show, show_rows(rng, shows, venue_ids, artist_ids, now), chunk_size)
+  mark_changed('all')
+  db.session.commit()
+
+  if app.config['UPCOMING_COUNTS_TABLE']:
+    refresh_upcoming_counts(full=True)
+  if app.config['SHOW_FACETS_TABLE']:
+    refresh_show_facets()
+  roll_show_partitions()
+  return counts